@@ -0,0 +1,5 @@
+"""Benchmarks for the throughput and latency of the SMTP server.
+
+Run the suite with `python -m benchmarks`, see `python -m benchmarks --help`
+for the options.
+"""
@@ -0,0 +1,354 @@
+"""Measures how quickly the server accepts connections and mail.
+
+Each scenario starts a server with `SMTPDFix` for a combination of the
+connection mode, authentication mechanism and message size. Local clients
+connect concurrently, first opening and closing connections, without
+authenticating, to measure the rate of connections and the time the server
+takes for each TLS handshake and the handshakes it completes each second,
+and then sending messages over a single connection each to measure the rate
+of messages and their latency.
+
+The results are written as JSON to `benchmarks/results/<version>.json` so
+that a run can be compared against the results of an earlier release with
+`--compare`. Running with `--loop uvloop --compare` the results of a run with
+the default loop shows the effect of the event loop on the same runner, and
+in the same way `--resume` shows the effect of clients resuming their TLS
+sessions when they reconnect.
+"""
+import argparse
+import json
+import math
+import platform
+import ssl
+import tempfile
+import time
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import product
+from pathlib import Path
+from smtplib import SMTP, SMTP_SSL, SMTPAuthenticationError
+from typing import (Any, Dict, Iterable, List, NamedTuple, Optional, Sequence,
+                    Tuple)
+
+from smtpdfix import AuthController, Config, SMTPDFix, __version__
+from smtpdfix.certs import _generate_certs
+from smtpdfix.loops import LOOP_TYPES
+
+MODES = ("plain", "ssl", "starttls")
+AUTH_MECHANISMS = ("none", "PLAIN", "LOGIN", "CRAM-MD5")
+SIZES = (1024, 64 * 1024, 1024 * 1024)
+RESULTS_DIR = Path(__file__).parent / "results"
+
+# The metrics where a larger value is an improvement, smaller values are
+# better for all of the others.
+HIGHER_IS_BETTER = ("messages_per_sec",
+                    "connections_per_sec",
+                    "handshakes_per_sec",
+                    "resumed_fraction")
+
+Results = Dict[str, Dict[str, float]]
+
+
+class Scenario(NamedTuple):
+    mode: str
+    auth: str
+    size: int
+
+    @property
+    def name(self) -> str:
+        return f"{self.mode}/{self.auth}/{self.size}"
+
+
+def _percentile(samples: Sequence[float], percent: float) -> float:
+    """Returns the percentile of the samples using the nearest rank."""
+    ordered = sorted(samples)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def _message(size: int) -> bytes:
+    """Returns a message of `size` bytes."""
+    header = (b"From: from.addr@example.org\r\n"
+              b"To: to.addr@example.org\r\n"
+              b"Subject: Benchmark\r\n\r\n")
+    line = b"x" * 76 + b"\r\n"
+    body_size = max(size - len(header), 0)
+    body = (line * (body_size // len(line) + 1))[:body_size]
+    return header + body
+
+
+class _ResumingContext():
+    """Wraps the sockets of a client with the TLS session of its previous
+    connection, so that the session is resumed rather than a full handshake
+    performed."""
+    def __init__(self, context: ssl.SSLContext) -> None:
+        self.context = context
+        self.session: Optional[ssl.SSLSession] = None
+
+    def wrap_socket(self, sock: Any, **kwargs: Any) -> ssl.SSLSocket:
+        return self.context.wrap_socket(sock, session=self.session, **kwargs)
+
+
+def _client_context() -> ssl.SSLContext:
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def _open(smtpd: AuthController, scenario: Scenario, context: Any) -> SMTP:
+    """Opens a connection to the server, negotiating TLS as required by the
+    scenario."""
+    client: SMTP
+    if scenario.mode == "ssl":
+        client = SMTP_SSL(smtpd.hostname, smtpd.port, context=context)
+    else:
+        client = SMTP(smtpd.hostname, smtpd.port)
+        if scenario.mode == "starttls":
+            client.starttls(context=context)
+    return client
+
+
+def _connect(smtpd: AuthController,
+             scenario: Scenario,
+             context: Any) -> SMTP:
+    """Opens a connection to the server, negotiating TLS and authenticating
+    as required by the scenario."""
+    client = _open(smtpd, scenario, context)
+    if scenario.auth != "none":
+        client.user = smtpd.config.login_username
+        client.password = smtpd.config.login_password
+        client.ehlo_or_helo_if_needed()
+        if scenario.auth == "PLAIN":
+            # The server expects the username and password for PLAIN to be
+            # separated by a space, as in the tests, rather than by NUL.
+            credentials = f"{client.user} {client.password}".encode()
+            code, resp = client.docmd(
+                "AUTH", f"PLAIN {b64encode(credentials).decode()}"
+            )
+            if code != 235:
+                raise SMTPAuthenticationError(code, resp)
+        elif scenario.auth == "LOGIN":
+            client.auth("LOGIN", client.auth_login)
+        else:
+            client.auth("CRAM-MD5", client.auth_cram_md5)
+    return client
+
+
+def _open_connections(smtpd: AuthController,
+                      scenario: Scenario,
+                      connections: int,
+                      context: ssl.SSLContext,
+                      resume: bool = False) -> None:
+    client_context = _ResumingContext(context) if resume else context
+    for _ in range(connections):
+        client = _open(smtpd, scenario, client_context)
+        # Reading the response to QUIT also receives any TLS 1.3 session
+        # tickets sent by the server
+        client.docmd("QUIT")
+        if isinstance(client_context, _ResumingContext) and \
+                isinstance(client.sock, ssl.SSLSocket):
+            client_context.session = client.sock.session
+        client.close()
+
+
+def _send_messages(smtpd: AuthController,
+                   scenario: Scenario,
+                   messages: int,
+                   context: ssl.SSLContext) -> List[float]:
+    content = _message(scenario.size)
+    latencies = []
+    with _connect(smtpd, scenario, context) as client:
+        for _ in range(messages):
+            start = time.perf_counter()
+            client.sendmail("from.addr@example.org",
+                            ["to.addr@example.org"],
+                            content)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_scenario(scenario: Scenario,
+                 clients: int = 4,
+                 connections: int = 10,
+                 messages: int = 20,
+                 cert_file: Optional[str] = None,
+                 event_loop: str = "asyncio",
+                 resume: bool = False) -> Dict[str, float]:
+    """Runs a single scenario with `clients` concurrent clients, each of which
+    opens `connections` connections and then sends `messages` messages, with
+    the server running on the `event_loop` type. With `resume` the clients
+    resume their TLS session when opening connections.
+
+    Raises:
+    - RuntimeError if the server did not receive all of the messages sent.
+    """
+    config = Config()
+    config.update(use_ssl=scenario.mode == "ssl",
+                  use_starttls=scenario.mode == "starttls",
+                  auth_require_tls=False,
+                  event_loop=event_loop)
+    if cert_file is not None:
+        config.ssl_cert_files = cert_file
+    context = _client_context()
+
+    with SMTPDFix(config=config) as smtpd, \
+            ThreadPoolExecutor(clients) as executor:
+        start = time.perf_counter()
+        list(executor.map(
+            lambda _: _open_connections(smtpd, scenario, connections, context,
+                                        resume),
+            range(clients)
+        ))
+        connect_time = time.perf_counter() - start
+        # The server times each handshake, from accepting the connection for
+        # implicit TLS or from the reply to STARTTLS, until it completes.
+        handshake_ms = smtpd.stats.handshake.mean * 1000
+        handshakes = smtpd.stats.tls_full + smtpd.stats.tls_resumed
+        resumed_fraction = (smtpd.stats.tls_resumed / handshakes
+                            if handshakes else 0.0)
+
+        start = time.perf_counter()
+        latencies = [
+            latency
+            for client_latencies in executor.map(
+                lambda _: _send_messages(smtpd, scenario, messages, context),
+                range(clients)
+            )
+            for latency in client_latencies
+        ]
+        send_time = time.perf_counter() - start
+
+        if len(smtpd.store) != clients * messages:
+            raise RuntimeError(f"{scenario.name}: {len(smtpd.store)} of "
+                               f"{clients * messages} messages received")
+
+    result = {
+        "messages_per_sec": clients * messages / send_time,
+        "connections_per_sec": clients * connections / connect_time,
+        "latency_p50_ms": _percentile(latencies, 50) * 1000,
+        "latency_p99_ms": _percentile(latencies, 99) * 1000,
+    }
+    if scenario.mode != "plain":
+        result["handshake_ms"] = handshake_ms
+        result["handshakes_per_sec"] = handshakes / connect_time
+        result["resumed_fraction"] = resumed_fraction
+    return result
+
+
+def run_suite(scenarios: Iterable[Scenario], **kwargs: Any) -> Results:
+    """Runs each of the scenarios, with the keyword arguments passed to
+    `run_scenario()`, returning the results keyed by the name of the
+    scenario."""
+    with tempfile.TemporaryDirectory() as path:
+        cert, _ = _generate_certs(Path(path))
+        return {
+            scenario.name: run_scenario(scenario,
+                                        cert_file=str(cert),
+                                        **kwargs)
+            for scenario in scenarios
+        }
+
+
+def compare(results: Results,
+            baseline: Results,
+            threshold: float = 0.1) -> List[str]:
+    """Returns a description of each metric that is worse than the same
+    metric in the baseline by more than the threshold, as a fraction of the
+    baseline."""
+    regressions = []
+    for name in sorted(results.keys() & baseline.keys()):
+        for metric in sorted(results[name].keys() & baseline[name].keys()):
+            new, old = results[name][metric], baseline[name][metric]
+            if metric in HIGHER_IS_BETTER:
+                regressed = new < old * (1 - threshold)
+            else:
+                regressed = new > old * (1 + threshold)
+            if regressed:
+                regressions.append(f"{name} {metric}: {old:.2f} -> {new:.2f}")
+    return regressions
+
+
+def _format(results: Results) -> str:
+    metrics = ("messages_per_sec", "connections_per_sec", "handshake_ms",
+               "handshakes_per_sec", "resumed_fraction", "latency_p50_ms",
+               "latency_p99_ms")
+    rows: List[Tuple[str, ...]] = [("scenario",) + metrics]
+    for name, result in results.items():
+        rows.append((name,) + tuple(
+            f"{result[metric]:.2f}" if metric in result else "-"
+            for metric in metrics
+        ))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join("  ".join(value.rjust(width)
+                               for value, width in zip(row, widths))
+                     for row in rows)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description=__doc__.split("\n")[0])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--auth", nargs="+", choices=AUTH_MECHANISMS,
+                        default=AUTH_MECHANISMS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES,
+                        help="the sizes of the messages in bytes")
+    parser.add_argument("--clients", type=int, default=4,
+                        help="the number of concurrent clients")
+    parser.add_argument("--connections", type=int, default=10,
+                        help="the connections opened by each client")
+    parser.add_argument("--messages", type=int, default=20,
+                        help="the messages sent by each client")
+    parser.add_argument("--loop", choices=LOOP_TYPES, default="asyncio",
+                        help="the event loop the server runs on")
+    parser.add_argument("--resume", action="store_true",
+                        help="clients resume their TLS sessions when they "
+                             "reconnect")
+    parser.add_argument("--quick", action="store_true",
+                        help="a short run with only the smallest messages")
+    parser.add_argument("--output", type=Path,
+                        default=RESULTS_DIR / f"{__version__}.json",
+                        help="the file the results are written to")
+    parser.add_argument("--compare", type=Path, metavar="BASELINE",
+                        help="results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="the fraction by which a metric can be worse "
+                             "than the baseline before it is reported")
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes[:1] if args.quick else args.sizes
+    connections, messages = ((2, 5) if args.quick
+                             else (args.connections, args.messages))
+    # Read the baseline first in case the results are written over it
+    baseline = (json.loads(args.compare.read_text())["results"]
+                if args.compare is not None else None)
+    scenarios = [Scenario(*values)
+                 for values in product(args.modes, args.auth, sizes)]
+    results = run_suite(scenarios,
+                        clients=args.clients,
+                        connections=connections,
+                        messages=messages,
+                        event_loop=args.loop,
+                        resume=args.resume)
+    print(_format(results))
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps({
+        "version": __version__,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "event_loop": args.loop,
+        "resume": args.resume,
+        "date": datetime.now(timezone.utc).isoformat(),
+        "results": results,
+    }, indent=2))
+    print(f"Results written to {args.output}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
@@ -1,15 +1,27 @@
 __all__ = (
+    "async_smtpd",
+    "AsyncAuthController",
     "AuthController",
     "Authenticator",
     "AuthMessage",
     "Config",
+    "CredentialStore",
+    "Delay",
+    "Listener",
+    "MailExport",
     "smtpd",
+    "smtpd_session",
+    "smtpd_shared",
     "SMTPDFix",
+    "WorkerController",
 )
 __version__ = "0.5.3"
 
-from .authenticator import Authenticator
+from .authenticator import Authenticator, CredentialStore
 from .configuration import Config
-from .controller import AuthController
-from .fixture import SMTPDFix, smtpd
+from .controller import AsyncAuthController, AuthController, Listener
+from .export import MailExport
+from .fixture import SMTPDFix, async_smtpd, smtpd, smtpd_session, smtpd_shared
 from .handlers import AuthMessage
+from .latency import Delay
+from .workers import WorkerController
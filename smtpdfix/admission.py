@@ -0,0 +1,202 @@
+import random
+import time
+from collections import defaultdict
+from typing import (TYPE_CHECKING, Any, DefaultDict, Dict, Mapping, NamedTuple,
+                    Optional, Tuple, Union)
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .configuration import Config
+
+RATE_LIMIT_KEYS: Tuple[str, ...] = ("connection", "user")
+
+TOO_MANY_SESSIONS = "421 4.7.0 Too many connections, try again later"
+RATE_LIMITED = "451 4.7.1 Rate limit exceeded, try again later"
+NOT_AVAILABLE = "421 4.3.2 Service not available, try again later"
+TEMPORARY_FAILURE = "4.3.0 Temporary failure, try again later"
+
+
+class Failure(NamedTuple):
+    """Temporary failures of a command, either with a `probability` between 0
+    and 1 or, if `every` is set, deterministically for every nth command
+    received by the server. A `code` of 421 closes the connection after the
+    response."""
+    probability: float = 0.0
+    every: int = 0
+    code: int = 451
+
+
+FailureType = Union[Failure, str, float]
+
+
+def _parse_failure(value: FailureType) -> Failure:
+    """Converts a probability, or a string in the form
+    `probability[:code]` or `every:n[:code]`, such as `0.1` or `every:3:421`,
+    to a failure.
+
+    Raises:
+    - ValueError if the value isn't a valid failure.
+    """
+    if isinstance(value, Failure):
+        failure = value
+    elif isinstance(value, str):
+        parts = value.strip().split(":")
+        every = parts[0].lower() == "every"
+        if every:
+            parts.pop(0)
+        if not 1 <= len(parts) <= 2:
+            raise ValueError(f"invalid failure {value}, expected "
+                             f"probability[:code] or every:n[:code]")
+        code = int(parts[1]) if len(parts) == 2 else 451
+        failure = (Failure(every=int(parts[0]), code=code) if every
+                   else Failure(probability=float(parts[0]), code=code))
+    else:
+        failure = Failure(probability=float(value))
+
+    if not 0 <= failure.probability <= 1 or failure.every < 0:
+        raise ValueError(f"invalid failure {value}, the probability must be "
+                         f"between 0 and 1 and every not negative")
+    if failure.code not in (421, 450, 451, 452):
+        raise ValueError(f"invalid failure {value}, the code must be one of "
+                         f"421, 450, 451 or 452")
+    return failure
+
+
+def _parse_failures(
+    value: Union[str, Mapping[str, FailureType], None]
+) -> Dict[str, Failure]:
+    """Converts a mapping of commands to failures, or a string in the form
+    `COMMAND=failure,...`, such as `MAIL=0.1,GREETING=every:10`, to a
+    dictionary of failures keyed by the upper case command.
+
+    Raises:
+    - ValueError if an item isn't a valid failure.
+    """
+    if not value:
+        return {}
+
+    items: Any
+    if isinstance(value, str):
+        items = []
+        for item in value.split(","):
+            command, sep, failure = item.partition("=")
+            if not sep:
+                raise ValueError(f"invalid failure {item}, expected "
+                                 f"COMMAND=failure")
+            items.append((command, failure))
+    else:
+        items = value.items()
+    return {command.strip().upper(): _parse_failure(failure)
+            for command, failure in items}
+
+
+class TokenBucket():
+    """Allows up to `burst` messages at once, refilled at `rate` messages a
+    second."""
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: int) -> None:
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self, rate: float, burst: int) -> bool:
+        """Takes a token, returning False if there are none left."""
+        now = time.monotonic()
+        self.tokens = min(float(burst),
+                          self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class AdmissionControl():
+    """Decides whether the sessions of a server are admitted and their
+    commands accepted, using the limits set by the config, so that clients
+    can be tested against a server that applies backpressure.
+
+    The settings are read from the config as they're needed so changes apply
+    to the sessions already open.
+
+    - `sessions`: the number of sessions admitted and still open.
+    - `rejected`: the number of sessions refused because too many were open.
+    - `rate_limited`: the number of MAIL commands refused by the rate limit.
+    - `failures`: the number of temporary failures injected, by command.
+    """
+    def __init__(self, config: "Config") -> None:
+        self.config = config
+        self.sessions = 0
+        self.reset()
+
+    def reset(self) -> None:
+        """Sets the counters back to zero and refills the rate limits of the
+        users. The sessions still open remain counted."""
+        self.rejected = 0
+        self.rate_limited = 0
+        self.failures: DefaultDict[str, int] = defaultdict(int)
+        self._counts: DefaultDict[str, int] = defaultdict(int)
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def open(self) -> bool:
+        """Counts a new session, returning False if it isn't admitted."""
+        if self.config.max_sessions and \
+                self.sessions >= self.config.max_sessions:
+            self.rejected += 1
+            return False
+        self.sessions += 1
+        return True
+
+    def close(self) -> None:
+        """Counts a session that was admitted closing."""
+        self.sessions -= 1
+
+    def bucket(self) -> TokenBucket:
+        """Returns a new bucket holding the burst of messages allowed."""
+        return TokenBucket(self.config.message_burst)
+
+    def greeting(self, admitted: bool) -> Optional[str]:
+        """Returns the response refusing a new session, or None to greet the
+        client."""
+        if not admitted:
+            return TOO_MANY_SESSIONS
+        if self._fails("GREETING"):
+            return NOT_AVAILABLE
+        return None
+
+    def check(self,
+              command: str,
+              bucket: TokenBucket,
+              user: Optional[str] = None) -> Optional[str]:
+        """Returns the response refusing the command, or None to accept it.
+        Messages are counted against the bucket for the connection or, if
+        limited by user, the bucket for the user."""
+        if self._fails(command):
+            code = self.config.failures[command].code
+            if code == 421:
+                return NOT_AVAILABLE
+            return f"{code} {TEMPORARY_FAILURE}"
+
+        rate = self.config.message_rate
+        if command == "MAIL" and rate:
+            if self.config.rate_limit_by == "user" and user is not None:
+                if user not in self._buckets:
+                    self._buckets[user] = self.bucket()
+                bucket = self._buckets[user]
+            if not bucket.take(rate, self.config.message_burst):
+                self.rate_limited += 1
+                return RATE_LIMITED
+        return None
+
+    def _fails(self, command: str) -> bool:
+        failure = self.config.failures.get(command)
+        if failure is None:
+            return False
+
+        if failure.every:
+            self._counts[command] += 1
+            failed = self._counts[command] % failure.every == 0
+        else:
+            failed = random.random() < failure.probability
+        if failed:
+            self.failures[command] += 1
+        return failed
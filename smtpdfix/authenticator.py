@@ -1,4 +1,7 @@
+import hmac
 from abc import ABCMeta, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, Iterator, Mapping, Optional, Union
 
 
 class Authenticator(metaclass=ABCMeta):
@@ -25,3 +28,109 @@ class Authenticator(metaclass=ABCMeta):
     def get_password(self, username: str) -> str:
         """Returns the password for a given username."""
         raise NotImplementedError()  # pragma: no cover
+
+    def cram_md5(self, username: str) -> Optional[hmac.HMAC]:
+        """Returns a HMAC-MD5 keyed with the password of the username, to be
+        updated with the CRAM-MD5 challenge, or None if the username is
+        unknown.
+
+        By default the key is derived from `get_password()` on every AUTH,
+        override to reuse keys computed in advance.
+        """
+        return hmac.new(self.get_password(username).encode(), digestmod="md5")
+
+
+class CredentialStore(Authenticator):
+    """An authenticator for any number of users, each with their own
+    password, so that a single server can be used by clients authenticating
+    as many distinct users.
+
+    Users are held in a dictionary so looking them up takes the same time
+    however many there are, and the HMAC key used for CRAM-MD5 is computed
+    for each user when they are added rather than on every AUTH.
+
+    Example:
+        credentials = CredentialStore({"alice": "secret", "bob": "hunter2"})
+        with SMTPDFix(authenticator=credentials) as smtpd:
+            ...
+    """
+    def __init__(self,
+                 credentials: Optional[Mapping[str, str]] = None) -> None:
+        self._passwords: Dict[str, str] = {}
+        self._cram_md5: Dict[str, hmac.HMAC] = {}
+        if credentials is not None:
+            self.update(credentials)
+
+    @classmethod
+    def from_file(cls,
+                  path: Union[str, Path],
+                  encoding: str = "utf-8") -> "CredentialStore":
+        """Loads the users from a file with a `username:password` pair on
+        each line. Blank lines and lines starting with `#` are ignored.
+
+        Raises:
+        - ValueError if a line doesn't contain a username and password.
+        """
+        store = cls()
+        with open(path, encoding=encoding) as file_:
+            for number, line in enumerate(file_, start=1):
+                line = line.rstrip("\r\n")
+                if not line.strip() or line.lstrip().startswith("#"):
+                    continue
+                username, sep, password = line.partition(":")
+                if not sep or not username:
+                    raise ValueError(f"{path}:{number} is not in the form "
+                                     f"username:password")
+                store.add(username, password)
+        return store
+
+    def add(self, username: str, password: str) -> None:
+        """Adds a user, or replaces the password of an existing user."""
+        self._passwords[username] = password
+        self._cram_md5[username] = hmac.new(password.encode(),
+                                            digestmod="md5")
+
+    def update(self, credentials: Mapping[str, str]) -> None:
+        """Adds the users in a mapping of usernames to passwords."""
+        for username, password in credentials.items():
+            self.add(username, password)
+
+    def remove(self, username: str) -> None:
+        """Removes a user.
+
+        Raises:
+        - KeyError if the user doesn't exist.
+        """
+        del self._passwords[username]
+        del self._cram_md5[username]
+
+    def validate(self, username: str, password: str) -> bool:
+        expected = self._passwords.get(username)
+        if expected is None:
+            return False
+        return hmac.compare_digest(expected.encode(), password.encode())
+
+    def verify(self, username: str) -> bool:
+        return username in self._passwords
+
+    def get_password(self, username: str) -> str:
+        """Returns the password for the username.
+
+        Raises:
+        - KeyError if the user doesn't exist.
+        """
+        return self._passwords[username]
+
+    def cram_md5(self, username: str) -> Optional[hmac.HMAC]:
+        key = self._cram_md5.get(username)
+        # The key is copied so that it can be reused by other sessions
+        return key.copy() if key is not None else None
+
+    def __contains__(self, username: Any) -> bool:
+        return username in self._passwords
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._passwords)
+
+    def __len__(self) -> int:
+        return len(self._passwords)
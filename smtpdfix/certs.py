@@ -1,27 +1,126 @@
+import hashlib
 import logging
+import os
 import socket
+import time
 from collections import namedtuple
 from datetime import datetime, timedelta, timezone
 from ipaddress import ip_address
 from pathlib import Path
-from typing import Union
+from types import TracebackType
+from typing import List, Optional, Type, Union
 
 from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.hazmat.primitives.asymmetric.types import \
+    CertificateIssuerPrivateKeyTypes
 from cryptography.x509 import (BasicConstraints, CertificateBuilder, DNSName,
-                               IPAddress, Name, NameAttribute,
-                               SubjectAlternativeName, random_serial_number)
+                               GeneralName, IPAddress, Name, NameAttribute,
+                               SubjectAlternativeName,
+                               load_pem_x509_certificate, random_serial_number)
 from cryptography.x509.oid import NameOID
 
 log = logging.getLogger(__name__)
 
 Cert = namedtuple("Cert", ["cert", "key"], defaults=[None, None])
 
+KEY_TYPES = ("rsa", "ec", "ed25519")
+
+
+class _FileLock():
+    """A lock held by exclusively creating a file so that separate processes,
+    such as pytest-xdist workers, don't generate the same certificate at the
+    same time.
+
+    A lock file older than `stale` seconds is assumed to have been left by a
+    process that crashed and is removed.
+    """
+    def __init__(self,
+                 path: Union[Path, str],
+                 timeout: float = 60.0,
+                 stale: float = 120.0) -> None:
+        self.path = Path(path)
+        self.timeout = timeout
+        self.stale = stale
+
+    def __enter__(self) -> "_FileLock":
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.close(fd)
+                return self
+            except FileExistsError:
+                pass
+
+            try:
+                age = time.time() - self.path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if age > self.stale:
+                log.info(f"Removing stale lock {self.path}")
+                self.path.unlink(missing_ok=True)
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Timed out waiting for lock {self.path}")
+            time.sleep(0.05)
+
+    def __exit__(self,
+                 type: Optional[Type[BaseException]],
+                 value: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+def _alt_names(hostname: str) -> List[GeneralName]:
+    """Returns the subject alternative names for the certificate."""
+    alt_names: List[GeneralName] = [
+        DNSName("localhost"),
+        DNSName("localhost.localdomain"),
+        DNSName(hostname),
+        IPAddress(ip_address("127.0.0.1")),
+        IPAddress(ip_address("0.0.0.1")),
+        IPAddress(ip_address("::1")),
+    ]
+
+    # Because on misconfigured systems it's possible to have a hostname that
+    # doesn't resolve to an IP we catch the error and skip adding it to the
+    # list of altnames. (issue #195)
+    try:
+        ip = socket.gethostbyname(hostname)
+        alt_names.append(IPAddress(ip_address(ip)))
+    except socket.gaierror as err:
+        log.info(f"{hostname} failed to resolve to ip")
+        log.error(err.strerror)
+
+    return alt_names
+
+
+def _generate_key(
+    key_type: str = "rsa",
+    key_size: int = 2048
+) -> CertificateIssuerPrivateKeyTypes:
+    """Generate a private key of the type, one of "rsa", "ec" (using the P-256
+    curve), or "ed25519". The key size only applies to RSA keys."""
+    if key_type == "rsa":
+        # 2048 is the minimum that works as of 3.9
+        return rsa.generate_private_key(public_exponent=65537,
+                                        key_size=key_size)
+    if key_type == "ec":
+        return ec.generate_private_key(ec.SECP256R1())
+    if key_type == "ed25519":
+        return ed25519.Ed25519PrivateKey.generate()
+
+    raise ValueError(f"Unsupported key type {key_type}, "
+                     f"expected one of {', '.join(KEY_TYPES)}")
+
 
 def _generate_certs(path: Union[Path, str],
                     days: int = 365,
                     key_size: int = 2048,
-                    separate_key: bool = False) -> Cert:
+                    separate_key: bool = False,
+                    alt_names: Optional[List[GeneralName]] = None,
+                    key_type: str = "rsa") -> Cert:
     """DO NOT USE THIS FOR ANYTHING PRODUCTION RELATED, EVER!
 
     Params:
@@ -30,6 +129,11 @@ def _generate_certs(path: Union[Path, str],
     - key_size: an `int` representing the byte size of the key.
     - separate_key: a `bool` representing whether the private key should be
       written to a separate file.
+    - alt_names: a `list` of the subject alternative names, if `None` the
+      names for the local host are used.
+    - key_type: a `str` of the type of key to generate, one of "rsa", "ec" or
+      "ed25519". EC and Ed25519 keys are much faster to generate and to use
+      in handshakes than RSA keys.
 
     Returns:
     - By default returns a `tuple` with a `Path` to the certificate file
@@ -44,39 +148,28 @@ def _generate_certs(path: Union[Path, str],
     """
     # DO NOT USE THIS FOR ANYTHING PRODUCTION RELATED, EVER!
     # Generate private key
-    # 2048 is the minimum that works as of 3.9
-    key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    key = _generate_key(key_type, key_size)
+    # Ed25519 keys can't be written in the traditional OpenSSL format
+    key_format = (serialization.PrivateFormat.PKCS8
+                  if key_type == "ed25519"
+                  else serialization.PrivateFormat.TraditionalOpenSSL)
     key_file = "key.pem" if separate_key else "cert.pem"
     key_path = Path(path).joinpath(key_file)
     with open(key_path, "ab") as f:
         f.write(key.private_bytes(
             encoding=serialization.Encoding.PEM,
             encryption_algorithm=serialization.NoEncryption(),
-            format=serialization.PrivateFormat.TraditionalOpenSSL
+            format=key_format
         ))
     log.debug("Private key generated")
 
     # Generate public certificate
-    hostname = socket.gethostname()
     subject = Name([NameAttribute(NameOID.COMMON_NAME, "smtpdfix_cert")])
-    alt_names = [
-        DNSName("localhost"),
-        DNSName("localhost.localdomain"),
-        DNSName(hostname),
-        IPAddress(ip_address("127.0.0.1")),
-        IPAddress(ip_address("0.0.0.1")),
-        IPAddress(ip_address("::1")),
-    ]
+    if alt_names is None:
+        alt_names = _alt_names(socket.gethostname())
 
-    # Because on misconfigured systems it's possible to have a hostname that
-    # doesn't resolve to an IP we catch the error and skip adding it to the
-    # list of altnames. (issue #195)
-    try:
-        ip = socket.gethostbyname(hostname)
-        alt_names.append(IPAddress(ip_address(ip)))
-    except socket.gaierror as err:
-        log.info(f"{hostname} failed to resolve to ip")
-        log.error(err.strerror)
+    # Ed25519 keys have a fixed hash algorithm and require None
+    algorithm = None if key_type == "ed25519" else hashes.SHA256()
 
     # Set it so the certificate can be a root certificate with
     # ca=true, path_length=0 means it can only sign itself.
@@ -91,7 +184,7 @@ def _generate_certs(path: Union[Path, str],
             .add_extension(SubjectAlternativeName(alt_names), critical=False)
             .public_key(key.public_key())
             .add_extension(constraints, critical=False)
-            .sign(private_key=key, algorithm=hashes.SHA256()))
+            .sign(private_key=key, algorithm=algorithm))
 
     cert_path = Path(path).joinpath("cert.pem")
     with open(cert_path, "ab") as f:
@@ -99,3 +192,58 @@ def _generate_certs(path: Union[Path, str],
     log.debug("Certificate generated")
 
     return Cert(cert_path, [key_path if separate_key else None])
+
+
+def _cert_is_valid(cert_path: Path, min_days: int) -> bool:
+    """Check that the file holds a private key and a certificate that will be
+    valid for at least `min_days`."""
+    try:
+        data = cert_path.read_bytes()
+        cert = load_pem_x509_certificate(data)
+    except (OSError, ValueError):
+        return False
+
+    expires = cert.not_valid_after_utc
+    remaining = expires - datetime.now(timezone.utc)
+    return b"PRIVATE KEY" in data and remaining > timedelta(days=min_days)
+
+
+def _cached_certs(cache_dir: Union[Path, str],
+                  days: int = 365,
+                  key_size: int = 2048,
+                  min_days: int = 1,
+                  key_type: str = "rsa") -> Cert:
+    """Returns a certificate, with the key in the same file, from the cache
+    directory, generating it only if it is missing or expires within
+    `min_days`.
+
+    Certificates are stored by the hostname, subject alternative names, key
+    type and key size so that changes to any of these result in a new
+    certificate. Concurrent processes share a single certificate rather than
+    each generating their own.
+    """
+    hostname = socket.gethostname()
+    alt_names = _alt_names(hostname)
+    names = sorted(str(name.value) for name in alt_names)
+    key = "|".join([hostname, *names, f"{key_type}-{key_size}"])
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+
+    path = Path(cache_dir).joinpath(digest)
+    path.mkdir(parents=True, exist_ok=True)
+    cert_path = path.joinpath("cert.pem")
+
+    with _FileLock(path.joinpath(".lock")):
+        if _cert_is_valid(cert_path, min_days):
+            log.debug(f"Using cached certificate {cert_path}")
+            return Cert(cert_path, None)
+
+        # The certificate and key are appended to the file so it needs to be
+        # removed before generating a new one.
+        cert_path.unlink(missing_ok=True)
+        cert, _ = _generate_certs(path,
+                                  days,
+                                  key_size,
+                                  alt_names=alt_names,
+                                  key_type=key_type)
+        # The key is in the certificate file whether or not it was cached
+        return Cert(cert, None)
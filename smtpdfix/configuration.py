@@ -1,11 +1,20 @@
+import hashlib
 import logging
 import os
+from contextlib import contextmanager
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, Optional, Tuple, Union
+from typing import (TYPE_CHECKING, Any, Dict, Iterator, Mapping, Optional,
+                    Tuple, Union)
 
-import portpicker
+from aiosmtpd.smtp import DATA_SIZE_DEFAULT
 
+from .admission import RATE_LIMIT_KEYS, Failure, FailureType, _parse_failures
+from .certs import KEY_TYPES
 from .event_handler import EventHandler
+from .export import EXPORT_FORMATS
+from .latency import Delay, DelayType, _parse_delays, _parse_optional_delay
+from .loops import LOOP_TYPES
+from .store import STORE_TYPES
 
 log = logging.getLogger(__name__)
 
@@ -42,11 +51,12 @@ class Config():
     def __init__(self) -> None:
         # Sets an event handler on the object
         self.OnChanged = EventHandler()
+        self._batch_depth = 0
+        self._batch_changed = False
 
         self._host: Optional[str] = os.getenv("SMTPD_HOST", "localhost")
-        self._port = int(
-            os.getenv("SMTPD_PORT", portpicker.pick_unused_port())
-        )
+        # Port 0 binds to a free port chosen by the OS when the server starts
+        self._port = int(os.getenv("SMTPD_PORT", 0))
         self._ready_timeout = float(os.getenv("SMTPD_READY_TIMEOUT", 10.0))
         self._login_username = os.getenv("SMTPD_LOGIN_NAME", "user")
         self._login_password = os.getenv("SMTPD_LOGIN_PASSWORD", "password")
@@ -56,10 +66,56 @@ class Config():
                                                       "True"))
         self._ssl_cert_files = (os.getenv("SMTPD_SSL_CERTIFICATE_FILE"),
                                 os.getenv("SMTPD_SSL_KEY_FILE"))
+        self._cert_key_type = self._check_choice(
+            os.getenv("SMTPD_CERT_KEY_TYPE", "rsa"), KEY_TYPES
+        )
         self._use_starttls = _strtobool(os.getenv("SMTPD_USE_STARTTLS",
                                                   "False"))
         self._use_ssl = (_strtobool(os.getenv("SMTPD_USE_SSL", "False"))
                          or _strtobool(os.getenv("SMTPD_USE_TLS", "False")))
+        self._message_store = self._check_choice(
+            os.getenv("SMTPD_MESSAGE_STORE", "memory"), STORE_TYPES
+        )
+        self._spool_max_memory = int(os.getenv("SMTPD_SPOOL_MAX_MEMORY",
+                                               2**24))
+        self._sink_digest = self._check_digest(os.getenv("SMTPD_SINK_DIGEST"))
+        self._event_loop = self._check_choice(
+            os.getenv("SMTPD_EVENT_LOOP", "asyncio"), LOOP_TYPES
+        )
+        self._delays = _parse_delays(os.getenv("SMTPD_DELAYS"))
+        self._read_bandwidth = int(os.getenv("SMTPD_READ_BANDWIDTH", 0))
+        self._handshake_delay = _parse_optional_delay(
+            os.getenv("SMTPD_HANDSHAKE_DELAY")
+        )
+        self._max_sessions = int(os.getenv("SMTPD_MAX_SESSIONS", 0))
+        self._message_rate = float(os.getenv("SMTPD_MESSAGE_RATE", 0))
+        self._message_burst = int(os.getenv("SMTPD_MESSAGE_BURST", 1))
+        self._rate_limit_by = self._check_choice(
+            os.getenv("SMTPD_RATE_LIMIT_BY", "connection"), RATE_LIMIT_KEYS
+        )
+        self._failures = _parse_failures(os.getenv("SMTPD_FAILURES"))
+        self._backlog = int(os.getenv("SMTPD_BACKLOG", 100))
+        self._reuse_port = _strtobool(os.getenv("SMTPD_REUSE_PORT", "False"))
+        self._handshake_timeout = float(os.getenv("SMTPD_HANDSHAKE_TIMEOUT",
+                                                  5.0))
+        self._session_timeout = float(os.getenv("SMTPD_SESSION_TIMEOUT",
+                                                300.0))
+        self._data_size_limit = int(os.getenv("SMTPD_DATA_SIZE_LIMIT",
+                                              DATA_SIZE_DEFAULT))
+        self._command_call_limit = self._check_call_limit(
+            os.getenv("SMTPD_COMMAND_CALL_LIMIT")
+        )
+        self._tls_session_tickets = int(
+            os.getenv("SMTPD_TLS_SESSION_TICKETS", 2)
+        )
+        self._export_path = os.getenv("SMTPD_EXPORT_PATH") or None
+        self._export_format = self._check_choice(
+            os.getenv("SMTPD_EXPORT_FORMAT", "mbox"), EXPORT_FORMATS
+        )
+        self._export_batch_size = int(os.getenv("SMTPD_EXPORT_BATCH_SIZE",
+                                                100))
+        self._export_rotate_bytes = int(os.getenv("SMTPD_EXPORT_ROTATE_BYTES",
+                                                  0))
         # Check to ensure that the _ssl_cert_files are either none or resolve
         assert self._check_cert_files()
 
@@ -80,6 +136,110 @@ class Config():
                 raise FileNotFoundError
         return True
 
+    def __getstate__(self) -> Dict[str, Any]:
+        # The handlers for OnChanged aren't pickled so that the config can be
+        # passed to other processes.
+        state = self.__dict__.copy()
+        del state["OnChanged"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.OnChanged = EventHandler()
+
+    def _check_choice(self, value: str, choices: Tuple[str, ...]) -> str:
+        """Check that the value is one of the choices, ignoring case.
+
+        Raises:
+        - ValueError if the value is not one of the choices.
+        """
+        choice = str(value).lower()
+        if choice not in choices:
+            raise ValueError(f"invalid value {value}, "
+                             f"expected one of {', '.join(choices)}")
+        return choice
+
+    def _check_digest(self, value: Optional[str]) -> Optional[str]:
+        """Check that the value is the name of a hashlib algorithm, or empty
+        for no digest.
+
+        Raises:
+        - ValueError if the algorithm is not available.
+        """
+        if not value:
+            return None
+
+        name = str(value).lower()
+        if name not in hashlib.algorithms_available:
+            raise ValueError(f"invalid value {value}, expected the name of "
+                             f"a hashlib algorithm")
+        return name
+
+    def _check_call_limit(
+        self,
+        value: Union[int, str, Mapping[str, int], None]
+    ) -> Union[int, Dict[str, int], None]:
+        """Converts the limit on the number of times each command can be
+        called in a session to a number, or a dictionary of numbers keyed by
+        the upper case command with `*` for the other commands. A string in
+        the form `COMMAND=n,...`, such as `MAIL=10,*=20`, is also accepted.
+        Empty values are no limit.
+
+        Raises:
+        - ValueError if the value isn't a valid limit.
+        """
+        if value is None or value == "":
+            return None
+        if isinstance(value, int):
+            return value
+        if isinstance(value, str):
+            if "=" not in value:
+                return int(value)
+            items = [item.partition("=")[::2] for item in value.split(",")]
+            value = {command: int(limit) for command, limit in items}
+        return {command.strip().upper(): int(limit)
+                for command, limit in value.items()}
+
+    def _changed(self) -> None:
+        """Fire the OnChanged event, or if in a batch defer it until the batch
+        is complete."""
+        if self._batch_depth:
+            self._batch_changed = True
+        else:
+            self.OnChanged()
+
+    @contextmanager
+    def batch(self) -> Iterator["Config"]:
+        """Group changes to the configuration so that OnChanged fires once
+        when the batch completes rather than for each change. Batches can be
+        nested, in which case the event fires when the outermost completes.
+
+        Example:
+            with smtpd.config.batch() as config:
+                config.use_starttls = True
+                config.enforce_auth = True
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._batch_changed:
+                self._batch_changed = False
+                self.OnChanged()
+
+    def update(self, **kwargs: Any) -> None:
+        """Set several properties at once, firing OnChanged only once.
+
+        Raises:
+        - AttributeError if a keyword is not a property of the config.
+        """
+        with self.batch():
+            for name, value in kwargs.items():
+                if not isinstance(getattr(type(self), name, None), property):
+                    raise AttributeError(f"Config has no property {name}")
+                setattr(self, name, value)
+
     def convert_to_bool(self, value: Any) -> bool:
         """Consistently convert to bool."""
         if isinstance(value, str):
@@ -93,7 +253,7 @@ class Config():
     @host.setter
     def host(self, value: Optional[str]) -> None:
         self._host = value
-        self.OnChanged()
+        self._changed()
 
     @property
     def port(self) -> int:
@@ -102,7 +262,7 @@ class Config():
     @port.setter
     def port(self, value: int) -> None:
         self._port = int(value)
-        self.OnChanged()
+        self._changed()
 
     @property
     def ready_timeout(self) -> float:
@@ -111,7 +271,7 @@ class Config():
     @ready_timeout.setter
     def ready_timeout(self, value: float) -> None:
         self._ready_timeout = float(value)
-        self.OnChanged()
+        self._changed()
 
     @property
     def login_username(self) -> str:
@@ -120,7 +280,7 @@ class Config():
     @login_username.setter
     def login_username(self, value: str) -> None:
         self._login_username = value
-        self.OnChanged()
+        self._changed()
 
     @property
     def login_password(self) -> str:
@@ -129,7 +289,7 @@ class Config():
     @login_password.setter
     def login_password(self, value: str) -> None:
         self._login_password = value
-        self.OnChanged()
+        self._changed()
 
     @property
     def enforce_auth(self) -> bool:
@@ -138,7 +298,7 @@ class Config():
     @enforce_auth.setter
     def enforce_auth(self, value: bool) -> None:
         self._enforce_auth = self.convert_to_bool(value)
-        self.OnChanged()
+        self._changed()
 
     @property
     def auth_require_tls(self) -> bool:
@@ -147,7 +307,7 @@ class Config():
     @auth_require_tls.setter
     def auth_require_tls(self, value: bool) -> None:
         self._auth_require_tls = self.convert_to_bool(value)
-        self.OnChanged()
+        self._changed()
 
     @property
     def ssl_cert_files(self) -> Tuple[Optional[str], Optional[str]]:
@@ -161,7 +321,16 @@ class Config():
         else:
             self._ssl_cert_files = (value, None)
         assert self._check_cert_files()
-        self.OnChanged()
+        self._changed()
+
+    @property
+    def cert_key_type(self) -> str:
+        return self._cert_key_type
+
+    @cert_key_type.setter
+    def cert_key_type(self, value: str) -> None:
+        self._cert_key_type = self._check_choice(value, KEY_TYPES)
+        self._changed()
 
     @property
     def use_starttls(self) -> bool:
@@ -170,7 +339,7 @@ class Config():
     @use_starttls.setter
     def use_starttls(self, value: Any) -> None:
         self._use_starttls = self.convert_to_bool(value)
-        self.OnChanged()
+        self._changed()
 
     @property
     def use_ssl(self) -> bool:
@@ -179,4 +348,215 @@ class Config():
     @use_ssl.setter
     def use_ssl(self, value: Any) -> None:
         self._use_ssl = self.convert_to_bool(value)
-        self.OnChanged()
+        self._changed()
+
+    @property
+    def message_store(self) -> str:
+        return self._message_store
+
+    @message_store.setter
+    def message_store(self, value: str) -> None:
+        self._message_store = self._check_choice(value, STORE_TYPES)
+        self._changed()
+
+    @property
+    def spool_max_memory(self) -> int:
+        return self._spool_max_memory
+
+    @spool_max_memory.setter
+    def spool_max_memory(self, value: int) -> None:
+        self._spool_max_memory = int(value)
+        self._changed()
+
+    @property
+    def sink_digest(self) -> Optional[str]:
+        return self._sink_digest
+
+    @sink_digest.setter
+    def sink_digest(self, value: Optional[str]) -> None:
+        self._sink_digest = self._check_digest(value)
+        self._changed()
+
+    @property
+    def event_loop(self) -> str:
+        return self._event_loop
+
+    @event_loop.setter
+    def event_loop(self, value: str) -> None:
+        self._event_loop = self._check_choice(value, LOOP_TYPES)
+        self._changed()
+
+    @property
+    def delays(self) -> Dict[str, Delay]:
+        return self._delays
+
+    @delays.setter
+    def delays(self, value: Union[str, Mapping[str, DelayType], None]) -> None:
+        self._delays = _parse_delays(value)
+        self._changed()
+
+    @property
+    def read_bandwidth(self) -> int:
+        return self._read_bandwidth
+
+    @read_bandwidth.setter
+    def read_bandwidth(self, value: int) -> None:
+        self._read_bandwidth = int(value)
+        self._changed()
+
+    @property
+    def handshake_delay(self) -> Optional[Delay]:
+        return self._handshake_delay
+
+    @handshake_delay.setter
+    def handshake_delay(self, value: Optional[DelayType]) -> None:
+        self._handshake_delay = _parse_optional_delay(value)
+        self._changed()
+
+    @property
+    def max_sessions(self) -> int:
+        return self._max_sessions
+
+    @max_sessions.setter
+    def max_sessions(self, value: int) -> None:
+        self._max_sessions = int(value)
+        self._changed()
+
+    @property
+    def message_rate(self) -> float:
+        return self._message_rate
+
+    @message_rate.setter
+    def message_rate(self, value: float) -> None:
+        self._message_rate = float(value)
+        self._changed()
+
+    @property
+    def message_burst(self) -> int:
+        return self._message_burst
+
+    @message_burst.setter
+    def message_burst(self, value: int) -> None:
+        self._message_burst = int(value)
+        self._changed()
+
+    @property
+    def rate_limit_by(self) -> str:
+        return self._rate_limit_by
+
+    @rate_limit_by.setter
+    def rate_limit_by(self, value: str) -> None:
+        self._rate_limit_by = self._check_choice(value, RATE_LIMIT_KEYS)
+        self._changed()
+
+    @property
+    def failures(self) -> Dict[str, Failure]:
+        return self._failures
+
+    @failures.setter
+    def failures(self,
+                 value: Union[str, Mapping[str, FailureType], None]) -> None:
+        self._failures = _parse_failures(value)
+        self._changed()
+
+    @property
+    def backlog(self) -> int:
+        return self._backlog
+
+    @backlog.setter
+    def backlog(self, value: int) -> None:
+        self._backlog = int(value)
+        self._changed()
+
+    @property
+    def reuse_port(self) -> bool:
+        return self._reuse_port
+
+    @reuse_port.setter
+    def reuse_port(self, value: Any) -> None:
+        self._reuse_port = self.convert_to_bool(value)
+        self._changed()
+
+    @property
+    def handshake_timeout(self) -> float:
+        return self._handshake_timeout
+
+    @handshake_timeout.setter
+    def handshake_timeout(self, value: float) -> None:
+        self._handshake_timeout = float(value)
+        self._changed()
+
+    @property
+    def session_timeout(self) -> float:
+        return self._session_timeout
+
+    @session_timeout.setter
+    def session_timeout(self, value: float) -> None:
+        self._session_timeout = float(value)
+        self._changed()
+
+    @property
+    def data_size_limit(self) -> int:
+        return self._data_size_limit
+
+    @data_size_limit.setter
+    def data_size_limit(self, value: int) -> None:
+        self._data_size_limit = int(value)
+        self._changed()
+
+    @property
+    def command_call_limit(self) -> Union[int, Dict[str, int], None]:
+        return self._command_call_limit
+
+    @command_call_limit.setter
+    def command_call_limit(
+        self,
+        value: Union[int, str, Mapping[str, int], None]
+    ) -> None:
+        self._command_call_limit = self._check_call_limit(value)
+        self._changed()
+
+    @property
+    def tls_session_tickets(self) -> int:
+        return self._tls_session_tickets
+
+    @tls_session_tickets.setter
+    def tls_session_tickets(self, value: int) -> None:
+        self._tls_session_tickets = int(value)
+        self._changed()
+
+    @property
+    def export_path(self) -> Optional[str]:
+        return self._export_path
+
+    @export_path.setter
+    def export_path(self, value: Optional[PathType]) -> None:
+        self._export_path = os.fspath(value) if value else None
+        self._changed()
+
+    @property
+    def export_format(self) -> str:
+        return self._export_format
+
+    @export_format.setter
+    def export_format(self, value: str) -> None:
+        self._export_format = self._check_choice(value, EXPORT_FORMATS)
+        self._changed()
+
+    @property
+    def export_batch_size(self) -> int:
+        return self._export_batch_size
+
+    @export_batch_size.setter
+    def export_batch_size(self, value: int) -> None:
+        self._export_batch_size = int(value)
+        self._changed()
+
+    @property
+    def export_rotate_bytes(self) -> int:
+        return self._export_rotate_bytes
+
+    @export_rotate_bytes.setter
+    def export_rotate_bytes(self, value: int) -> None:
+        self._export_rotate_bytes = int(value)
+        self._changed()
@@ -1,28 +1,191 @@
 import asyncio
-import errno
 import logging
+import socket
 from contextlib import ExitStack
-from os import strerror
-from pathlib import Path
+from email.message import Message as EmailMessage
+from functools import partial
 from socket import create_connection
-from ssl import (CERT_NONE, CERT_OPTIONAL, Purpose, SSLContext,
+from ssl import (CERT_NONE, CERT_OPTIONAL, Purpose, SSLContext, VerifyMode,
                  create_default_context)
-from typing import Any, Coroutine, List, Optional
+from typing import (Any, Callable, Coroutine, Dict, Iterable, List, NamedTuple,
+                    Optional, Tuple)
+from weakref import WeakSet
 
 from aiosmtpd.controller import Controller, get_localhost
 
+from .admission import AdmissionControl
 from .authenticator import Authenticator
 from .configuration import Config
+from .export import MailExport, _create_export
 from .handlers import AuthMessage
+from .loops import _new_event_loop
+from .records import MessageRecord
 from .smtp import _SMTP
+from .stats import ServerStats
+from .store import MessageStore, RecordPredicate, _create_store
+from .tls import SSLContextCache
 
 AsyncServer = asyncio.base_events.Server
 ServerCoroutine = Coroutine[Any, Any, asyncio.base_events.Server]
 
 log = logging.getLogger(__name__)
 
+LISTENER_MODES = ("plain", "ssl", "starttls")
+
+
+class Listener(NamedTuple):
+    """A listener bound by the controller in addition to the one set by the
+    config. The `mode` is one of "plain", "ssl" for implicit TLS, or
+    "starttls" to require STARTTLS. If the port is not given an unused port is
+    chosen when the server starts."""
+    mode: str
+    port: Optional[int] = None
+    host: Optional[str] = None
+
+
+def _bind_sockets(host: Optional[str],
+                  port: int = 0,
+                  reuse_port: bool = False) -> List[socket.socket]:
+    """Binds a socket to each address of the host, all on the same port. If
+    the port is 0 the first address is bound to a free port and the rest of
+    the addresses to the port it was given. As with create_server() an empty
+    host binds all interfaces."""
+    infos = socket.getaddrinfo(host or None, port,
+                               type=socket.SOCK_STREAM,
+                               flags=socket.AI_PASSIVE)
+    sockets: List[socket.socket] = []
+    try:
+        # getaddrinfo() may return the same address more than once
+        for family, type_, proto, _, address in dict.fromkeys(infos):
+            sock = socket.socket(family, type_, proto)
+            sockets.append(sock)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            if family == socket.AF_INET6:
+                # Otherwise the IPv6 wildcard also takes the IPv4 port
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+            sock.bind((address[0], port) + address[2:])
+            port = sock.getsockname()[1]
+    except OSError:
+        for sock in sockets:
+            sock.close()
+        raise
+    return sockets
+
+
+def _record_predicate(
+    predicate: Optional[Callable[[EmailMessage], bool]]
+) -> Optional[RecordPredicate]:
+    """Wraps a predicate for messages so that it can be applied to records."""
+    if predicate is None:
+        return None
+
+    def _predicate(record: MessageRecord) -> bool:
+        return predicate(record.message)
+    return _predicate
+
+
+class _ReceivedMessages():
+    """Access to the messages in the store of a controller."""
+    _messages: MessageStore
+    _export: Optional[MailExport]
+
+    def clear(self) -> None:
+        """Removes all of the messages received by the server without
+        restarting it."""
+        self._messages.clear()
+
+    @property
+    def messages(self) -> List[EmailMessage]:
+        """A copy of the list of messages received by the server. Each message
+        is parsed the first time it is accessed."""
+        return [record.message for record in self._messages]
+
+    def find(self, **criteria: str) -> List[EmailMessage]:
+        """Returns the messages, in the order received, matching all of the
+        criteria using the indexes kept by the store. The criteria are any of
+        `to` and `sender` for the envelope addresses, `auth_user` for the
+        authenticated user, and `message_id` and `subject` for the headers.
+        The values are matched in the same way as by `MessageStore.find()`,
+        so `find(message_id=...)` matches the messages that `get()` does.
+
+        Example:
+            smtpd.find(to="to.addr@example.org", subject="Foo")
+        """
+        return [record.message for record in self._messages.find(**criteria)]
+
+    def get(self, message_id: str) -> Optional[EmailMessage]:
+        """Returns the message with the Message-ID, or `None` if no message
+        with that Message-ID has been received."""
+        record = self._messages.get(message_id)
+        return record.message if record is not None else None
+
+    def wait_for(
+        self,
+        count: int = 1,
+        predicate: Optional[Callable[[EmailMessage], bool]] = None,
+        timeout: Optional[float] = 5.0
+    ) -> List[EmailMessage]:
+        """Block until at least `count` messages matching the predicate, or
+        any messages if there is no predicate, have been received. Returns
+        the matching messages. The caller is woken as soon as each message is
+        received rather than polling.
+
+        Example:
+            smtpd.wait_for(predicate=lambda m: m["Subject"] == "Foo")
+
+        Raises:
+        - TimeoutError if the messages are not received within `timeout`
+          seconds.
+        """
+        records = self._messages.wait_for(count,
+                                          _record_predicate(predicate),
+                                          timeout)
+        return [record.message for record in records]
+
+    async def wait_for_async(
+        self,
+        count: int = 1,
+        predicate: Optional[Callable[[EmailMessage], bool]] = None,
+        timeout: Optional[float] = 5.0
+    ) -> List[EmailMessage]:
+        """The awaitable equivalent of `wait_for()` for use in asynchronous
+        tests.
+
+        Raises:
+        - TimeoutError if the messages are not received within `timeout`
+          seconds.
+        """
+        records = await self._messages.wait_for_async(
+            count,
+            _record_predicate(predicate),
+            timeout
+        )
+        return [record.message for record in records]
+
+    @property
+    def store(self) -> MessageStore:
+        """The store holding the records of the messages received."""
+        return self._messages
+
+    @property
+    def export(self) -> Optional[MailExport]:
+        """The export writing the messages received to an mbox file or
+        Maildir as set by the config, or None."""
+        return self._export
+
+    @property
+    def records(self) -> List[MessageRecord]:
+        """A copy of the list of records of the messages received, giving
+        access to the envelope and raw content without parsing the
+        messages."""
+        return self._messages.copy()
+
+
+class AuthController(_ReceivedMessages, Controller):
+    port: int
 
-class AuthController(Controller):
     def __init__(self,
                  loop: Optional[asyncio.AbstractEventLoop] = None,
                  hostname: Optional[str] = None,
@@ -31,26 +194,54 @@ class AuthController(Controller):
                  ssl_context: Optional[SSLContext] = None,
                  config: Optional[Config] = None,
                  authenticator: Optional[Authenticator] = None,
+                 listeners: Optional[Iterable[Listener]] = None,
+                 handler: Optional[Any] = None,
                  **kwargs: Any) -> None:
         self.config = config or Config()
-        self._messages = kwargs.get("messages") or []
+        self._handler = handler
+        self._extra_listeners = [Listener(*listener)
+                                 for listener in listeners or []]
+        for listener in self._extra_listeners:
+            if listener.mode not in LISTENER_MODES:
+                raise ValueError(f"{listener.mode} is not a valid mode for a "
+                                 f"listener, must be one of {LISTENER_MODES}")
+        self._extra_servers: List[AsyncServer] = []
+        messages = kwargs.pop("messages", None)
+        self._store_settings = self._message_store_settings()
+        self._messages: MessageStore = (
+            messages
+            if messages is not None
+            else _create_store(*self._store_settings)
+        )
+        self._export_settings = self._message_export_settings()
+        self._export = kwargs.pop("export", None)
+        if self._export is None:
+            self._export = _create_export(*self._export_settings)
         self._ssl_context = ssl_context
+        self._ssl_cache = kwargs.pop("ssl_cache", None) or SSLContextCache()
+        self._cert_files = self.config.ssl_cert_files
+        self._stats = kwargs.pop("stats", None) or ServerStats()
+        self._admission = (kwargs.pop("admission", None)
+                           or AdmissionControl(self.config))
+        self._starting = False
         self._authenticator = authenticator
 
-        _handler = AuthMessage(messages=self._messages)
+        _handler = handler or AuthMessage(messages=self._messages,
+                                          export=self._export)
         _hostname = hostname or self.config.host
         _port = int(port or self.config.port)
         _ready_timeout = float(ready_timeout or self.config.ready_timeout)
-        _loop = loop or asyncio.new_event_loop()
-        _loop.set_exception_handler(self._handle_exception)
+        _loop = loop or _new_event_loop(self.config.event_loop)
+        self._prepare_loop(_loop)
 
         def context_or_none() -> Optional[SSLContext]:
             # Determines whether to return a sslContext or None to avoid a
             # situation where both could be used. Prefers STARTTLS to TLS.
             if (self.config.use_ssl and not self.config.use_starttls):
-                context = ssl_context or self._get_ssl_context()
-                context.verify_mode = CERT_OPTIONAL
-                return context
+                if ssl_context is not None:
+                    ssl_context.verify_mode = CERT_OPTIONAL
+                    return ssl_context
+                return self._get_ssl_context(CERT_OPTIONAL)
 
             return None
 
@@ -68,44 +259,58 @@ class AuthController(Controller):
         self.config.host = _hostname
         if port is not None:
             self.config.port = port
-        self.config.OnChanged += self.reset
-        log.info(f"SMTPDFix running on {self.hostname}:{self.port}")
+        self._listener = self._listener_settings()
+        self.config.OnChanged += self._on_config_changed
+
+    def _mode(self) -> str:
+        """The mode of the listener set by the config."""
+        if self.config.use_starttls:
+            return "starttls"
+        return "ssl" if self.config.use_ssl else "plain"
 
     def factory(self) -> _SMTP:
-        use_starttls = self.config.use_starttls
+        return self._factory(self._mode())
+
+    def _factory(self, mode: str) -> _SMTP:
+        use_starttls = mode == "starttls"
         context = self._get_ssl_context() if use_starttls else None
+        # The connection made to check the server has started isn't delayed,
+        # counted or refused
+        starting = self._starting
 
         return _SMTP(handler=self.handler,
-                     require_starttls=self.config.use_starttls,
+                     require_starttls=use_starttls,
+                     timeout=self.config.session_timeout,
+                     data_size_limit=self.config.data_size_limit,
+                     command_call_limit=self.config.command_call_limit,
+                     handshake_timeout=self.config.handshake_timeout,
                      auth_required=self.config.enforce_auth,
                      auth_require_tls=self.config.auth_require_tls,
                      tls_context=context,
-                     authenticator=self._authenticator)
+                     authenticator=self._authenticator,
+                     stats=None if starting else self._stats,
+                     delays=None if starting else self.config.delays,
+                     read_bandwidth=self.config.read_bandwidth,
+                     handshake_delay=self.config.handshake_delay,
+                     admission=None if starting else self._admission)
 
-    def _get_ssl_context(self) -> SSLContext:
+    def _get_ssl_context(self,
+                         verify_mode: VerifyMode = CERT_NONE) -> SSLContext:
+        """Returns the context given to the controller or, if there isn't
+        one, the cached context for the certificate set by the config and
+        the verify mode. Implicit TLS asks for client certificates, with
+        CERT_OPTIONAL, while STARTTLS doesn't."""
         if self._ssl_context is not None:
             return self._ssl_context
 
         cert_file, key_file = self.config.ssl_cert_files
+        return self._ssl_cache.get(cert_file,
+                                   key_file,
+                                   self.config.tls_session_tickets,
+                                   verify_mode)
 
-        def _resolve_file(file_: Optional[str]) -> str:
-            # NB: the paths are returned as strings becuase PYPY3 doesn't
-            # support paths in sslcontext.load_cert_chain()
-            if file_ and Path(file_).is_file():
-                return str(Path(file_))
-
-            raise FileNotFoundError(errno.ENOENT,
-                                    strerror(errno.ENOENT),
-                                    file_)
-
-        cert_path = _resolve_file(cert_file)
-        key_path = _resolve_file(key_file) if key_file else None
-
-        context = create_default_context(Purpose.CLIENT_AUTH)
-        context.check_hostname = False
-        context.load_verify_locations(cert_path)
-        context.load_cert_chain(cert_path, keyfile=key_path)
-        return context
+    def _prepare_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        loop.set_exception_handler(self._handle_exception)
 
     def _handle_exception(self, loop: Any, context: Any) -> None:
         loop.default_exception_handler(context)
@@ -115,6 +320,90 @@ class AuthController(Controller):
         self.smtpd.transport.close()
         self.server.close()
 
+    def _session_invoker(self, mode: str) -> _SMTP:
+        self.smtpd = self._factory(mode)
+        return self.smtpd
+
+    async def _bind(self,
+                    factory: Callable[[], Any],
+                    host: Optional[str],
+                    port: int,
+                    ssl_context: Optional[SSLContext]) -> List[AsyncServer]:
+        """Binds every address of the host on the same port, returning a
+        server for each of them starting with the first address."""
+        config = self.config
+        coro_kwargs: Dict[str, Any] = {"backlog": config.backlog}
+        if ssl_context:
+            coro_kwargs["ssl_handshake_timeout"] = config.handshake_timeout
+
+        # The sockets are bound here rather than by create_server() as it
+        # would bind each address of the host to a different port when the
+        # port is 0.
+        sockets = _bind_sockets(host, port, config.reuse_port)
+        servers: List[AsyncServer] = []
+        try:
+            for sock in sockets:
+                server: AsyncServer = await self.loop.create_server(
+                    factory,
+                    ssl=ssl_context,
+                    sock=sock,
+                    **coro_kwargs
+                )
+                servers.append(server)
+        except Exception:
+            for server in servers:
+                server.close()
+            for sock in sockets[len(servers):]:
+                sock.close()
+            raise
+        return servers
+
+    async def _create_servers(self) -> AsyncServer:
+        """Binds the listener set by the config, and then any additional
+        listeners, on the loop. Returns the server for the listener set by the
+        config. The servers for the other addresses of the host are kept with
+        those of the additional listeners."""
+        server, *others = await self._bind(self._factory_invoker,
+                                           self.hostname,
+                                           self.port,
+                                           self.ssl_context)
+        self._extra_servers.extend(others)
+        if self.port == 0:
+            # Publish the port chosen by the OS. The listener settings are
+            # updated first so that the change isn't seen as needing a restart.
+            self.port = server.sockets[0].getsockname()[1]
+            self._listener = self._listener_settings(self.port)
+            self.config.port = self.port
+        log.info(f"SMTPDFix running on {self.hostname}:{self.port}")
+
+        try:
+            for i, listener in enumerate(self._extra_listeners):
+                ssl_context = None
+                if listener.mode == "ssl":
+                    ssl_context = self._get_ssl_context(CERT_OPTIONAL)
+
+                extra = await self._bind(
+                    partial(self._session_invoker, listener.mode),
+                    listener.host or self.hostname,
+                    listener.port or 0,
+                    ssl_context
+                )
+                self._extra_servers.extend(extra)
+                # Keep the port chosen so that it's reused if the server is
+                # restarted
+                port = extra[0].sockets[0].getsockname()[1]
+                self._extra_listeners[i] = listener._replace(port=port)
+        except Exception:
+            self._close_extra_servers()
+            server.close()
+            raise
+        return server
+
+    def _close_extra_servers(self) -> None:
+        for server in self._extra_servers:
+            server.close()
+        self._extra_servers = []
+
     def _run(self, ready_event: Any) -> None:
         asyncio.set_event_loop(self.loop)
         try:
@@ -122,17 +411,7 @@ class AuthController(Controller):
             # detect the types of the vars. Cannot use `assert isinstance`,
             # because Python 3.6 in asyncio debug mode has a bug wherein
             # CoroWrapper is not an instance of Coroutine
-            coro_kwargs = {}
-            if self.ssl_context:
-                coro_kwargs["ssl_handshake_timeout"] = 5.0
-
-            srv_coro: ServerCoroutine = self.loop.create_server(
-                self._factory_invoker,
-                host=self.hostname,
-                port=self.port,
-                ssl=self.ssl_context,
-                **coro_kwargs
-            )
+            srv_coro: ServerCoroutine = self._create_servers()
             self.server_coro = srv_coro
             srv: AsyncServer = self.loop.run_until_complete(srv_coro)
             self.server = srv
@@ -148,6 +427,7 @@ class AuthController(Controller):
             return
         self.loop.call_soon(ready_event.set)
         self.loop.run_forever()
+        self._close_extra_servers()
         self.server.close()
         self.loop.run_until_complete(self.server.wait_closed())
         self.loop.close()
@@ -155,6 +435,71 @@ class AuthController(Controller):
         # more sensible self.server = None
         setattr(self, "server", None)
 
+    def _listener_settings(self,
+                           port: Optional[int] = None) -> Tuple[Any, ...]:
+        """The settings that can only be changed by binding a new listener."""
+        implicit_tls = self.config.use_ssl and not self.config.use_starttls
+        uses_ssl = implicit_tls or any(listener.mode == "ssl"
+                                       for listener in self._extra_listeners)
+        return (self.config.host,
+                self.config.port if port is None else port,
+                implicit_tls,
+                self.config.ssl_cert_files if uses_ssl else None,
+                self.config.handshake_timeout if uses_ssl else None,
+                self.config.tls_session_tickets if uses_ssl else None,
+                self.config.backlog,
+                self.config.reuse_port)
+
+    def _message_store_settings(self) -> Tuple[str, int, Optional[str]]:
+        return (self.config.message_store,
+                self.config.spool_max_memory,
+                self.config.sink_digest)
+
+    def _message_export_settings(self) -> Tuple[Optional[str], str, int, int]:
+        return (self.config.export_path,
+                self.config.export_format,
+                self.config.export_batch_size,
+                self.config.export_rotate_bytes)
+
+    def _on_config_changed(self) -> None:
+        """Applies changes to the config.
+
+        Settings for the SMTP protocol, such as enforce_auth or use_starttls,
+        are read by factory() whenever a client connects, so they apply to all
+        new sessions without any further action. The server is only restarted
+        when the host, port, implicit TLS or other listener settings, such as
+        the backlog, change.
+        """
+        # The cached contexts are kept while the certificates are unchanged
+        # so that clients can resume their TLS sessions.
+        if self.config.ssl_cert_files != self._cert_files:
+            self._cert_files = self.config.ssl_cert_files
+            self._ssl_cache.clear()
+        self.ready_timeout = self.config.ready_timeout
+
+        if self._message_store_settings() != self._store_settings:
+            # Move the messages already received to a store of the new type
+            self._store_settings = self._message_store_settings()
+            store = _create_store(*self._store_settings)
+            for record in self._messages:
+                store.append(record)
+            self._messages = store
+            if isinstance(self.handler, AuthMessage):
+                self.handler.store = store
+
+        if self._message_export_settings() != self._export_settings:
+            # The messages already queued are written by the old export
+            # before it's replaced
+            self._export_settings = self._message_export_settings()
+            if self._export is not None:
+                self._close_export(self._export)
+            self._export = _create_export(*self._export_settings)
+            if isinstance(self.handler, AuthMessage):
+                self.handler.export = self._export
+
+        if self._listener_settings() != self._listener:
+            self.reset()
+
     def reset(self, persist_messages: bool = True) -> None:
         _running = False
         try:
@@ -164,7 +509,7 @@ class AuthController(Controller):
             pass
 
         # Remove the handler to avoid recursion
-        self.config.OnChanged -= self.reset
+        self.config.OnChanged -= self._on_config_changed
 
         # Ignoring this for the purposes of type checking on the grounds that
         # this works and can't be replaced for now.
@@ -175,12 +520,25 @@ class AuthController(Controller):
             ssl_context=self._ssl_context,
             config=self.config,
             authenticator=self._authenticator,
-            messages=self._messages if persist_messages else None
+            listeners=self._extra_listeners,
+            handler=self._handler,
+            messages=self._messages if persist_messages else None,
+            ssl_cache=self._ssl_cache,
+            stats=self._stats,
+            export=self._export,
+            admission=self._admission
         )
 
         if _running:
             self.start()
 
+    def start(self) -> None:
+        self._starting = True
+        try:
+            super().start()
+        finally:
+            self._starting = False
+
     def _trigger_server(self) -> None:
         hostname = self.hostname or get_localhost()
         with ExitStack() as stk:
@@ -195,6 +553,155 @@ class AuthController(Controller):
 
             _ = s.recv(1024)
 
+    def _close_export(self, export: MailExport) -> None:
+        """Writes the messages queued for the export and stops its writer."""
+        export.close()
+
+    def _cleanup(self) -> None:
+        super()._cleanup()
+        # Everything received has been queued so is written before returning
+        if self._export is not None:
+            self._close_export(self._export)
+
     @property
-    def messages(self) -> List[Any]:
-        return self._messages.copy()
+    def listeners(self) -> List[Listener]:
+        """The listeners bound by the controller, starting with the listener
+        set by the config. A single store holds the messages received by all
+        of them."""
+        primary = Listener(self._mode(), self.port, self.hostname)
+        return [primary] + self._extra_listeners
+
+    @property
+    def stats(self) -> ServerStats:
+        """Counters and latency histograms for the sessions of the server,
+        kept while the server is restarted. Use `stats.reset()` to clear
+        them."""
+        return self._stats
+
+    @property
+    def admission(self) -> AdmissionControl:
+        """The admission control applying the session limit, rate limit and
+        temporary failures set by the config, with counts of the sessions,
+        commands and messages refused, kept while the server is
+        restarted."""
+        return self._admission
+
+    @property
+    def ssl_cache(self) -> SSLContextCache:
+        """The cache of the contexts used for TLS connections."""
+        return self._ssl_cache
+
+    @property
+    def authenticator(self) -> Optional[Authenticator]:
+        """The authenticator used by AUTH. Setting it applies to sessions
+        started after the change, without restarting the server."""
+        return self._authenticator
+
+    @authenticator.setter
+    def authenticator(self, value: Optional[Authenticator]) -> None:
+        self._authenticator = value
+
+
+class AsyncAuthController(AuthController):
+    """A controller that runs the server on the event loop that creates it
+    rather than on a thread of its own, for use in asynchronous tests.
+
+    The server is started and stopped with `await start_async()` and
+    `await stop_async()`. As the server shares the loop with the test no
+    connection is made to check it is ready, and messages are handed to the
+    store without crossing threads.
+
+    Changes to the host, port or implicit TLS settings are applied by
+    `await reset_async()` as the listener cannot be rebound from the
+    synchronous handler for changes to the config.
+    """
+    def __init__(self,
+                 loop: Optional[asyncio.AbstractEventLoop] = None,
+                 **kwargs: Any) -> None:
+        self._sessions: "WeakSet[_SMTP]" = WeakSet()
+        # Exports being closed on another thread
+        self._closing: List["asyncio.Future[None]"] = []
+        super().__init__(loop=loop or asyncio.get_running_loop(), **kwargs)
+
+    def _prepare_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        # The loop belongs to the caller so it's left as it is
+        pass
+
+    def _factory(self, mode: str) -> _SMTP:
+        smtpd = super()._factory(mode)
+        self._sessions.add(smtpd)
+        return smtpd
+
+    def _close_export(self, export: MailExport) -> None:
+        # Joining the writer would block the loop until the messages queued
+        # have been written.
+        if export.running:
+            self._closing.append(
+                self.loop.run_in_executor(None, export.close)
+            )
+
+    def start(self) -> None:
+        raise RuntimeError("Use 'await start_async()' to start the server")
+
+    def stop(self, no_assert: bool = False) -> None:
+        raise RuntimeError("Use 'await stop_async()' to stop the server")
+
+    async def start_async(self) -> None:
+        assert self.server is None, "SMTP daemon already running"
+        self.server = await self._create_servers()
+
+    async def stop_async(self) -> None:
+        assert self.server is not None, "SMTP daemon not running"
+        servers = [self.server] + self._extra_servers
+        self._close_extra_servers()
+        self.server.close()
+        # Sessions left open by clients would otherwise keep the server from
+        # closing.
+        for session in list(self._sessions):
+            if session.transport is not None:
+                session.transport.close()
+        for server in servers:
+            await server.wait_closed()
+        # The export is closed, and any replaced exports finish writing, on
+        # another thread so that the loop isn't blocked.
+        if self._export is not None:
+            self._close_export(self._export)
+        closing, self._closing = self._closing, []
+        await asyncio.gather(*closing)
+        self._cleanup()
+
+    def reset(self, persist_messages: bool = True) -> None:
+        if self.server is not None:
+            log.warning("The server must be restarted for the changes to the "
+                        "config to apply, use 'await reset_async()'")
+            return
+
+        self._reinitialize(persist_messages)
+
+    async def reset_async(self, persist_messages: bool = True) -> None:
+        """Stops the server, if it's running, and starts it again using the
+        current configuration."""
+        running = self.server is not None
+        if running:
+            await self.stop_async()
+        self._reinitialize(persist_messages)
+        if running:
+            await self.start_async()
+
+    def _reinitialize(self, persist_messages: bool) -> None:
+        self.config.OnChanged -= self._on_config_changed
+        self.__init__(  # type: ignore
+            loop=self.loop,
+            hostname=self.config.host,
+            port=self.config.port,
+            ssl_context=self._ssl_context,
+            config=self.config,
+            authenticator=self._authenticator,
+            listeners=self._extra_listeners,
+            handler=self._handler,
+            messages=self._messages if persist_messages else None,
+            ssl_cache=self._ssl_cache,
+            stats=self._stats,
+            export=self._export,
+            admission=self._admission
+        )
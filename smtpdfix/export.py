@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import mailbox
+import os
+import queue
+import re
+import threading
+import time
+from typing import BinaryIO, List, Optional, Tuple, Union
+
+from .records import MessageRecord
+
+log = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("mbox", "maildir")
+
+# Lines that would be mistaken for the start of a message, and lines already
+# quoted, are quoted with ">" as in the mboxrd format.
+_FROM_LINE = re.compile(rb"^(>*From )", re.MULTILINE)
+
+
+def _mbox_entry(record: MessageRecord) -> bytes:
+    """Formats the record as a message in an mbox file."""
+    sender = record.mail_from or "MAILER-DAEMON"
+    date = time.asctime(time.gmtime(record.received))
+    content = _FROM_LINE.sub(rb">\1", record.content.replace(b"\r\n", b"\n"))
+    if not content.endswith(b"\n"):
+        content += b"\n"
+    return f"From {sender} {date}\n".encode() + content + b"\n"
+
+
+class _MboxWriter():
+    """Appends messages to an mbox file."""
+    def __init__(self, path: str) -> None:
+        self._file: BinaryIO = open(path, "ab")
+        self.size = self._file.tell()
+
+    def write(self, records: List[MessageRecord]) -> None:
+        data = b"".join(_mbox_entry(record) for record in records)
+        self._file.write(data)
+        self._file.flush()
+        self.size += len(data)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _MaildirWriter():
+    """Adds messages to the new folder of a Maildir, each of which is written
+    to a temporary file and then moved so that it's never partly written."""
+    def __init__(self, path: str) -> None:
+        self._maildir = mailbox.Maildir(path, create=True)
+        self.size = 0
+
+    def write(self, records: List[MessageRecord]) -> None:
+        for record in records:
+            content = record.content.replace(b"\r\n", b"\n")
+            self._maildir.add(content)
+            self.size += len(content)
+
+    def close(self) -> None:
+        self._maildir.close()
+
+
+class MailExport():
+    """Appends the messages received by the server to an mbox file, or a
+    Maildir, as they arrive so that they can be examined after a test run,
+    even one that crashed, without holding them all in memory.
+
+    Messages are written by a thread of its own, in batches of up to
+    `batch_size` messages, so the server's event loop never waits for the
+    disk. Each batch is flushed once it's written. The queue of messages
+    waiting to be written holds at most two batches, so memory use stays
+    constant. If the writer falls behind `add_async()` waits for room in the
+    queue without blocking the event loop, so only the sessions delivering
+    messages are slowed.
+
+    If `rotate_bytes` is set, once that many bytes have been written to the
+    mbox file or Maildir it's renamed with the next unused suffix, `.1`,
+    `.2` and so on, and a new one started.
+
+    - `exported`: the number of messages written.
+    - `errors`: the number of messages that couldn't be written.
+    """
+    def __init__(self,
+                 path: Union[str, "os.PathLike[str]"],
+                 format: str = "mbox",
+                 batch_size: int = 100,
+                 rotate_bytes: int = 0) -> None:
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"{format} is not a valid export format, must "
+                             f"be one of {EXPORT_FORMATS}")
+        self.path = os.fspath(path)
+        self.format = format
+        self.batch_size = max(batch_size, 1)
+        self.rotate_bytes = rotate_bytes
+        self.exported = 0
+        self.errors = 0
+        self._queue: "queue.Queue[Optional[MessageRecord]]" = queue.Queue(
+            self.batch_size * 2
+        )
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, record: MessageRecord) -> None:
+        """Queues the record to be written, starting the writer if it isn't
+        running. Blocks while the queue is full."""
+        self._start()
+        self._queue.put(record)
+
+    async def add_async(self, record: MessageRecord) -> None:
+        """Queues the record to be written, waiting for room in the queue on
+        another thread if it's full so that the event loop isn't blocked."""
+        self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._queue.put, record)
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._write,
+                                                name="smtpdfix-export",
+                                                daemon=True)
+                self._thread.start()
+
+    @property
+    def running(self) -> bool:
+        """Whether the writer has been started and not closed since."""
+        return self._thread is not None
+
+    def flush(self) -> None:
+        """Blocks until the messages added so far have been written."""
+        self._queue.join()
+
+    def close(self) -> None:
+        """Writes the messages that are queued and stops the writer. Adding
+        another message starts it again, appending to the same file."""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _open(self) -> Union[_MboxWriter, _MaildirWriter]:
+        if self.format == "maildir":
+            return _MaildirWriter(self.path)
+        return _MboxWriter(self.path)
+
+    def _rotate(self) -> None:
+        n = 1
+        while os.path.exists(f"{self.path}.{n}"):
+            n += 1
+        os.rename(self.path, f"{self.path}.{n}")
+
+    def _next_batch(self) -> Tuple[List[MessageRecord], bool]:
+        """Waits for a record and then takes whatever else is queued, up to a
+        batch, without waiting for more to arrive. Returns the batch and
+        whether the export is closing."""
+        batch: List[MessageRecord] = []
+        record = self._queue.get()
+        while record is not None:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                break
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                break
+        return batch, record is None
+
+    def _write(self) -> None:
+        writer: Optional[Union[_MboxWriter, _MaildirWriter]] = None
+        closing = False
+        while not closing:
+            batch, closing = self._next_batch()
+            if batch:
+                try:
+                    if writer is None:
+                        writer = self._open()
+                    writer.write(batch)
+                    self.exported += len(batch)
+                except Exception:
+                    log.exception(f"Failed to export {len(batch)} messages "
+                                  f"to {self.path}")
+                    self.errors += len(batch)
+
+            if writer is not None and self.rotate_bytes and \
+                    writer.size >= self.rotate_bytes:
+                writer.close()
+                writer = None
+                try:
+                    self._rotate()
+                except OSError:
+                    log.exception(f"Failed to rotate {self.path}")
+
+            for _ in range(len(batch) + closing):
+                self._queue.task_done()
+
+        if writer is not None:
+            writer.close()
+
+
+def _create_export(path: Optional[str],
+                   format: str,
+                   batch_size: int,
+                   rotate_bytes: int) -> Optional[MailExport]:
+    """Create an export to the path, or None if there isn't a path."""
+    if not path:
+        return None
+    return MailExport(path, format, batch_size, rotate_bytes)
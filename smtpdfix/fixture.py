@@ -1,17 +1,29 @@
 import logging
 import os
-from typing import Any, Generator, Optional
+from pathlib import Path
+from typing import Any, AsyncGenerator, Dict, Generator, Iterable, Optional
 
-import portpicker
 import pytest
 
 from .authenticator import Authenticator
-from .certs import _generate_certs
+from .certs import _cached_certs, _generate_certs
 from .configuration import Config
-from .controller import AuthController
+from .controller import AsyncAuthController, AuthController, Listener
+
+try:
+    import pytest_asyncio
+    _async_fixture = pytest_asyncio.fixture
+except ImportError:  # pragma: no cover
+    # Without pytest-asyncio pytest will report that the async fixture isn't
+    # supported when it is used.
+    _async_fixture = pytest.fixture
 
 log = logging.getLogger(__name__)
 
+# The certificates generated for the fixtures by key type, so that they can be
+# told apart from a certificate set in the environment by the user.
+_generated_certs: Dict[str, str] = {}
+
 
 class _Authenticator(Authenticator):
     def __init__(self, config: Config) -> None:
@@ -39,21 +51,28 @@ class SMTPDFix():
     def __init__(self,
                  hostname: Optional[str] = None,
                  port: Optional[int] = None,
-                 config: Optional[Config] = None) -> None:
+                 config: Optional[Config] = None,
+                 listeners: Optional[Iterable[Listener]] = None,
+                 message_store: Optional[str] = None,
+                 handler: Optional[Any] = None,
+                 authenticator: Optional[Authenticator] = None) -> None:
         self.hostname = hostname
-        self.port = (
-            int(port)
-            if port is not None
-            else portpicker.pick_unused_port()
-        )
+        self.port = int(port) if port is not None else None
         self.config = config or Config()
+        if message_store is not None:
+            self.config.message_store = message_store
+        self.listeners = listeners
+        self.handler = handler
+        self.authenticator = authenticator or _Authenticator(self.config)
 
     def __enter__(self) -> AuthController:
         self.controller = AuthController(
             hostname=self.hostname,
             port=self.port,
             config=self.config,
-            authenticator=_Authenticator(self.config)
+            authenticator=self.authenticator,
+            listeners=self.listeners,
+            handler=self.handler
         )
         self.controller.start()
         return self.controller
@@ -61,9 +80,68 @@ class SMTPDFix():
     def __exit__(self, type: Any, value: Any, traceback: Any) -> None:
         self.controller.stop()
 
+    async def __aenter__(self) -> AsyncAuthController:
+        controller = AsyncAuthController(
+            hostname=self.hostname,
+            port=self.port,
+            config=self.config,
+            authenticator=self.authenticator,
+            listeners=self.listeners,
+            handler=self.handler
+        )
+        self.controller = controller
+        await controller.start_async()
+        return controller
+
+    async def __aexit__(self, type: Any, value: Any, traceback: Any) -> None:
+        assert isinstance(self.controller, AsyncAuthController)
+        await self.controller.stop_async()
+
+
+def _default_certs(config: Config,
+                   pytestconfig: "pytest.Config",
+                   tmp_path_factory: pytest.TempPathFactory) -> None:
+    """Generate a certificate, of the type set in the config, for the fixtures
+    to use if one has not been set in the environment.
+
+    The certificate is stored in pytest's cache so that it is reused by later
+    sessions and by pytest-xdist workers. If the cache is disabled the
+    certificate is generated in a temporary directory instead. A certificate
+    is generated for each key type the first time that it's used.
+    """
+    cert_file = os.getenv("SMTPD_SSL_CERTIFICATE_FILE")
+    if cert_file is not None and cert_file not in _generated_certs.values():
+        return
+
+    key_type = config.cert_key_type
+    cert_file = _generated_certs.get(key_type)
+    if cert_file is None:
+        cache = getattr(pytestconfig, "cache", None)
+        if cache is not None:
+            # Cache.makedir was replaced by Cache.mkdir in pytest 7
+            mkdir = getattr(cache, "mkdir", None) or cache.makedir
+            cert, _ = _cached_certs(Path(mkdir("smtpdfix")),
+                                    key_type=key_type)
+        else:
+            path = tmp_path_factory.mktemp("certs")
+            cert, _ = _generate_certs(path, key_type=key_type)
+        cert_file = _generated_certs[key_type] = str(cert.resolve())
+    os.environ["SMTPD_SSL_CERTIFICATE_FILE"] = cert_file
+    config.ssl_cert_files = cert_file
+
+
+def _config_state(config: Config) -> Dict[str, Any]:
+    """Returns the values of all of the properties of the config."""
+    return {
+        name: getattr(config, name)
+        for name in dir(Config)
+        if isinstance(getattr(Config, name), property)
+    }
+
 
 @pytest.fixture
 def smtpd(
+    pytestconfig: "pytest.Config",
     tmp_path_factory: pytest.TempPathFactory
 ) -> Generator[AuthController, None, None]:
     """A small SMTP server for use when testing applications that send email
@@ -77,10 +155,87 @@ def smtpd(
                 code, resp = client.noop()
                 assert code == 250
     """
-    if os.getenv("SMTPD_SSL_CERTIFICATE_FILE") is None:
-        path = tmp_path_factory.mktemp("certs")
-        cert, _ = _generate_certs(path, separate_key=False)
-        os.environ["SMTPD_SSL_CERTIFICATE_FILE"] = str(cert.resolve())
+    config = Config()
+    _default_certs(config, pytestconfig, tmp_path_factory)
+
+    with SMTPDFix(config=config) as fixture:
+        yield fixture
+
+
+@_async_fixture
+async def async_smtpd(
+    pytestconfig: "pytest.Config",
+    tmp_path_factory: pytest.TempPathFactory
+) -> AsyncGenerator[AsyncAuthController, None]:
+    """A SMTP server running on the event loop of the test rather than on a
+    thread of its own. Requires pytest-asyncio.
+
+    Example:
+        @pytest.mark.asyncio
+        async def test_mail(async_smtpd):
+            from smtplib import SMTP
+            def send():
+                with SMTP(async_smtpd.hostname, async_smtpd.port) as c:
+                    c.sendmail("from@example.org", "to@example.org", "Foo")
+            # The client must not block the loop that the server runs on
+            await asyncio.get_running_loop().run_in_executor(None, send)
+            assert len(async_smtpd.messages) == 1
+    """
+    config = Config()
+    _default_certs(config, pytestconfig, tmp_path_factory)
 
-    with SMTPDFix() as fixture:
+    async with SMTPDFix(config=config) as fixture:
         yield fixture
+
+
+@pytest.fixture(scope="session")
+def smtpd_session(
+    pytestconfig: "pytest.Config",
+    tmp_path_factory: pytest.TempPathFactory
+) -> Generator[AuthController, None, None]:
+    """A SMTP server that is started once and shared by every test in the
+    session. When running under pytest-xdist each worker starts its own
+    server.
+
+    Messages accumulate across tests, use `smtpd_shared` to get the server
+    with the messages cleared for each test.
+    """
+    config = Config()
+    _default_certs(config, pytestconfig, tmp_path_factory)
+
+    with SMTPDFix(config=config) as fixture:
+        yield fixture
+
+
+@pytest.fixture
+def smtpd_shared(
+    smtpd_session: AuthController
+) -> Generator[AuthController, None, None]:
+    """The session wide SMTP server with the messages captured by earlier
+    tests cleared. Changes made to the configuration, or the authenticator,
+    during the test are reverted after the test completes, and the stats,
+    admission counters and TLS context cache counters are reset.
+
+    Example:
+        def test_mail(smtpd_shared):
+            from smtplib import SMTP
+            with SMTP(smtpd_shared.hostname, smtpd_shared.port) as client:
+                client.sendmail("from@example.org", "to@example.org", "Foo")
+            assert len(smtpd_shared.messages) == 1
+    """
+    state = _config_state(smtpd_session.config)
+    authenticator = smtpd_session.authenticator
+    smtpd_session.clear()
+
+    yield smtpd_session
+
+    smtpd_session.authenticator = authenticator
+    smtpd_session.stats.reset()
+    smtpd_session.admission.reset()
+    smtpd_session.ssl_cache.reset_counters()
+    changed = {
+        name: value
+        for name, value in state.items()
+        if getattr(smtpd_session.config, name) != value
+    }
+    smtpd_session.config.update(**changed)
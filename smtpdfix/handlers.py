@@ -4,18 +4,45 @@ import logging
 import secrets
 from datetime import datetime
 from email.message import Message as EmailMessage
-from typing import List
+from typing import List, Optional
 
 from aiosmtpd.handlers import Message
-from aiosmtpd.smtp import MISSING, SMTP, AuthResult, auth_mechanism
+from aiosmtpd.smtp import (MISSING, SMTP, AuthResult, Envelope, Session,
+                           auth_mechanism)
+
+from .export import MailExport
+from .records import MessageRecord
+from .store import MessageStore
 
 log = logging.getLogger(__name__)
 
 
 class AuthMessage(Message):
-    def __init__(self, messages: List[EmailMessage]) -> None:
+    def __init__(self,
+                 messages: MessageStore,
+                 export: Optional[MailExport] = None) -> None:
         super().__init__()
         self._messages = messages
+        self._export = export
+
+    @property
+    def store(self) -> MessageStore:
+        """The store that received messages are added to."""
+        return self._messages
+
+    @store.setter
+    def store(self, value: MessageStore) -> None:
+        self._messages = value
+
+    @property
+    def export(self) -> Optional[MailExport]:
+        """The export that received messages are written to as they arrive,
+        or None."""
+        return self._export
+
+    @export.setter
+    def export(self, value: Optional[MailExport]) -> None:
+        self._export = value
 
     @auth_mechanism("CRAM-MD5")
     async def auth_CRAM_MD5(self, server: SMTP, args: List[str]) -> AuthResult:
@@ -28,16 +55,22 @@ class AuthMessage(Message):
         challenge = f"<{secret}{ts}@{hostname}>"
         response = await server.challenge_auth(challenge)
         user, received = response.split()
-        password = server._authenticator.get_password(user.decode())
+        authenticator = server._authenticator
+        cram_md5 = getattr(authenticator, "cram_md5", None)
+        if cram_md5 is not None:
+            mac = cram_md5(user.decode())
+        else:
+            # Authenticators that don't subclass Authenticator only provide
+            # the password
+            password = authenticator.get_password(user.decode())
+            mac = hmac.new(password.encode(), digestmod="md5")
 
         # Verify
-        mac = hmac.HMAC(password.encode(),
-                        challenge.encode(),
-                        "md5")
-        expected = mac.hexdigest().encode()
-        if hmac.compare_digest(expected, received):
-            log.debug("AUTH CARM-MD5 succeeded")
-            return AuthResult(success=True, handled=True, auth_data=user)
+        if mac is not None:
+            mac.update(challenge.encode())
+            if hmac.compare_digest(mac.hexdigest().encode(), received):
+                log.debug("AUTH CARM-MD5 succeeded")
+                return AuthResult(success=True, handled=True, auth_data=user)
         log.debug("AUTH CRAM-MD5 failed")
         return AuthResult(success=False, handled=False)
 
@@ -83,10 +116,34 @@ class AuthMessage(Message):
             and server._authenticator.validate(split_resp[0], split_resp[-1])
         ):
             log.debug("AUTH PLAIN succeeded")
-            return AuthResult(success=True, handled=True)
+            return AuthResult(success=True,
+                              handled=True,
+                              auth_data=split_resp[0])
 
         log.debug("AUTH PLAIN failed")
         return AuthResult(success=False, handled=False)
 
+    async def handle_DATA(self,
+                          server: SMTP,
+                          session: Session,
+                          envelope: Envelope) -> str:
+        # The message is stored without being parsed, parsing is deferred
+        # until the message is accessed. See MessageRecord.
+        auth_user = session.auth_data
+        if isinstance(auth_user, bytes):
+            auth_user = auth_user.decode()
+        record = MessageRecord(content=envelope.original_content or b"",
+                               mail_from=envelope.mail_from,
+                               rcpt_tos=list(envelope.rcpt_tos),
+                               peer=session.peer,
+                               auth_user=auth_user)
+        self._messages.append(record)
+        if self._export is not None:
+            await self._export.add_async(record)
+        return "250 OK"
+
     def handle_message(self, message: EmailMessage) -> None:
-        self._messages.append(message)
+        record = MessageRecord.from_message(message)
+        self._messages.append(record)
+        if self._export is not None:
+            self._export.add(record)
@@ -0,0 +1,105 @@
+import random
+from typing import Any, Dict, Mapping, NamedTuple, Optional, Tuple, Union
+
+DISTRIBUTIONS: Tuple[str, ...] = ("fixed", "uniform", "normal", "exponential")
+
+# The point in a session, other than an SMTP command, that can be delayed.
+GREETING = "GREETING"
+
+
+class Delay(NamedTuple):
+    """A delay, in seconds, added before the server responds.
+
+    - `fixed`: always `seconds`.
+    - `uniform`: between `seconds - spread` and `seconds + spread`.
+    - `normal`: a mean of `seconds` with a standard deviation of `spread`.
+    - `exponential`: a mean of `seconds`, giving a long tail of slow
+      responses.
+
+    Delays are never less than zero.
+    """
+    seconds: float
+    spread: float = 0.0
+    distribution: str = "fixed"
+
+    def sample(self) -> float:
+        """Returns a delay drawn from the distribution."""
+        if self.distribution == "uniform":
+            value = random.uniform(self.seconds - self.spread,
+                                   self.seconds + self.spread)
+        elif self.distribution == "normal":
+            value = random.gauss(self.seconds, self.spread)
+        elif self.distribution == "exponential":
+            value = random.expovariate(1 / self.seconds) if self.seconds else 0
+        else:
+            value = self.seconds
+        return max(value, 0.0)
+
+
+DelayType = Union[Delay, str, float]
+
+
+def _parse_delay(value: DelayType) -> Delay:
+    """Converts a number of seconds, or a string in the form
+    `[distribution:]seconds[:spread]`, such as `0.5`, `normal:0.2:0.05` or
+    `exponential:0.2`, to a delay.
+
+    Raises:
+    - ValueError if the value isn't a valid delay.
+    """
+    if isinstance(value, Delay):
+        delay = value
+    elif isinstance(value, str):
+        parts = value.strip().split(":")
+        distribution = "fixed"
+        if parts[0].lower() in DISTRIBUTIONS:
+            distribution = parts.pop(0).lower()
+        if not 1 <= len(parts) <= 2:
+            raise ValueError(f"invalid delay {value}, expected "
+                             f"[distribution:]seconds[:spread]")
+        numbers = [float(part) for part in parts] + [0.0]
+        delay = Delay(numbers[0], numbers[1], distribution)
+    else:
+        delay = Delay(float(value))
+
+    if delay.distribution not in DISTRIBUTIONS:
+        raise ValueError(f"invalid distribution {delay.distribution}, "
+                         f"expected one of {', '.join(DISTRIBUTIONS)}")
+    if delay.seconds < 0 or delay.spread < 0:
+        raise ValueError(f"invalid delay {value}, must not be negative")
+    return delay
+
+
+def _parse_delays(
+    value: Union[str, Mapping[str, DelayType], None]
+) -> Dict[str, Delay]:
+    """Converts a mapping of commands to delays, or a string in the form
+    `COMMAND=delay,...`, such as `GREETING=0.5,DATA=exponential:0.2`, to a
+    dictionary of delays keyed by the upper case command.
+
+    Raises:
+    - ValueError if an item isn't a valid delay.
+    """
+    if not value:
+        return {}
+
+    items: Any
+    if isinstance(value, str):
+        items = []
+        for item in value.split(","):
+            command, sep, delay = item.partition("=")
+            if not sep:
+                raise ValueError(f"invalid delay {item}, expected "
+                                 f"COMMAND=delay")
+            items.append((command, delay))
+    else:
+        items = value.items()
+    return {command.strip().upper(): _parse_delay(delay)
+            for command, delay in items}
+
+
+def _parse_optional_delay(value: Optional[DelayType]) -> Optional[Delay]:
+    """Converts the value to a delay, or None if empty."""
+    if value is None or value == "":
+        return None
+    return _parse_delay(value)
@@ -0,0 +1,22 @@
+import asyncio
+import logging
+from typing import Tuple
+
+log = logging.getLogger(__name__)
+
+LOOP_TYPES: Tuple[str, ...] = ("asyncio", "uvloop")
+
+
+def _new_event_loop(loop_type: str = "asyncio") -> asyncio.AbstractEventLoop:
+    """Creates a new event loop of the type, falling back to the standard
+    asyncio loop if the type requested isn't installed."""
+    if loop_type == "uvloop":
+        try:
+            import uvloop
+        except ImportError:
+            log.warning("uvloop is not installed, using the asyncio event "
+                        "loop")
+        else:
+            loop: asyncio.AbstractEventLoop = uvloop.new_event_loop()
+            return loop
+    return asyncio.new_event_loop()
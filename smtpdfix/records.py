@@ -0,0 +1,109 @@
+import time
+from email import message_from_bytes
+from email.message import Message as EmailMessage
+from email.parser import BytesHeaderParser
+from typing import TYPE_CHECKING, Any, List, Optional
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .store import _Spool
+
+COMMASPACE = ", "
+
+
+class MessageRecord():
+    """A message received by the server.
+
+    Only the raw content of the message and its envelope are kept when the
+    message is received. The content is parsed into an `EmailMessage` the
+    first time `message` is accessed and the result is kept for subsequent
+    use, unless the content has been moved to a spool in which case it's
+    parsed each time so that the message isn't held in memory.
+    """
+    __slots__ = ("mail_from", "rcpt_tos", "peer", "received", "auth_user",
+                 "_content", "_size", "_spool", "_offset", "_message")
+
+    def __init__(self,
+                 content: bytes,
+                 mail_from: Optional[str] = None,
+                 rcpt_tos: Optional[List[str]] = None,
+                 peer: Any = None,
+                 received: Optional[float] = None,
+                 auth_user: Optional[str] = None) -> None:
+        self._content: Optional[bytes] = content
+        self._size = len(content)
+        self._spool: Optional["_Spool"] = None
+        self._offset = 0
+        self.mail_from = mail_from
+        self.rcpt_tos = rcpt_tos or []
+        self.peer = peer
+        self.received = time.time() if received is None else received
+        self.auth_user = auth_user
+        self._message: Optional[EmailMessage] = None
+
+    @classmethod
+    def from_message(cls, message: EmailMessage) -> "MessageRecord":
+        """Create a record for a message that has already been parsed."""
+        rcpt_tos = message.get("X-RcptTo")
+        record = cls(content=message.as_bytes(),
+                     mail_from=message.get("X-MailFrom"),
+                     rcpt_tos=rcpt_tos.split(COMMASPACE) if rcpt_tos else [],
+                     peer=message.get("X-Peer"))
+        record._message = message
+        return record
+
+    @property
+    def content(self) -> bytes:
+        """The raw content of the message as received by the server."""
+        if self._content is not None:
+            return self._content
+        assert self._spool is not None
+        return self._spool.read(self._offset, self._size)
+
+    def _spooled(self, spool: "_Spool", offset: int) -> None:
+        """Release the content held in memory, reading it from the spool when
+        it's needed instead."""
+        self._spool = spool
+        self._offset = offset
+        self._content = None
+        self._message = None
+
+    @property
+    def message(self) -> EmailMessage:
+        """The parsed message, with the X-Peer, X-MailFrom and X-RcptTo headers
+        added in the same way as aiosmtpd's Message handler."""
+        if self._message is not None:
+            return self._message
+
+        message = message_from_bytes(self.content)
+        # Records created from a message already have the headers
+        headers = {"X-Peer": str(self.peer),
+                   "X-MailFrom": self.mail_from or "",
+                   "X-RcptTo": COMMASPACE.join(self.rcpt_tos)}
+        for name, value in headers.items():
+            del message[name]
+            message[name] = value
+        if self._spool is None:
+            self._message = message
+        return message
+
+    @property
+    def headers(self) -> EmailMessage:
+        """The headers of the message, parsed without the body. If the message
+        has already been parsed it is returned instead."""
+        if self._message is not None:
+            return self._message
+
+        content = self.content
+        end = content.find(b"\r\n\r\n")
+        if end < 0:
+            end = content.find(b"\n\n")
+        header_block = content if end < 0 else content[:end]
+        return BytesHeaderParser().parsebytes(header_block)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def __repr__(self) -> str:
+        return (f"MessageRecord(mail_from={self.mail_from!r}, "
+                f"rcpt_tos={self.rcpt_tos!r}, size={self.size})")
@@ -1,17 +1,30 @@
 import asyncio
 import logging
 import socket
+import time
+from functools import wraps
 from ssl import SSLContext
-from typing import Any, Dict, Iterable, Optional, Union
+from typing import (Any, AnyStr, Awaitable, Callable, Dict, Iterable, List,
+                    Mapping, Optional, Union)
 
-from aiosmtpd.smtp import (DATA_SIZE_DEFAULT, SMTP, AuthCallbackType,
+from aiosmtpd.smtp import (DATA_SIZE_DEFAULT, MISSING, SMTP, AuthCallbackType,
                            AuthenticatorType, TLSSetupException, syntax)
 
+from .admission import AdmissionControl
+from .latency import GREETING, Delay
+from .stats import ServerStats
+
 log = logging.getLogger(__name__)
 
+# The number of bytes of content collected before being passed to the
+# handler's handle_DATA_CHUNK() hook.
+CHUNK_SIZE = 2**16
+
 
 class _SMTP(SMTP):
     """Patch for the SMTP protocol from aiosmtpd."""
+    _smtp_methods: Dict[str, Any]
+
     def __init__(
             self,
             handler: Any,
@@ -31,8 +44,32 @@ class _SMTP(SMTP):
             command_call_limit: Union[int, Dict[str, int], None] = None,
             authenticator: Optional[AuthenticatorType] = None,
             proxy_protocol_timeout: Optional[Union[int, float]] = None,
-            loop: Optional[asyncio.AbstractEventLoop] = None
+            loop: Optional[asyncio.AbstractEventLoop] = None,
+            stats: Optional[ServerStats] = None,
+            delays: Optional[Mapping[str, Delay]] = None,
+            read_bandwidth: int = 0,
+            handshake_delay: Optional[Delay] = None,
+            admission: Optional[AdmissionControl] = None,
+            handshake_timeout: float = 5.0
     ):
+        # The session is created when the connection is accepted, before any
+        # TLS handshake, so this is used to time implicit TLS handshakes.
+        self._created = time.perf_counter()
+        self._stats = stats
+        self._delays = dict(delays or {})
+        self._handshake_delay = handshake_delay
+        self._handshake_timeout = handshake_timeout
+        # The delay before the next response, set once a message is received
+        self._reply_delay = 0.0
+        self._read_bandwidth = read_bandwidth
+        # The time on the loop at which the data received will have been read
+        # at the bandwidth, and the number of reads waiting until then.
+        self._read_until = 0.0
+        self._read_pending = 0
+        self._admission = admission
+        # Whether the session is counted as open by the admission control
+        self._admitted = False
+        self._bucket = admission.bucket() if admission is not None else None
         if hostname:  # pragma: no cover
             _hostname = hostname
         else:
@@ -59,6 +96,163 @@ class _SMTP(SMTP):
             loop=loop,
         )
 
+        # The delay for DATA is applied to the response once the message has
+        # been received rather than to the 354 response.
+        for command, delay in self._delays.items():
+            if command in self._smtp_methods and command != "DATA":
+                self._smtp_methods[command] = self._delayed(
+                    self._smtp_methods[command], delay
+                )
+        if admission is not None:
+            self._smtp_methods = {
+                command: self._admit(command, method, admission)
+                for command, method in self._smtp_methods.items()
+            }
+        if stats is not None:
+            self._smtp_methods = {
+                command: self._timed(command, method, stats)
+                for command, method in self._smtp_methods.items()
+            }
+
+    def _delayed(
+        self,
+        method: Callable[[str], Awaitable[None]],
+        delay: Delay
+    ) -> Callable[[str], Awaitable[None]]:
+        """Wraps the method for a command to wait before processing it."""
+        @wraps(method)
+        async def delayed(arg: str) -> None:
+            await asyncio.sleep(delay.sample())
+            await method(arg)
+        return delayed
+
+    def _admit(
+        self,
+        command: str,
+        method: Callable[[str], Awaitable[None]],
+        admission: AdmissionControl
+    ) -> Callable[[str], Awaitable[None]]:
+        """Wraps the method for a command to refuse it if it fails or is rate
+        limited by the admission control."""
+        @wraps(method)
+        async def admit(arg: str) -> None:
+            assert self._bucket is not None
+            status = admission.check(command, self._bucket, self._user())
+            if status is None:
+                await method(arg)
+                return
+            await self.push(status)
+            if status.startswith("421") and self.transport is not None:
+                self.transport.close()
+        return admit
+
+    def _user(self) -> Optional[str]:
+        """The authenticated user, or None."""
+        if self.session is None or not self.session.authenticated:
+            return None
+        user = self.session.auth_data
+        return user.decode() if isinstance(user, bytes) else str(user)
+
+    def _timed(self,
+               command: str,
+               method: Callable[[str], Awaitable[None]],
+               stats: ServerStats) -> Callable[[str], Awaitable[None]]:
+        """Wraps the method for a command to record the time it takes."""
+        @wraps(method)
+        async def timed(arg: str) -> None:
+            authenticated = self.session is not None and \
+                self.session.authenticated
+            start = time.perf_counter()
+            try:
+                await method(arg)
+            finally:
+                stats.record_command(command, time.perf_counter() - start)
+                if command == "AUTH" and not authenticated:
+                    if self.session is not None and self.session.authenticated:
+                        stats.auth_success += 1
+                    else:
+                        stats.auth_failure += 1
+        return timed
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        if self._admission is not None and self._original_transport is None:
+            self._admitted = self._admission.open()
+        if self._stats is not None and self._original_transport is None:
+            self._stats.connections += 1
+            ssl_object = transport.get_extra_info("ssl_object")
+            if ssl_object is not None:
+                self._stats.record_handshake(time.perf_counter()
+                                             - self._created,
+                                             ssl_object.session_reused)
+        super().connection_made(transport)
+
+    def data_received(self, data: bytes) -> None:
+        if self._stats is not None:
+            self._stats.bytes_received += len(data)
+        if not self._read_bandwidth:
+            super().data_received(data)
+            return
+
+        # The data is passed on once receiving it would have taken at the
+        # read bandwidth, with reading paused until then.
+        self._read_until = (max(self._read_until, self.loop.time())
+                            + len(data) / self._read_bandwidth)
+        self._read_pending += 1
+        self.loop.call_at(self._read_until, self._receive, data)
+        if self._read_pending == 1 and self.transport is not None:
+            self.transport.pause_reading()
+
+    def _receive(self, data: bytes) -> None:
+        self._read_pending -= 1
+        if self.transport is None:
+            # The connection was lost in the meantime
+            return
+        super().data_received(data)
+        if not self._read_pending and not self.transport.is_closing():
+            self.transport.resume_reading()
+
+    def connection_lost(self, error: Optional[Exception]) -> None:
+        if self._admission is not None and self._admitted:
+            self._admitted = False
+            self._admission.close()
+        super().connection_lost(error)
+
+    async def _handle_client(self) -> None:
+        if self._admission is not None:
+            status = self._admission.greeting(self._admitted)
+            if status is not None:
+                await self.push(status)
+                assert self.transport is not None
+                self.transport.close()
+                return
+        greeting = self._delays.get(GREETING)
+        if greeting is not None:
+            await asyncio.sleep(greeting.sample())
+        await super()._handle_client()
+
+    def _set_post_data_state(self) -> None:
+        # Called once the message has been received, before the response
+        delay = self._delays.get("DATA")
+        if delay is not None:
+            self._reply_delay = delay.sample()
+        super()._set_post_data_state()
+
+    async def push(self, status: AnyStr) -> None:
+        if self._reply_delay:
+            delay, self._reply_delay = self._reply_delay, 0.0
+            await asyncio.sleep(delay)
+        await super().push(status)
+
+    async def _call_handler_hook(self, command: str, *args: Any) -> Any:
+        if self._stats is None:
+            return await super()._call_handler_hook(command, *args)
+
+        start = time.perf_counter()
+        try:
+            return await super()._call_handler_hook(command, *args)
+        finally:
+            self._stats.record_handler(command, time.perf_counter() - start)
+
     @syntax('STARTTLS', when='tls_context')
     async def smtp_STARTTLS(self, arg: str) -> None:
         """Process the STARTTLS command when received.
@@ -73,22 +267,125 @@ class _SMTP(SMTP):
             log.info("STARTTLS received but TLS not configured")
             await self.push('454 TLS not available')
             return
+        if self._handshake_delay is not None:
+            # The client's hello is left unread while the handshake is
+            # stalled, start_tls() resumes reading.
+            assert self.transport is not None
+            self.transport.pause_reading()
         await self.push('220 Ready to start TLS')
 
         try:
             self._original_transport = self.transport
+            start = time.perf_counter()
+            if self._handshake_delay is not None:
+                await asyncio.sleep(self._handshake_delay.sample())
             new_transport = await self.loop.start_tls(
-                                       transport=self.transport,
-                                       protocol=self,
-                                       sslcontext=self.tls_context,
-                                       server_side=True,
-                                       ssl_handshake_timeout=5.0)
+                transport=self.transport,
+                protocol=self,
+                sslcontext=self.tls_context,
+                server_side=True,
+                ssl_handshake_timeout=self._handshake_timeout
+            )
             self._reader._transport = new_transport
             self._writer._transport = new_transport
             self._tls_protocol = new_transport.get_protocol()
+            if self._stats is not None:
+                ssl_object = new_transport.get_extra_info("ssl_object")
+                self._stats.record_handshake(time.perf_counter() - start,
+                                             ssl_object.session_reused)
             log.info("Connection upgraded to TLS after STARTTLS received")
 
         except asyncio.CancelledError:
             raise
         except Exception as error:
             raise TLSSetupException() from error
+
+    @syntax('DATA')
+    async def smtp_DATA(self, arg: str) -> None:
+        """Process the DATA command when received.
+
+        If the handler has a handle_DATA_CHUNK() hook the content is passed to
+        it in chunks of about CHUNK_SIZE bytes as it is received, after the
+        transparency dots are removed, rather than being held in memory until
+        the message is complete. The handle_DATA_END() hook, if there is one,
+        is then called for the status to return. If the message is rejected
+        for being too large or having too long a line, or the connection is
+        lost, the handle_DATA_ABORT() hook is called instead so that the
+        handler can discard the chunks it has received.
+
+        Handlers without handle_DATA_CHUNK() receive the whole message in
+        handle_DATA() as usual.
+        """
+        if "DATA_CHUNK" not in self._handle_hooks:
+            await super().smtp_DATA(arg)
+            return
+
+        if await self.check_helo_needed():
+            return
+        if await self.check_auth_needed("DATA"):
+            return
+        assert self.envelope is not None
+        if not self.envelope.rcpt_tos:
+            await self.push('503 Error: need RCPT command')
+            return
+        if arg:
+            await self.push('501 Syntax: DATA')
+            return
+
+        await self.push('354 End data with <CR><LF>.<CR><LF>')
+        chunk: List[bytes] = []
+        chunk_size = 0
+        num_bytes = 0
+        error: Optional[str] = None
+        # Whether the last read ended part way through a line
+        partial = False
+        # Losing the connection cancels the coroutine, as with aiosmtpd, so
+        # the loop only ends at the end of the data.
+        while self.transport is not None:  # pragma: no branch
+            try:
+                line = await self._reader.readuntil(b'\r\n')
+            except asyncio.CancelledError:
+                log.info('Connection lost during DATA')
+                self._writer.close()
+                if "DATA_ABORT" in self._handle_hooks:
+                    await self._call_handler_hook('DATA_ABORT')
+                raise
+            except asyncio.LimitOverrunError as e:
+                # The line exceeds the reader's limit. As with aiosmtpd the
+                # error is only sent once all of the data is received.
+                error = error or '500 Line too long (see RFC5321 4.5.3.1.6)'
+                line = await self._reader.read(e.consumed)
+
+            if not partial and line == b'.\r\n':
+                break
+            num_bytes += len(line)
+            if (
+                error is None
+                and self.data_size_limit
+                and num_bytes > self.data_size_limit
+            ):
+                error = '552 Error: Too much mail data'
+
+            if error is None:
+                if not partial and line.startswith(b'.'):
+                    line = line[1:]
+                chunk.append(line)
+                chunk_size += len(line)
+                if chunk_size >= CHUNK_SIZE:
+                    content = b''.join(chunk)
+                    chunk, chunk_size = [], 0
+                    await self._call_handler_hook('DATA_CHUNK', content)
+            partial = not line.endswith(b'\r\n')
+
+        if error is not None:
+            if "DATA_ABORT" in self._handle_hooks:
+                await self._call_handler_hook('DATA_ABORT')
+            self._set_post_data_state()
+            await self.push(error)
+            return
+
+        if chunk:
+            await self._call_handler_hook('DATA_CHUNK', b''.join(chunk))
+        status = await self._call_handler_hook('DATA_END')
+        self._set_post_data_state()
+        await self.push('250 OK' if status is MISSING else status)
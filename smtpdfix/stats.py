@@ -0,0 +1,130 @@
+import math
+from bisect import bisect_left
+from typing import Any, Dict, Tuple
+
+# The upper bounds, in seconds, of the buckets that durations are counted in.
+# Durations longer than the last bound are counted in a final overflow bucket.
+BUCKETS: Tuple[float, ...] = (0.0001, 0.00025, 0.0005,
+                              0.001, 0.0025, 0.005,
+                              0.01, 0.025, 0.05,
+                              0.1, 0.25, 0.5,
+                              1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram():
+    """Counts durations in fixed buckets so that recording a duration is cheap
+    and the memory used doesn't grow with the number of durations."""
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent: float) -> float:
+        """Returns the upper bound of the bucket containing the percentile,
+        `inf` if it is in the overflow bucket, or 0 if nothing has been
+        recorded."""
+        if not self.count:
+            return 0.0
+
+        rank = max(math.ceil(percent / 100 * self.count), 1)
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"count": self.count,
+                "total": self.total,
+                "buckets": dict(zip(BUCKETS + (math.inf,), self.counts))}
+
+    def __repr__(self) -> str:
+        return f"Histogram(count={self.count}, mean={self.mean:.6f})"
+
+
+class ServerStats():
+    """Counters and latency histograms for the sessions of a server.
+
+    The stats are recorded by the sessions on the server's event loop and
+    can be read, or reset, by tests at any time.
+
+    - `connections`: the number of connections accepted.
+    - `bytes_received`: the bytes received from clients, after decryption.
+    - `auth_success` and `auth_failure`: the number of AUTH commands that did
+      and did not authenticate the client.
+    - `commands`: a histogram of the time taken by each SMTP command, keyed by
+      the command. The time for DATA includes receiving the message.
+    - `handlers`: a histogram of the time taken by the handler for each hook,
+      such as DATA.
+    - `handshake`: a histogram of the time taken by TLS handshakes, both for
+      implicit TLS and STARTTLS.
+    - `tls_full` and `tls_resumed`: the number of TLS handshakes that were
+      full handshakes and that resumed an earlier session.
+    """
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        """Sets all of the counters and histograms back to zero."""
+        self.connections = 0
+        self.bytes_received = 0
+        self.auth_success = 0
+        self.auth_failure = 0
+        self.commands: Dict[str, Histogram] = {}
+        self.handlers: Dict[str, Histogram] = {}
+        self.handshake = Histogram()
+        self.tls_full = 0
+        self.tls_resumed = 0
+
+    def record_handshake(self, seconds: float, resumed: bool) -> None:
+        self.handshake.record(seconds)
+        if resumed:
+            self.tls_resumed += 1
+        else:
+            self.tls_full += 1
+
+    def record_command(self, command: str, seconds: float) -> None:
+        histogram = self.commands.get(command)
+        if histogram is None:
+            histogram = self.commands[command] = Histogram()
+        histogram.record(seconds)
+
+    def record_handler(self, hook: str, seconds: float) -> None:
+        histogram = self.handlers.get(hook)
+        if histogram is None:
+            histogram = self.handlers[hook] = Histogram()
+        histogram.record(seconds)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Returns the stats as a dictionary, for example to log them."""
+        def histograms(
+            values: Dict[str, Histogram]
+        ) -> Dict[str, Dict[str, Any]]:
+            return {name: value.as_dict() for name, value in values.items()}
+
+        return {"connections": self.connections,
+                "bytes_received": self.bytes_received,
+                "auth_success": self.auth_success,
+                "auth_failure": self.auth_failure,
+                "commands": histograms(self.commands),
+                "handlers": histograms(self.handlers),
+                "handshake": self.handshake.as_dict(),
+                "tls_full": self.tls_full,
+                "tls_resumed": self.tls_resumed}
+
+    def __repr__(self) -> str:
+        return (f"ServerStats(connections={self.connections}, "
+                f"bytes_received={self.bytes_received}, "
+                f"commands={sorted(self.commands)})")
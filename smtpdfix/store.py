@@ -0,0 +1,432 @@
+import asyncio
+import hashlib
+import logging
+import mmap
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from email.errors import HeaderParseError
+from email.header import decode_header, make_header
+from typing import (Awaitable, Callable, DefaultDict, Dict, Iterator, List,
+                    Optional, Tuple)
+
+from .records import MessageRecord
+
+log = logging.getLogger(__name__)
+
+RecordPredicate = Callable[[MessageRecord], bool]
+
+STORE_TYPES = ("memory", "spool", "sink")
+
+
+def _decode(value: Optional[str]) -> Optional[str]:
+    """Decode a header value which may use RFC 2047 encoded words."""
+    if value is None:
+        return None
+    try:
+        return str(make_header(decode_header(value))).strip()
+    except (HeaderParseError, LookupError, UnicodeError):
+        return str(value).strip()
+
+
+def _criterion(name: str, value: str) -> str:
+    """Normalise the value of a criterion in the same way as the values that
+    are indexed."""
+    if name in ("to", "sender"):
+        return value.lower()
+    if name in ("message_id", "subject"):
+        return value.strip()
+    return value
+
+
+def _contains(positions: List[int], position: int) -> bool:
+    """Check whether the sorted list of positions contains the position."""
+    i = bisect_left(positions, position)
+    return i < len(positions) and positions[i] == position
+
+
+class MessageStore():
+    """Holds the records of the messages received by the server in memory.
+
+    As records are added they are indexed by envelope recipient, envelope
+    sender, authenticated user, and the Message-ID and Subject headers so that
+    they can be found without scanning every message. Addresses are matched
+    without regard to case.
+
+    Threads and coroutines waiting for records, using `wait_for()` or
+    `wait_for_async()`, are woken as each record is added.
+    """
+    INDEXES = ("to", "sender", "auth_user", "message_id", "subject")
+
+    def __init__(self) -> None:
+        self._records: List[MessageRecord] = []
+        self._lock = threading.RLock()
+        self._added = threading.Condition(self._lock)
+        self._listeners: List[Callable[[], None]] = []
+        # Incremented when the store is cleared so waiters can start again
+        self._generation = 0
+        self._indexes: Dict[str, DefaultDict[str, List[int]]] = {
+            name: defaultdict(list) for name in self.INDEXES
+        }
+
+    def _index(self, position: int, record: MessageRecord) -> None:
+        headers = record.headers
+        keys: Dict[str, List[Optional[str]]] = {
+            "to": [addr.lower() for addr in record.rcpt_tos],
+            "sender": [(record.mail_from or "").lower()],
+            "auth_user": [record.auth_user],
+            "message_id": [_decode(headers.get("Message-ID"))],
+            "subject": [_decode(headers.get("Subject"))],
+        }
+        for name, values in keys.items():
+            for value in set(values):
+                if value is not None:
+                    self._indexes[name][value].append(position)
+
+    def append(self, record: MessageRecord) -> None:
+        with self._lock:
+            self._records.append(record)
+            self._index(len(self._records) - 1, record)
+            self._keep(record)
+            self._notify()
+
+    def _keep(self, record: MessageRecord) -> None:
+        """Called once the record has been indexed to decide where its content
+        is kept. By default it stays in memory."""
+
+    def _notify(self) -> None:
+        """Wakes the callers waiting for records. Must be called holding the
+        lock."""
+        self._added.notify_all()
+        for listener in self._listeners:
+            listener()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+            self._generation += 1
+            for index in self._indexes.values():
+                index.clear()
+
+    def _new_records(self,
+                     generation: int,
+                     checked: int) -> Tuple[int, List[MessageRecord]]:
+        """Returns the generation of the store and the records added since
+        `checked` records had been seen. If the store has been cleared all
+        of the records are returned."""
+        if generation != self._generation:
+            return self._generation, self._records.copy()
+        return generation, self._records[checked:]
+
+    def wait_for(self,
+                 count: int = 1,
+                 predicate: Optional[RecordPredicate] = None,
+                 timeout: Optional[float] = None) -> List[MessageRecord]:
+        """Block until at least `count` records matching the predicate, or
+        any records if there is no predicate, have been added. Returns the
+        matching records.
+
+        Raises:
+        - TimeoutError if the records are not added within `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        generation, checked = self._generation, 0
+        matched: List[MessageRecord] = []
+        while len(matched) < count:
+            with self._lock:
+                current, new = self._new_records(generation, checked)
+                while not new and current == generation:
+                    remaining = (None if deadline is None
+                                 else deadline - time.monotonic())
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(
+                            f"{count} messages not received in {timeout}s"
+                        )
+                    self._added.wait(remaining)
+                    current, new = self._new_records(generation, checked)
+
+            if current != generation:
+                generation, checked, matched = current, 0, []
+            checked += len(new)
+            # The predicate is checked without holding the lock so that the
+            # server isn't blocked while messages are parsed.
+            matched.extend(r for r in new if predicate is None or predicate(r))
+        return matched
+
+    async def wait_for_async(
+        self,
+        count: int = 1,
+        predicate: Optional[RecordPredicate] = None,
+        timeout: Optional[float] = None
+    ) -> List[MessageRecord]:
+        """The awaitable equivalent of `wait_for()`, which is woken by the
+        server's event loop rather than blocking the caller's.
+
+        Raises:
+        - TimeoutError if the records are not added within `timeout` seconds.
+        """
+        async def wait(added: asyncio.Event) -> List[MessageRecord]:
+            generation, checked = self._generation, 0
+            matched: List[MessageRecord] = []
+            while len(matched) < count:
+                added.clear()
+                with self._lock:
+                    current, new = self._new_records(generation, checked)
+                if current != generation:
+                    generation, checked, matched = current, 0, []
+                checked += len(new)
+                matched.extend(r for r in new
+                               if predicate is None or predicate(r))
+                if len(matched) < count:
+                    await added.wait()
+            return matched
+
+        return await self._wait_async(wait, count, timeout)
+
+    async def _wait_async(
+        self,
+        wait: Callable[[asyncio.Event], Awaitable[List[MessageRecord]]],
+        count: int,
+        timeout: Optional[float]
+    ) -> List[MessageRecord]:
+        """Awaits `wait`, passing it an event that is set each time a record
+        is added."""
+        loop = asyncio.get_running_loop()
+        added = asyncio.Event()
+
+        def listener() -> None:
+            loop.call_soon_threadsafe(added.set)
+
+        with self._lock:
+            self._listeners.append(listener)
+        try:
+            return await asyncio.wait_for(wait(added), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(
+                f"{count} messages not received in {timeout}s"
+            ) from None
+        finally:
+            with self._lock:
+                self._listeners.remove(listener)
+
+    def copy(self) -> List[MessageRecord]:
+        return self._records.copy()
+
+    def find(self, **criteria: str) -> List[MessageRecord]:
+        """Returns the records, in the order received, matching all of the
+        criteria. The criteria are any of `to`, `sender`, `auth_user`,
+        `message_id` and `subject`. Addresses are matched ignoring case, and
+        the Message-ID and subject ignoring surrounding whitespace.
+
+        Example:
+            store.find(to="to.addr@example.org", subject="Foo")
+
+        Raises:
+        - TypeError if a criterion is not one of the indexes.
+        """
+        for name in criteria:
+            if name not in self._indexes:
+                raise TypeError(f"find() got an unexpected criterion {name}")
+
+        with self._lock:
+            postings = []
+            for name, value in criteria.items():
+                postings.append(
+                    self._indexes[name].get(_criterion(name, value), [])
+                )
+            if not postings:
+                return self._records.copy()
+
+            # Positions are added in order so each list is sorted and the
+            # positions in the smallest can be searched for in the others.
+            postings.sort(key=len)
+            return [self._records[position]
+                    for position in postings[0]
+                    if all(_contains(p, position) for p in postings[1:])]
+
+    def get(self, message_id: str) -> Optional[MessageRecord]:
+        """Returns the first record with the Message-ID, or `None` if there
+        is no such record."""
+        with self._lock:
+            positions = self._indexes["message_id"].get(
+                _criterion("message_id", message_id)
+            )
+            return self._records[positions[0]] if positions else None
+
+    def __getitem__(self, index: int) -> MessageRecord:
+        return self._records[index]
+
+    def __iter__(self) -> Iterator[MessageRecord]:
+        return iter(self._records.copy())
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
+class _Spool():
+    """A temporary file that message content is appended to and read back
+    from through a memory map."""
+    def __init__(self, directory: Optional[str] = None) -> None:
+        self._file = tempfile.TemporaryFile(dir=directory)
+        self._map: Optional[mmap.mmap] = None
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def write(self, content: bytes) -> int:
+        """Append the content to the spool and return its offset."""
+        with self._lock:
+            offset = self.size
+            self._file.seek(offset)
+            self._file.write(content)
+            self.size += len(content)
+            return offset
+
+    def read(self, offset: int, length: int) -> bytes:
+        if not length:
+            return b""
+        with self._lock:
+            if self._map is None or len(self._map) < offset + length:
+                # The spool has grown since it was mapped
+                self._file.flush()
+                if self._map is not None:
+                    self._map.close()
+                self._map = mmap.mmap(self._file.fileno(),
+                                      0,
+                                      access=mmap.ACCESS_READ)
+            return self._map[offset:offset + length]
+
+
+class SpoolStore(MessageStore):
+    """Holds the records of the messages received by the server, writing the
+    content of messages to a temporary spool file once the content held in
+    memory exceeds `max_memory` bytes. The envelope of each message is always
+    kept in memory.
+
+    Spooled content is read back from the file through a memory map when the
+    record's content or message are accessed.
+    """
+    def __init__(self,
+                 max_memory: int = 2**24,
+                 directory: Optional[str] = None) -> None:
+        super().__init__()
+        self.max_memory = max_memory
+        self.memory_size = 0
+        self._directory = directory
+        self._spool = _Spool(directory)
+
+    @property
+    def spool_size(self) -> int:
+        """The number of bytes written to the spool file."""
+        return self._spool.size
+
+    def _keep(self, record: MessageRecord) -> None:
+        # The record is spooled after it's indexed so that the headers are
+        # read while the content is still in memory.
+        if self.memory_size + record.size > self.max_memory:
+            offset = self._spool.write(record.content)
+            record._spooled(self._spool, offset)
+        else:
+            self.memory_size += record.size
+
+    def clear(self) -> None:
+        super().clear()
+        # Records that have already been copied still refer to the old spool
+        # so it is replaced rather than truncated.
+        self._spool = _Spool(self._directory)
+        self.memory_size = 0
+
+
+class SinkStore(MessageStore):
+    """Counts the messages received by the server, and their size, without
+    keeping them, for load tests where the content doesn't matter. If the
+    name of a `hashlib` algorithm is given as `digest` a rolling digest of the
+    content of every message is kept as well.
+
+    As the records are discarded iterating over the store, `find()` and
+    `get()` return nothing, and `wait_for()` only waits for the number of
+    messages.
+    """
+    def __init__(self, digest: Optional[str] = None) -> None:
+        super().__init__()
+        self.digest_name = digest
+        self.clear()
+
+    def append(self, record: MessageRecord) -> None:
+        with self._lock:
+            self.count += 1
+            self.total_bytes += record.size
+            if self._digest is not None:
+                self._digest.update(record.content)
+            self._notify()
+
+    def clear(self) -> None:
+        super().clear()
+        self.count = 0
+        self.total_bytes = 0
+        self._digest = (hashlib.new(self.digest_name)
+                        if self.digest_name else None)
+
+    @property
+    def digest(self) -> Optional[str]:
+        """The hex digest of the content of all of the messages received, in
+        order, or `None` if a digest isn't kept."""
+        return self._digest.hexdigest() if self._digest is not None else None
+
+    def wait_for(self,
+                 count: int = 1,
+                 predicate: Optional[RecordPredicate] = None,
+                 timeout: Optional[float] = None) -> List[MessageRecord]:
+        """Block until at least `count` messages have been received. As the
+        messages aren't kept an empty list is returned.
+
+        Raises:
+        - TypeError if a predicate is given.
+        - TimeoutError if the messages are not received within `timeout`
+          seconds.
+        """
+        _check_no_predicate(predicate)
+        with self._lock:
+            if not self._added.wait_for(lambda: self.count >= count, timeout):
+                raise TimeoutError(
+                    f"{count} messages not received in {timeout}s"
+                )
+        return []
+
+    async def wait_for_async(
+        self,
+        count: int = 1,
+        predicate: Optional[RecordPredicate] = None,
+        timeout: Optional[float] = None
+    ) -> List[MessageRecord]:
+        _check_no_predicate(predicate)
+
+        async def wait(added: asyncio.Event) -> List[MessageRecord]:
+            while True:
+                added.clear()
+                if self.count >= count:
+                    return []
+                await added.wait()
+
+        return await self._wait_async(wait, count, timeout)
+
+    def __len__(self) -> int:
+        return self.count
+
+
+def _check_no_predicate(predicate: Optional[RecordPredicate]) -> None:
+    if predicate is not None:
+        raise TypeError("The messages in a sink can't be matched against a "
+                        "predicate as they aren't kept")
+
+
+def _create_store(store_type: str,
+                  max_memory: int,
+                  digest: Optional[str] = None) -> MessageStore:
+    """Create a store of the type, one of the STORE_TYPES."""
+    if store_type == "spool":
+        return SpoolStore(max_memory=max_memory)
+    if store_type == "sink":
+        return SinkStore(digest=digest)
+    return MessageStore()
@@ -0,0 +1,121 @@
+import errno
+import logging
+from os import stat, strerror
+from pathlib import Path
+from ssl import (CERT_NONE, OP_NO_TICKET, Purpose, SSLContext, VerifyMode,
+                 create_default_context)
+from stat import S_ISREG
+from typing import Dict, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, Optional[str], int, Optional[int], VerifyMode]
+
+
+def _stat_file(file_: Optional[str]) -> Tuple[str, int]:
+    """Returns the path of the file and its modification time, with a single
+    call to stat() as this is done for every connection."""
+    # NB: the paths are returned as strings becuase PYPY3 doesn't
+    # support paths in sslcontext.load_cert_chain()
+    if file_:
+        path = str(Path(file_))
+        try:
+            result = stat(path)
+        except OSError:
+            pass
+        else:
+            if S_ISREG(result.st_mode):
+                return path, result.st_mtime_ns
+
+    raise FileNotFoundError(errno.ENOENT, strerror(errno.ENOENT), file_)
+
+
+def _set_session_tickets(context: SSLContext, tickets: int) -> None:
+    """Sets the number of session tickets the server issues, without tickets
+    TLS 1.2 sessions can only be resumed from the server's session cache."""
+    if tickets:
+        context.options &= ~OP_NO_TICKET
+    else:
+        context.options |= OP_NO_TICKET
+    # num_tickets was added in Python 3.8 and isn't available with every
+    # implementation of the ssl module.
+    if hasattr(context, "num_tickets"):
+        context.num_tickets = tickets
+
+
+class SSLContextCache():
+    """Holds the server `SSLContext` for a certificate and key so that the
+    files are only read and parsed once rather than for every connection.
+
+    Contexts are keyed by the path and modification time of the certificate
+    and key files, so that a file replaced on disk results in a new context,
+    and by the verify mode, so that a context is never changed after it's
+    shared. Only the contexts for the latest version of the files are kept.
+    The number of `hits` and `misses` are counted to confirm that contexts
+    are being reused.
+
+    Reusing a context also lets clients resume their TLS sessions, either
+    with session tickets or from the session cache that OpenSSL keeps for
+    each context, rather than performing a full handshake.
+    """
+    def __init__(self) -> None:
+        self._contexts: Dict[CacheKey, SSLContext] = {}
+        # The number of session tickets set on each context
+        self._tickets: Dict[CacheKey, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self,
+            cert_file: Optional[str],
+            key_file: Optional[str] = None,
+            session_tickets: int = 2,
+            verify_mode: VerifyMode = CERT_NONE) -> SSLContext:
+        """Returns the context for the certificate and key files, and the
+        verify mode for client certificates, creating it if it is not already
+        cached. `session_tickets` is the number of TLS 1.3 session tickets
+        issued after each full handshake, with 0 disabling tickets.
+
+        Raises:
+        - FileNotFoundError if the certificate or key file does not exist.
+        """
+        cert_path, cert_mtime = _stat_file(cert_file)
+        key_path, key_mtime = (_stat_file(key_file) if key_file
+                               else (None, None))
+        key = (cert_path, key_path, cert_mtime, key_mtime, verify_mode)
+
+        context = self._contexts.get(key)
+        if context is not None:
+            self.hits += 1
+            # The context is shared by the sessions so it's only changed
+            # when the number of tickets is
+            if self._tickets[key] != session_tickets:
+                _set_session_tickets(context, session_tickets)
+                self._tickets[key] = session_tickets
+            return context
+
+        self.misses += 1
+        # The contexts for earlier versions of the files won't be used again
+        for stale in [k for k in self._contexts
+                      if k[:2] == key[:2] and k[2:4] != key[2:4]]:
+            del self._contexts[stale]
+            del self._tickets[stale]
+
+        log.debug(f"Creating SSLContext for {cert_path}")
+        context = create_default_context(Purpose.CLIENT_AUTH)
+        context.check_hostname = False
+        context.load_verify_locations(cert_path)
+        context.load_cert_chain(cert_path, keyfile=key_path)
+        context.verify_mode = verify_mode
+        _set_session_tickets(context, session_tickets)
+        self._contexts[key] = context
+        self._tickets[key] = session_tickets
+        return context
+
+    def clear(self) -> None:
+        """Discard all of the cached contexts."""
+        self._contexts.clear()
+        self._tickets.clear()
+
+    def reset_counters(self) -> None:
+        self.hits = 0
+        self.misses = 0
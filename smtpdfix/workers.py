@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from multiprocessing.process import BaseProcess
+from queue import Empty
+from typing import Any, List, Optional
+
+from .authenticator import Authenticator
+from .configuration import Config
+from .controller import AsyncAuthController, _bind_sockets, _ReceivedMessages
+from .export import _create_export
+from .fixture import _Authenticator
+from .loops import _new_event_loop
+from .records import MessageRecord
+from .store import MessageStore, _create_store
+
+log = logging.getLogger(__name__)
+
+
+class _ForwardingStore(MessageStore):
+    """Sends the records of the messages received by a worker to the parent
+    process rather than keeping them."""
+    def __init__(self, queue: Any) -> None:
+        super().__init__()
+        self._queue = queue
+
+    def append(self, record: MessageRecord) -> None:
+        self._queue.put(record)
+
+
+def _serve(config: Config,
+           authenticator: Optional[Authenticator],
+           records: Any,
+           status: Any,
+           stop: Any) -> None:
+    """Runs a worker, listening on the port shared by all of the workers,
+    until `stop` is set. `None` is put on the status queue once the worker is
+    listening, or the exception if it fails to start."""
+    async def serve() -> None:
+        config.reuse_port = True
+        # The messages are exported by the parent, rather than by every
+        # worker writing to the same file
+        config.export_path = None
+        controller = AsyncAuthController(config=config,
+                                         authenticator=authenticator,
+                                         messages=_ForwardingStore(records))
+        await controller.start_async()
+        status.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+        await controller.stop_async()
+
+    loop = _new_event_loop(config.event_loop)
+    try:
+        loop.run_until_complete(serve())
+    except Exception as error:
+        status.put(error)
+    finally:
+        loop.close()
+
+
+class WorkerController(_ReceivedMessages):
+    """Runs the server in several processes listening on the same port, using
+    SO_REUSEPORT, so that handling connections is spread across cores rather
+    than limited to the single event loop of `AuthController`.
+
+    The messages received by the workers are sent back to this process and
+    kept in a single store, created as set by the config, so they can be
+    accessed, and exported, in the same way as with `AuthController`. The
+    config is copied to the workers when they start, changes made to it
+    afterwards don't apply until the workers are restarted.
+
+    Only the messages are sent back. The statistics and admission counters
+    are kept by each worker, and lost when it stops, so they aren't
+    available as they are with `AuthController`.
+
+    Raises:
+    - RuntimeError if SO_REUSEPORT is not supported by the platform.
+    """
+    def __init__(self,
+                 workers: Optional[int] = None,
+                 hostname: Optional[str] = None,
+                 port: Optional[int] = None,
+                 config: Optional[Config] = None,
+                 authenticator: Optional[Authenticator] = None) -> None:
+        if not hasattr(socket, "SO_REUSEPORT"):  # pragma: no cover
+            raise RuntimeError("SO_REUSEPORT is not supported on this "
+                               "platform")
+
+        self.config = config or Config()
+        if hostname is not None:
+            self.config.host = hostname
+        if port is not None:
+            self.config.port = port
+        self.workers = workers or os.cpu_count() or 1
+        # The same default as SMTPDFix, the login set by the config
+        self._authenticator = authenticator or _Authenticator(self.config)
+        self._messages = _create_store(self.config.message_store,
+                                       self.config.spool_max_memory,
+                                       self.config.sink_digest)
+        self._export = _create_export(self.config.export_path,
+                                      self.config.export_format,
+                                      self.config.export_batch_size,
+                                      self.config.export_rotate_bytes)
+        # Workers are spawned, rather than forked, as the parent process is
+        # likely to be running other threads.
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: List[BaseProcess] = []
+        self._collector: Optional[threading.Thread] = None
+        self._reservation: List[socket.socket] = []
+
+    @property
+    def hostname(self) -> Optional[str]:
+        return self.config.host
+
+    @property
+    def port(self) -> int:
+        return self.config.port
+
+    def start(self) -> None:
+        """Starts the workers, returning once they are all listening.
+
+        Raises:
+        - TimeoutError if the workers don't start within the ready_timeout.
+        - The exception raised by a worker that failed to start.
+        """
+        assert not self._processes, "SMTP workers already running"
+        if self.config.port == 0:
+            # The port is kept bound, without listening, until the workers
+            # stop so that it isn't taken in the meantime.
+            self._reservation = _bind_sockets(self.config.host,
+                                              reuse_port=True)
+            self.config.port = self._reservation[0].getsockname()[1]
+
+        records = self._context.Queue()
+        status = self._context.Queue()
+        self._records = records
+        self._stop = self._context.Event()
+        self._collector = threading.Thread(target=self._collect,
+                                           args=(records,),
+                                           daemon=True)
+        self._collector.start()
+
+        for _ in range(self.workers):
+            process = self._context.Process(target=_serve,
+                                            args=(self.config,
+                                                  self._authenticator,
+                                                  records,
+                                                  status,
+                                                  self._stop),
+                                            daemon=True)
+            process.start()
+            self._processes.append(process)
+
+        deadline = time.monotonic() + self.config.ready_timeout
+        for _ in range(self.workers):
+            try:
+                error = status.get(timeout=max(deadline - time.monotonic(), 0))
+            except Empty:
+                self.stop()
+                raise TimeoutError("SMTP workers failed to start within the "
+                                   "allotted time") from None
+            if error is not None:
+                self.stop()
+                raise error
+        log.info(f"SMTPDFix running {self.workers} workers on "
+                 f"{self.hostname}:{self.port}")
+
+    def stop(self) -> None:
+        """Stops the workers, once all of the messages they received have
+        been added to the store."""
+        assert self._processes, "SMTP workers not running"
+        self._stop.set()
+        for process in self._processes:
+            process.join(self.config.ready_timeout)
+            if process.is_alive():  # pragma: no cover
+                process.terminate()
+                process.join()
+        self._processes = []
+
+        # The workers have exited so all of the records they sent precede this
+        self._records.put(None)
+        assert self._collector is not None
+        self._collector.join()
+        self._collector = None
+        if self._export is not None:
+            self._export.close()
+        for sock in self._reservation:
+            sock.close()
+        self._reservation = []
+
+    def _collect(self, records: Any) -> None:
+        """Adds the records sent by the workers to the store until stopped."""
+        while True:
+            record = records.get()
+            if record is None:
+                return
+            self._messages.append(record)
+            if self._export is not None:
+                self._export.add(record)
@@ -1,9 +1,12 @@
 import os
 from email.message import EmailMessage
-from typing import List, NamedTuple
+from typing import TYPE_CHECKING, List, NamedTuple
 
 import pytest
 
+if TYPE_CHECKING:  # pragma: no cover
+    from smtpdfix.records import MessageRecord
+
 # Because we need to test the fixture we include the plugin here, but generally
 # this is not necessary and the fixture is loaded automatically.
 pytest_plugins = ["smtpdfix", "pytester"]
@@ -14,6 +17,16 @@ class User(NamedTuple):
     password: str
 
 
+def make_record(content: bytes) -> "MessageRecord":
+    """A record of a message received from and sent to the usual test
+    addresses."""
+    # Imported here so that the plugin isn't imported before pytest loads it
+    from smtpdfix.records import MessageRecord
+    return MessageRecord(content=content,
+                         mail_from="from.addr@example.org",
+                         rcpt_tos=["to.addr@example.org"])
+
+
 def pytest_collection_modifyitems(items: List[pytest.Item]) -> None:
     # Mark each test as timing out after 10 seconds to prevent the server
     # hanging on errors. Note that this can lead to the entire test run
@@ -0,0 +1,165 @@
+from smtplib import SMTP, SMTPConnectError, SMTPServerDisconnected
+
+import pytest
+
+from smtpdfix.admission import (AdmissionControl, Failure, TokenBucket,
+                                _parse_failure, _parse_failures)
+from smtpdfix.configuration import Config
+from smtpdfix.controller import AuthController
+from tests.conftest import User
+
+
+@pytest.mark.parametrize("value, expected", [
+    (0.5, Failure(probability=0.5)),
+    ("0.1", Failure(probability=0.1)),
+    ("0.1:421", Failure(probability=0.1, code=421)),
+    ("every:3", Failure(every=3)),
+    ("Every:3:450", Failure(every=3, code=450)),
+    (Failure(every=2), Failure(every=2)),
+])
+def test_parse_failure(value: object, expected: Failure) -> None:
+    assert _parse_failure(value) == expected  # type: ignore
+
+
+@pytest.mark.parametrize("value", ["", "1.5", "every", "every:-1",
+                                   "0.1:550", "every:1:2:3"])
+def test_parse_failure_invalid(value: str) -> None:
+    with pytest.raises(ValueError):
+        _parse_failure(value)
+
+
+def test_parse_failures() -> None:
+    assert _parse_failures(None) == {}
+    assert _parse_failures("mail=0.5, GREETING=every:2") == {
+        "MAIL": Failure(probability=0.5),
+        "GREETING": Failure(every=2),
+    }
+    with pytest.raises(ValueError):
+        _parse_failures("MAIL")
+
+
+def test_token_bucket() -> None:
+    bucket = TokenBucket(2)
+    assert bucket.take(0, 2)
+    assert bucket.take(0, 2)
+    assert not bucket.take(0, 2)
+    # A high rate refills the bucket almost immediately
+    assert bucket.take(1e9, 2)
+
+
+def test_probabilistic_failures() -> None:
+    config = Config()
+    config.failures = {"RCPT": 0.5}
+    admission = AdmissionControl(config)
+    bucket = admission.bucket()
+    results = [admission.check("RCPT", bucket) for _ in range(1000)]
+    failures = sum(result is not None for result in results)
+    assert 350 < failures < 650
+    assert admission.failures["RCPT"] == failures
+
+
+def test_admission_reset() -> None:
+    config = Config()
+    config.update(failures="RCPT=every:2", message_rate=1, message_burst=1,
+                  rate_limit_by="user")
+    admission = AdmissionControl(config)
+    admission.open()
+    bucket = admission.bucket()
+    assert admission.check("RCPT", bucket) is None
+    assert admission.check("RCPT", bucket) is not None
+    assert admission.check("MAIL", bucket, user="user") is None
+    assert admission.check("MAIL", bucket, user="user") is not None
+
+    admission.reset()
+    assert (admission.rejected, admission.rate_limited) == (0, 0)
+    assert admission.failures == {}
+    # The open session is still counted, and the user's rate limit refilled
+    assert admission.sessions == 1
+    assert admission.check("RCPT", bucket) is None
+    assert admission.check("MAIL", bucket, user="user") is None
+
+
+def test_max_sessions(smtpd: AuthController) -> None:
+    smtpd.config.max_sessions = 1
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        assert client.noop()[0] == 250
+        with pytest.raises(SMTPConnectError) as error:
+            SMTP(smtpd.hostname, smtpd.port)
+        assert error.value.smtp_code == 421
+    assert smtpd.admission.rejected == 1
+
+    # The session is counted as closed once the client disconnects
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        assert client.noop()[0] == 250
+
+
+def test_message_rate(smtpd: AuthController) -> None:
+    smtpd.config.update(message_rate=0.01, message_burst=2)
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.ehlo()
+        for _ in range(2):
+            assert client.mail("from.addr@example.org")[0] == 250
+            client.rset()
+        assert client.mail("from.addr@example.org")[0] == 451
+
+    # Each connection has a bucket of its own
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.ehlo()
+        assert client.mail("from.addr@example.org")[0] == 250
+    assert smtpd.admission.rate_limited == 1
+
+
+def test_message_rate_by_user(smtpd: AuthController, user: User) -> None:
+    smtpd.config.update(message_rate=0.01,
+                        rate_limit_by="user",
+                        auth_require_tls=False)
+    for expected in (250, 451):
+        with SMTP(smtpd.hostname, smtpd.port) as client:
+            client.login(user.username, user.password)
+            assert client.mail("from.addr@example.org")[0] == expected
+
+
+def test_deterministic_failures(smtpd: AuthController) -> None:
+    smtpd.config.failures = "RCPT=every:2"
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.ehlo()
+        client.mail("from.addr@example.org")
+        codes = [client.rcpt("to.addr@example.org")[0] for _ in range(4)]
+    assert codes == [250, 451, 250, 451]
+
+
+def test_failure_closes_connection(smtpd: AuthController) -> None:
+    smtpd.config.failures = {"MAIL": "1:421"}
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.ehlo()
+        assert client.mail("from.addr@example.org")[0] == 421
+        with pytest.raises(SMTPServerDisconnected):
+            client.noop()
+
+
+def test_greeting_failure(smtpd: AuthController) -> None:
+    smtpd.config.failures = {"GREETING": "every:1"}
+    with pytest.raises(SMTPConnectError) as error:
+        SMTP(smtpd.hostname, smtpd.port)
+    assert error.value.smtp_code == 421
+    assert smtpd.admission.failures["GREETING"] == 1
+
+
+def test_counters_kept_on_reset(smtpd: AuthController) -> None:
+    smtpd.config.failures = "RCPT=every:2"
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.ehlo()
+        client.mail("from.addr@example.org")
+        client.rcpt("to.addr@example.org")
+        client.rcpt("to.addr@example.org")
+    admission = smtpd.admission
+
+    smtpd.reset()
+    assert smtpd.admission is admission
+    assert smtpd.admission.failures["RCPT"] == 1
+    # The count of commands continues from before the restart
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.ehlo()
+        client.mail("from.addr@example.org")
+        assert client.rcpt("to.addr@example.org")[0] == 250
+        assert client.rcpt("to.addr@example.org")[0] == 451
@@ -0,0 +1,116 @@
+from pathlib import Path
+from smtplib import SMTP, SMTPAuthenticationError
+
+import pytest
+
+from smtpdfix import AuthController, CredentialStore, SMTPDFix
+
+users = {f"user{n}": f"password{n}" for n in range(1000)}
+
+
+def test_credential_store() -> None:
+    credentials = CredentialStore({"alice": "secret"})
+    credentials.add("bob", "hunter2")
+    credentials.update({"carol": "s3cr3t"})
+
+    assert len(credentials) == 3
+    assert "bob" in credentials
+    assert sorted(credentials) == ["alice", "bob", "carol"]
+    assert credentials.validate("alice", "secret")
+    assert not credentials.validate("alice", "hunter2")
+    assert not credentials.validate("dave", "secret")
+    assert credentials.verify("carol")
+    assert credentials.get_password("bob") == "hunter2"
+
+    credentials.remove("bob")
+    assert not credentials.verify("bob")
+    assert credentials.cram_md5("bob") is None
+    with pytest.raises(KeyError):
+        credentials.get_password("bob")
+
+
+def test_cram_md5_key_reused() -> None:
+    credentials = CredentialStore({"alice": "secret"})
+    first = credentials.cram_md5("alice")
+    second = credentials.cram_md5("alice")
+    assert first is not None and second is not None
+    first.update(b"<challenge>")
+    second.update(b"<challenge>")
+    assert first.hexdigest() == second.hexdigest()
+
+
+def test_from_file(tmp_path: Path) -> None:
+    path = tmp_path.joinpath("users")
+    path.write_text("# Test users\n"
+                    "alice:secret\n"
+                    "\n"
+                    "bob:pass:word\n")
+    credentials = CredentialStore.from_file(path)
+    assert credentials.get_password("alice") == "secret"
+    assert credentials.get_password("bob") == "pass:word"
+    assert len(credentials) == 2
+
+
+def test_from_file_invalid(tmp_path: Path) -> None:
+    path = tmp_path.joinpath("users")
+    path.write_text("alice:secret\nbob\n")
+    with pytest.raises(ValueError, match=":2 "):
+        CredentialStore.from_file(path)
+
+
+@pytest.mark.parametrize("mechanism", ["LOGIN", "CRAM-MD5"])
+def test_many_users(smtpd: AuthController, mechanism: str) -> None:
+    smtpd.config.auth_require_tls = False
+    smtpd.authenticator = CredentialStore(users)
+
+    for username in ("user0", "user999"):
+        with SMTP(smtpd.hostname, smtpd.port) as client:
+            client.user, client.password = username, users[username]
+            client.ehlo()
+            auth = (client.auth_login if mechanism == "LOGIN"
+                    else client.auth_cram_md5)
+            code, _ = client.auth(mechanism, auth)
+            assert code == 235
+
+
+def test_unknown_user_cram_md5(smtpd: AuthController) -> None:
+    smtpd.config.auth_require_tls = False
+    smtpd.authenticator = CredentialStore(users)
+
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.user, client.password = "user1000", "password1000"
+        client.ehlo()
+        with pytest.raises(SMTPAuthenticationError):
+            client.auth("CRAM-MD5", client.auth_cram_md5)
+
+
+class DuckAuthenticator():
+    """An authenticator that doesn't subclass Authenticator."""
+    def validate(self, username: str, password: str) -> bool:
+        return (username, password) == ("alice", "secret")
+
+    def verify(self, username: str) -> bool:
+        return username == "alice"
+
+    def get_password(self, username: str) -> str:
+        return "secret"
+
+
+def test_cram_md5_duck_typed(smtpd: AuthController) -> None:
+    smtpd.config.auth_require_tls = False
+    smtpd.authenticator = DuckAuthenticator()  # type: ignore
+
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.user, client.password = "alice", "secret"
+        client.ehlo()
+        code, _ = client.auth("CRAM-MD5", client.auth_cram_md5)
+        assert code == 235
+
+
+def test_smtpdfix_authenticator() -> None:
+    credentials = CredentialStore({"alice": "secret"})
+    with SMTPDFix(authenticator=credentials) as smtpd:
+        smtpd.config.auth_require_tls = False
+        assert smtpd.authenticator is credentials
+        with SMTP(smtpd.hostname, smtpd.port) as client:
+            assert client.login("alice", "secret")
@@ -0,0 +1,78 @@
+from pathlib import Path
+
+import pytest
+
+from benchmarks.suite import (Scenario, _message, _percentile, compare, main,
+                              run_scenario)
+from smtpdfix.certs import _generate_certs
+
+
+def test_message_size() -> None:
+    assert len(_message(1024)) == 1024
+
+
+def test_percentile() -> None:
+    samples = list(range(1, 101))
+    assert _percentile(samples, 50) == 50
+    assert _percentile(samples, 99) == 99
+    assert _percentile([5.0], 99) == 5.0
+
+
+def test_run_scenario(tmp_path: Path) -> None:
+    cert, _ = _generate_certs(tmp_path)
+    result = run_scenario(Scenario("starttls", "CRAM-MD5", 1024),
+                          clients=2,
+                          connections=1,
+                          messages=2,
+                          cert_file=str(cert))
+    assert result["messages_per_sec"] > 0
+    assert result["handshake_ms"] > 0
+    assert result["handshakes_per_sec"] > 0
+    assert result["latency_p50_ms"] <= result["latency_p99_ms"]
+
+
+@pytest.mark.parametrize("mode", ["ssl", "starttls"])
+def test_run_scenario_resume(tmp_path: Path, mode: str) -> None:
+    cert, _ = _generate_certs(tmp_path)
+    result = run_scenario(Scenario(mode, "none", 1024),
+                          clients=1,
+                          connections=4,
+                          messages=1,
+                          cert_file=str(cert),
+                          resume=True)
+    # Only the first connection performs a full handshake
+    assert result["resumed_fraction"] == 0.75
+    assert result["handshakes_per_sec"] > 0
+
+
+def test_compare() -> None:
+    baseline = {"plain/none/1024": {"messages_per_sec": 100.0,
+                                    "latency_p99_ms": 10.0}}
+    results = {"plain/none/1024": {"messages_per_sec": 95.0,
+                                   "latency_p99_ms": 12.0}}
+    regression, = compare(results, baseline, threshold=0.1)
+    assert regression.startswith("plain/none/1024 latency_p99_ms")
+    assert compare(results, baseline, threshold=0.5) == []
+
+
+def test_main(tmp_path: Path) -> None:
+    output = tmp_path.joinpath("results.json")
+    args = ["--quick", "--modes", "plain", "--auth", "PLAIN", "--clients",
+            "1", "--output", str(output)]
+    assert main(args) == 0
+    assert output.is_file()
+    assert main(args + ["--compare", str(output), "--threshold", "10"]) == 0
+
+
+def test_compare_event_loop(tmp_path: Path) -> None:
+    pytest.importorskip("uvloop")
+    baseline = tmp_path.joinpath("asyncio.json")
+    args = ["--quick", "--modes", "plain", "ssl", "--auth", "none",
+            "--clients", "1"]
+    assert main(args + ["--output", str(baseline)]) == 0
+    # The threshold is high so that the comparison is reported without
+    # failing on a noisy runner
+    assert main(args + ["--loop", "uvloop",
+                        "--output", str(tmp_path.joinpath("uvloop.json")),
+                        "--compare", str(baseline),
+                        "--threshold", "10"]) == 0
@@ -1,12 +1,15 @@
 import functools
+import pickle
 from pathlib import Path  # noqa: F401
 from typing import Any, Generator, List
 from unittest.mock import MagicMock, patch
 
 import pytest
 
+from smtpdfix.admission import Failure
 from smtpdfix.configuration import Config, _strtobool
 from smtpdfix.event_handler import EventHandler
+from smtpdfix.latency import Delay
 
 values = [
     ("host", "mail.localhost", "mail.localhost", str),
@@ -31,11 +34,48 @@ values = [
         "./certs/key.pem",
         ("./certs/key.pem", None),
         tuple),
+    ("cert_key_type", "ec", "ec", str),
+    ("cert_key_type", "Ed25519", "ed25519", str),
+    ("message_store", "Spool", "spool", str),
+    ("spool_max_memory", "1024", 1024, int),
+    ("sink_digest", "SHA256", "sha256", str),
+    ("event_loop", "UVLoop", "uvloop", str),
+    ("delays", "ehlo=0.5", {"EHLO": Delay(0.5)}, dict),
+    ("read_bandwidth", "1024", 1024, int),
+    ("handshake_delay", "normal:1:0.5", Delay(1.0, 0.5, "normal"), Delay),
+    ("max_sessions", "10", 10, int),
+    ("message_rate", "2.5", 2.5, float),
+    ("message_burst", "5", 5, int),
+    ("rate_limit_by", "User", "user", str),
+    ("failures", "mail=every:3", {"MAIL": Failure(every=3)}, dict),
+    ("backlog", "1024", 1024, int),
+    ("reuse_port", "True", True, bool),
+    ("handshake_timeout", "2", 2.0, float),
+    ("session_timeout", 30, 30.0, float),
+    ("data_size_limit", "1024", 1024, int),
+    ("command_call_limit", "10", 10, int),
+    ("command_call_limit", "mail=5, *=10", {"MAIL": 5, "*": 10}, dict),
+    ("command_call_limit", {"rcpt": 100}, {"RCPT": 100}, dict),
+    ("tls_session_tickets", "0", 0, int),
+    ("export_path", Path("messages.mbox"), "messages.mbox", str),
+    ("export_format", "Maildir", "maildir", str),
+    ("export_batch_size", "10", 10, int),
+    ("export_rotate_bytes", "1024", 1024, int),
     ("use_starttls", False, False, bool),
     ("use_tls", True, True, bool),
     ("use_ssl", True, True, bool),
 ]
 props = [p for p in dir(Config) if isinstance(getattr(Config, p), property)]
+# Properties which only accept specific values
+prop_values = {"cert_key_type": "ec",
+               "message_store": "spool",
+               "sink_digest": "sha256",
+               "event_loop": "uvloop",
+               "delays": {"EHLO": 0.5},
+               "rate_limit_by": "user",
+               "failures": {"MAIL": 0.5},
+               "export_path": "messages.mbox",
+               "export_format": "maildir"}
 
 
 class FakeHandler():
@@ -99,10 +139,58 @@ def test_event_handler_fires(mock_Path: MagicMock,
     config = Config()
     result: List[Any] = []
     config.OnChanged += functools.partial(handler.handle, result)
-    setattr(config, prop, 1)
+    setattr(config, prop, prop_values.get(prop, 1))
     assert result.pop() is True
 
 
+def test_invalid_key_type() -> None:
+    config = Config()
+    with pytest.raises(ValueError):
+        config.cert_key_type = "dsa"
+
+
+def test_invalid_sink_digest() -> None:
+    config = Config()
+    with pytest.raises(ValueError):
+        config.sink_digest = "foo"
+    config.sink_digest = None
+    assert config.sink_digest is None
+
+
+def test_command_call_limit_none() -> None:
+    config = Config()
+    config.command_call_limit = 10
+    config.command_call_limit = ""
+    assert config.command_call_limit is None
+
+
+def test_export_path_none() -> None:
+    config = Config()
+    config.export_path = "messages.mbox"
+    config.export_path = ""
+    assert config.export_path is None
+
+
+def test_pickle(handler: FakeHandler) -> None:
+    config = Config()
+    config.port = 5025
+    result: List[Any] = []
+    config.OnChanged += functools.partial(handler.handle, result)
+
+    copy = pickle.loads(pickle.dumps(config))
+    assert copy.port == 5025
+    # The handlers of the original aren't copied
+    copy.port = 5026
+    assert result == []
+    assert config.port == 5025
+
+
+def test_invalid_event_loop() -> None:
+    config = Config()
+    with pytest.raises(ValueError):
+        config.event_loop = "trio"
+
+
 def test_unset_event_handler(handler: FakeHandler) -> None:
     config = Config()
     result: List[EventHandler] = []
@@ -116,3 +204,56 @@ def test_unset_event_handler(handler: FakeHandler) -> None:
     config.OnChanged -= func
     setattr(config, prop, 0)
     assert not result
+
+
+def test_batch(handler: FakeHandler) -> None:
+    config = Config()
+    result: List[Any] = []
+    config.OnChanged += functools.partial(handler.handle, result)
+    with config.batch():
+        config.use_starttls = True
+        config.enforce_auth = True
+        with config.batch():
+            config.login_password = "word"
+        assert not result
+
+    assert result == [True]
+    assert config.use_starttls and config.enforce_auth
+
+
+def test_batch_no_changes(handler: FakeHandler) -> None:
+    config = Config()
+    result: List[Any] = []
+    config.OnChanged += functools.partial(handler.handle, result)
+    with config.batch():
+        pass
+    assert not result
+
+
+def test_batch_error(handler: FakeHandler) -> None:
+    config = Config()
+    result: List[Any] = []
+    config.OnChanged += functools.partial(handler.handle, result)
+    with pytest.raises(ValueError):
+        with config.batch():
+            config.enforce_auth = True
+            config.cert_key_type = "dsa"
+
+    # The changes made before the error still need to be applied
+    assert result == [True]
+
+
+def test_update(handler: FakeHandler) -> None:
+    config = Config()
+    result: List[Any] = []
+    config.OnChanged += functools.partial(handler.handle, result)
+    config.update(use_starttls="1", login_password="word")
+    assert result == [True]
+    assert config.use_starttls is True
+    assert config.login_password == "word"
+
+
+def test_update_unknown() -> None:
+    config = Config()
+    with pytest.raises(AttributeError):
+        config.update(rubbish=True)
@@ -1,15 +1,21 @@
+import asyncio
 import logging
+import socket
 import ssl
+import time
 from email.message import EmailMessage
 from smtplib import SMTP, SMTP_SSL, SMTPSenderRefused, SMTPServerDisconnected
+from typing import Any, List
+from unittest.mock import patch
 
 import pytest
 from pytest import FixtureRequest, TempPathFactory
 
 from smtpdfix.certs import _generate_certs
 from smtpdfix.configuration import Config
-from smtpdfix.controller import AuthController
+from smtpdfix.controller import AuthController, Listener
 from smtpdfix.fixture import _Authenticator
+from tests.conftest import User
 
 log = logging.getLogger(__name__)
 
@@ -132,3 +138,300 @@ def test_exception_handler(request: FixtureRequest, msg: EmailMessage) -> None:
             client.send_message(msg)
 
         assert len(server.messages) == 1
+
+
+def test_ssl_context_reused(smtpd: AuthController) -> None:
+    smtpd.config.use_starttls = True
+    smtpd.ssl_cache.reset_counters()
+    for _ in range(3):
+        with SMTP(smtpd.hostname, smtpd.port) as client:
+            client.starttls()
+            client.noop()
+
+    assert smtpd.ssl_cache.misses <= 1
+    assert smtpd.ssl_cache.hits >= 2
+
+
+def test_ssl_context_cert_changed(smtpd: AuthController,
+                                  tmp_path_factory: TempPathFactory) -> None:
+    smtpd.config.use_starttls = True
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.starttls()
+    previous = smtpd._get_ssl_context()
+    smtpd.ssl_cache.reset_counters()
+
+    # A new certificate discards the cached contexts
+    cert, _ = _generate_certs(tmp_path_factory.mktemp("certs"))
+    smtpd.config.ssl_cert_files = str(cert)
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.starttls()
+        client.noop()
+
+    assert smtpd.ssl_cache.misses == 1
+    assert smtpd._get_ssl_context() is not previous
+
+
+def test_reset_stopped(request: FixtureRequest) -> None:
+    server = AuthController()
+    # The server isn't running so changing the listener doesn't start it
+    server.config.host = "127.0.0.1"
+    assert server.hostname == "127.0.0.1"
+    assert server.server is None
+
+    request.addfinalizer(server.stop)
+    server.start()
+    with SMTP(server.hostname, server.port) as client:
+        assert client.noop()[0] == 250
+
+
+def test_update_restarts_once(smtpd: AuthController,
+                              msg: EmailMessage) -> None:
+    with patch.object(smtpd, "start", wraps=smtpd.start) as mock_start:
+        smtpd.config.update(use_ssl=True,
+                            enforce_auth=False,
+                            login_password="word")
+    mock_start.assert_called_once()
+
+    with SMTP_SSL(smtpd.hostname, smtpd.port) as client:
+        client.send_message(msg)
+    assert len(smtpd.messages) == 1
+
+
+def test_hot_reconfigure(smtpd: AuthController, user: User) -> None:
+    thread = smtpd._thread
+    with patch.object(smtpd, "start", wraps=smtpd.start) as mock_start:
+        smtpd.config.use_starttls = True
+        smtpd.config.enforce_auth = True
+        smtpd.config.login_password = "word"
+    mock_start.assert_not_called()
+    assert smtpd._thread is thread
+
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.starttls()
+        assert client.login(user.username, "word")
+
+
+def test_hot_reconfigure_ready_timeout(smtpd: AuthController) -> None:
+    smtpd.config.ready_timeout = 2.5
+    assert smtpd.ready_timeout == 2.5
+
+
+def test_listeners(request: FixtureRequest,
+                   tmp_path_factory: TempPathFactory,
+                   msg: EmailMessage) -> None:
+    path = tmp_path_factory.mktemp("certs")
+    _generate_certs(path)
+    _config = Config()
+    _config.ssl_cert_files = str(path.joinpath("cert.pem"))
+
+    server = AuthController(config=_config,
+                            listeners=[Listener("ssl"),
+                                       Listener("starttls")])
+    request.addfinalizer(server.stop)
+    server.start()
+
+    plain, implicit, starttls = server.listeners
+    assert [plain.mode, implicit.mode, starttls.mode] == \
+        ["plain", "ssl", "starttls"]
+    assert len({plain.port, implicit.port, starttls.port}) == 3
+
+    with SMTP(server.hostname, plain.port) as client:
+        client.send_message(msg)
+    with SMTP_SSL(server.hostname, implicit.port) as client:
+        client.send_message(msg)
+    with SMTP(server.hostname, starttls.port) as client:
+        with pytest.raises(SMTPSenderRefused):
+            client.send_message(msg)
+        client.starttls()
+        client.send_message(msg)
+
+    assert len(server.messages) == 3
+    # Implicit TLS asks for client certificates without changing the context
+    # used for STARTTLS
+    assert server._get_ssl_context().verify_mode == ssl.CERT_NONE
+    assert server._get_ssl_context(ssl.CERT_OPTIONAL).verify_mode == \
+        ssl.CERT_OPTIONAL
+
+    server.config.port = 0
+    assert server.listeners[1:] == [implicit, starttls]
+
+
+def test_listener_port_in_use(request: FixtureRequest) -> None:
+    taken = socket.socket()
+    request.addfinalizer(taken.close)
+    taken.bind(("127.0.0.1", 0))
+    taken.listen()
+    port = taken.getsockname()[1]
+
+    # The ready_timeout is set by the config as publishing the port chosen
+    # for the first listener applies the config's value
+    config = Config()
+    config.ready_timeout = 1
+    server = AuthController(hostname="127.0.0.1",
+                            config=config,
+                            listeners=[Listener("starttls"),
+                                       Listener("plain", port=port)])
+    with pytest.raises(OSError):
+        server.start()
+
+    # The servers already listening are closed
+    assert server.server is None
+    for listener in server.listeners[:2]:
+        assert listener.port
+        with pytest.raises(ConnectionRefusedError):
+            socket.create_connection(("127.0.0.1", listener.port), timeout=1)
+
+
+def test_bind_socket_error(monkeypatch: pytest.MonkeyPatch) -> None:
+    from smtpdfix.controller import _bind_sockets
+    created = []
+
+    class _Socket(socket.socket):
+        def __init__(self, *args: Any) -> None:
+            super().__init__(*args)
+            created.append(self)
+    monkeypatch.setattr(socket, "socket", _Socket)
+
+    # 192.0.2.0/24 is reserved for documentation so isn't a local address
+    infos = [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, 0))
+             for address in ("127.0.0.1", "192.0.2.1")]
+    monkeypatch.setattr(socket, "getaddrinfo", lambda *args, **kwargs: infos)
+    with pytest.raises(OSError):
+        _bind_sockets("localhost")
+    # The sockets already bound are closed as well
+    assert [sock.fileno() for sock in created] == [-1, -1]
+
+
+@pytest.mark.skipif(not socket.has_ipv6, reason="IPv6 is not supported")
+def test_bind_all_addresses(request: FixtureRequest) -> None:
+    # An empty host binds the IPv4 and IPv6 wildcard addresses
+    config = Config()
+    config.host = ""
+    server = AuthController(config=config)
+    request.addfinalizer(server.stop)
+    server.start()
+
+    def noop(host: str) -> int:
+        with SMTP(host, server.port) as client:
+            return client.noop()[0]
+
+    assert [noop("127.0.0.1"), noop("::1")] == [250, 250]
+
+    # Restarting the server binds the published port in the same way
+    port = server.port
+    server.config.backlog = 64
+    assert server.port == port
+    assert [noop("127.0.0.1"), noop("::1")] == [250, 250]
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(not socket.has_ipv6, reason="IPv6 is not supported")
+async def test_bind_server_error() -> None:
+    from smtpdfix.controller import AsyncAuthController
+    config = Config()
+    config.host = ""
+    server = AsyncAuthController(config=config)
+    create_server = asyncio.BaseEventLoop.create_server
+    servers: List[Any] = []
+    socks: List[socket.socket] = []
+
+    async def create_once(*args: Any, **kwargs: Any) -> Any:
+        socks.append(kwargs["sock"])
+        if servers:
+            raise OSError("Foo")
+        servers.append(await create_server(*args, **kwargs))
+        return servers[-1]
+
+    with patch.object(asyncio.BaseEventLoop, "create_server", autospec=True,
+                      side_effect=create_once):
+        with pytest.raises(OSError):
+            await server.start_async()
+    # The server created for the first address is closed with the socket of
+    # the second
+    assert not servers[0].is_serving()
+    assert [sock.fileno() for sock in socks[1:]] == [-1]
+
+
+def test_listener_invalid_mode() -> None:
+    with pytest.raises(ValueError):
+        AuthController(listeners=[Listener("foo")])
+
+
+def test_event_loop(request: FixtureRequest, msg: EmailMessage) -> None:
+    uvloop = pytest.importorskip("uvloop")
+    _config = Config()
+    _config.event_loop = "uvloop"
+    server = AuthController(config=_config)
+    request.addfinalizer(server.stop)
+    server.start()
+
+    assert isinstance(server.loop, uvloop.Loop)
+    with SMTP(server.hostname, server.port) as client:
+        client.send_message(msg)
+    assert len(server.messages) == 1
+
+
+def test_event_loop_fallback(caplog: pytest.LogCaptureFixture) -> None:
+    _config = Config()
+    _config.event_loop = "uvloop"
+    with patch.dict("sys.modules", {"uvloop": None}):
+        server = AuthController(config=_config)
+    server.loop.close()
+
+    assert isinstance(server.loop, asyncio.BaseEventLoop)
+    assert "uvloop is not installed" in caplog.text
+
+
+def test_listener_tuning(smtpd: AuthController) -> None:
+    port = smtpd.port
+    with patch.object(smtpd, "reset") as mock_reset:
+        smtpd.config.session_timeout = 30
+        mock_reset.assert_not_called()
+        smtpd.config.backlog = 1024
+        mock_reset.assert_called_once()
+    assert smtpd.port == port
+
+
+def test_backlog(smtpd: AuthController) -> None:
+    smtpd.config.update(backlog=1024, reuse_port=True)
+    create_server = asyncio.BaseEventLoop.create_server
+    with patch.object(asyncio.BaseEventLoop, "create_server", autospec=True,
+                      side_effect=create_server) as mock_create_server:
+        smtpd.reset()
+    _, kwargs = mock_create_server.call_args
+    assert kwargs["backlog"] == 1024
+    assert kwargs["sock"].getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT)
+
+
+def test_session_limits(smtpd: AuthController, msg: EmailMessage) -> None:
+    smtpd.config.update(data_size_limit=1024,
+                        command_call_limit={"NOOP": 2})
+    msg.set_content("x" * 2048)
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.ehlo()
+        assert client.esmtp_features["size"] == "1024"
+        with pytest.raises(SMTPSenderRefused):
+            client.send_message(msg)
+        codes = [client.noop()[0] for _ in range(3)]
+    assert codes == [250, 250, 421]
+
+
+def test_session_timeout(smtpd: AuthController) -> None:
+    smtpd.config.session_timeout = 0.2
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.sock.settimeout(5)
+        start = time.monotonic()
+        assert client.sock.recv(1024) == b""
+    assert time.monotonic() - start < 2
+
+
+def test_handshake_timeout(smtpd: AuthController) -> None:
+    smtpd.config.update(use_starttls=True, handshake_timeout=0.2)
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.ehlo()
+        assert client.docmd("STARTTLS")[0] == 220
+        # The connection is closed without the client starting the handshake
+        client.sock.settimeout(5)
+        start = time.monotonic()
+        assert client.sock.recv(1024) == b""
+    assert time.monotonic() - start < 2
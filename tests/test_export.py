@@ -0,0 +1,248 @@
+import asyncio
+import mailbox
+import threading
+from email.message import EmailMessage
+from pathlib import Path
+from smtplib import SMTP
+from typing import List
+from unittest.mock import patch
+
+import pytest
+
+from smtpdfix.controller import AuthController
+from smtpdfix.export import MailExport, _MboxWriter
+from smtpdfix.handlers import AuthMessage
+from smtpdfix.records import MessageRecord
+from smtpdfix.store import MessageStore
+from tests.conftest import make_record
+
+
+def test_mbox(tmp_path: Path) -> None:
+    path = tmp_path.joinpath("messages.mbox")
+    export = MailExport(path, batch_size=2)
+    for n in range(5):
+        export.add(make_record(f"Subject: {n}\r\n\r\nFrom here\r\n".encode()))
+    export.close()
+
+    assert export.exported == 5
+    messages = list(mailbox.mbox(str(path)))
+    assert [m["Subject"] for m in messages] == ["0", "1", "2", "3", "4"]
+    assert messages[0].get_from().startswith("from.addr@example.org ")
+    assert messages[0].get_payload() == ">From here\n"
+
+
+def test_mbox_appends(tmp_path: Path) -> None:
+    path = tmp_path.joinpath("messages.mbox")
+    export = MailExport(path)
+    export.add(make_record(b"Subject: Foo\r\n\r\nFoo\r\n"))
+    export.close()
+    # Adding after the export is closed starts the writer again
+    export.add(make_record(b"Subject: Bar\r\n\r\nBar\r\n"))
+    export.flush()
+
+    assert len(mailbox.mbox(str(path))) == 2
+    export.close()
+
+
+def test_maildir(tmp_path: Path) -> None:
+    path = tmp_path.joinpath("Maildir")
+    export = MailExport(path, format="maildir")
+    export.add(make_record(b"Subject: Foo\r\n\r\nFoo\r\n"))
+    export.add(make_record(b"Subject: Bar\r\n\r\nBar\r\n"))
+    export.close()
+
+    maildir = mailbox.Maildir(str(path), create=False)
+    assert sorted(m["Subject"] for m in maildir) == ["Bar", "Foo"]
+
+
+@pytest.mark.parametrize("format", ["mbox", "maildir"])
+def test_rotate(tmp_path: Path, format: str) -> None:
+    path = tmp_path.joinpath("messages")
+    export = MailExport(path, format=format, batch_size=1, rotate_bytes=100)
+    for _ in range(3):
+        export.add(make_record(b"Subject: Foo\r\n\r\n" + b"x" * 100 + b"\r\n"))
+        # Each message fills a file when written
+        export.flush()
+    export.close()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "messages.1", "messages.2", "messages.3"
+    ]
+
+
+def test_mbox_no_final_newline(tmp_path: Path) -> None:
+    path = tmp_path.joinpath("messages.mbox")
+    export = MailExport(path)
+    export.add(make_record(b"Subject: Foo\r\n\r\nFoo"))
+    export.add(make_record(b"Subject: Bar\r\n\r\nBar"))
+    export.close()
+    messages = list(mailbox.mbox(str(path)))
+    assert [m.get_payload() for m in messages] == ["Foo\n", "Bar\n"]
+
+
+def test_close_not_started(tmp_path: Path) -> None:
+    path = tmp_path.joinpath("messages.mbox")
+    export = MailExport(path)
+    export.close()
+    assert not path.exists()
+
+
+def test_rotate_error(tmp_path: Path) -> None:
+    path = tmp_path.joinpath("messages.mbox")
+    export = MailExport(path, batch_size=1, rotate_bytes=1)
+    with patch("os.rename", side_effect=OSError):
+        export.add(make_record(b"Foo"))
+        export.flush()
+    export.add(make_record(b"Bar"))
+    export.close()
+    # The file couldn't be rotated so the next message was appended to it
+    # before it was rotated
+    assert (export.exported, export.errors) == (2, 0)
+    assert len(mailbox.mbox(f"{path}.1")) == 2
+
+
+class StalledWriter(_MboxWriter):
+    """A writer that waits until it's released before writing."""
+    release = threading.Event()
+
+    def write(self, records: List[MessageRecord]) -> None:
+        self.release.wait()
+        super().write(records)
+
+
+@pytest.mark.asyncio
+async def test_add_async_full(tmp_path: Path) -> None:
+    export = MailExport(tmp_path.joinpath("messages.mbox"), batch_size=1)
+    with patch.object(export, "_open",
+                      lambda: StalledWriter(export.path)):
+        # One message is being written and two fill the queue
+        tasks = [asyncio.ensure_future(export.add_async(make_record(b"Foo")))
+                 for _ in range(5)]
+        await asyncio.sleep(0.1)
+        # The event loop is still running while the adds wait
+        assert sum(task.done() for task in tasks) == 3
+        StalledWriter.release.set()
+        await asyncio.gather(*tasks)
+        await asyncio.get_running_loop().run_in_executor(None, export.close)
+    assert export.exported == 5
+
+
+def test_handle_message(tmp_path: Path, msg: EmailMessage) -> None:
+    export = MailExport(tmp_path.joinpath("messages.mbox"))
+    handler = AuthMessage(MessageStore(), export=export)
+    handler.handle_message(msg)
+    export.close()
+    assert len(handler.store) == 1
+    assert export.exported == 1
+
+
+def test_errors(tmp_path: Path) -> None:
+    export = MailExport(tmp_path.joinpath("missing", "messages.mbox"))
+    export.add(make_record(b"Foo"))
+    export.close()
+    assert (export.exported, export.errors) == (0, 1)
+
+
+def test_invalid_format(tmp_path: Path) -> None:
+    with pytest.raises(ValueError):
+        MailExport(tmp_path.joinpath("messages"), format="eml")
+
+
+def test_export(smtpd: AuthController,
+                msg: EmailMessage,
+                tmp_path: Path) -> None:
+    path = tmp_path.joinpath("messages.mbox")
+    smtpd.config.update(message_store="sink", export_path=path)
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.send_message(msg)
+        client.send_message(msg)
+
+    assert smtpd.export is not None
+    smtpd.export.flush()
+    messages = list(mailbox.mbox(str(path)))
+    assert [m["Subject"] for m in messages] == [msg["Subject"]] * 2
+
+
+def test_export_changed(smtpd: AuthController,
+                        msg: EmailMessage,
+                        tmp_path: Path) -> None:
+    smtpd.config.export_path = tmp_path.joinpath("messages.mbox")
+    export = smtpd.export
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.send_message(msg)
+        # The messages already received are written when the export changes
+        smtpd.config.update(export_path=tmp_path.joinpath("Maildir"),
+                            export_format="maildir")
+        client.send_message(msg)
+
+    assert export is not None and export.exported == 1
+    assert smtpd.export is not None and smtpd.export is not export
+    smtpd.export.flush()
+    assert len(mailbox.Maildir(str(tmp_path.joinpath("Maildir")))) == 1
+
+
+def test_export_kept_on_reset(smtpd: AuthController,
+                              msg: EmailMessage,
+                              tmp_path: Path) -> None:
+    path = tmp_path.joinpath("messages.mbox")
+    smtpd.config.export_path = path
+    export = smtpd.export
+    smtpd.reset()
+    assert smtpd.export is export
+
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.send_message(msg)
+    assert export is not None
+    export.flush()
+    assert len(mailbox.mbox(str(path))) == 1
+
+
+def test_export_custom_handler(request: pytest.FixtureRequest,
+                               tmp_path: Path) -> None:
+    from aiosmtpd.handlers import Sink
+
+    handler = Sink()
+    server = AuthController(handler=handler)
+    request.addfinalizer(server.stop)
+    server.start()
+    # The export is only given to handlers that write to it
+    server.config.export_path = tmp_path.joinpath("messages.mbox")
+    assert server.export is not None
+    assert server.handler is handler
+
+
+@pytest.mark.asyncio
+async def test_async_export_closed_off_loop(tmp_path: Path,
+                                            msg: EmailMessage) -> None:
+    from smtpdfix import Config
+    from smtpdfix.controller import AsyncAuthController
+
+    config = Config()
+    config.export_path = tmp_path.joinpath("first.mbox")
+    server = AsyncAuthController(config=config)
+    await server.start_async()
+    loop = asyncio.get_running_loop()
+
+    def send() -> None:
+        with SMTP(server.hostname, server.port) as client:
+            client.send_message(msg)
+
+    threads: List[threading.Thread] = []
+    close = MailExport.close
+
+    def record_close(export: MailExport) -> None:
+        threads.append(threading.current_thread())
+        close(export)
+
+    with patch.object(MailExport, "close", autospec=True,
+                      side_effect=record_close):
+        await loop.run_in_executor(None, send)
+        config.export_path = tmp_path.joinpath("second.mbox")
+        await loop.run_in_executor(None, send)
+        await server.stop_async()
+
+    # Both exports were closed, and written, without blocking the loop
+    assert len(threads) == 2
+    assert threading.current_thread() not in threads
+    for name in ("first.mbox", "second.mbox"):
+        assert len(mailbox.mbox(str(tmp_path.joinpath(name)))) == 1
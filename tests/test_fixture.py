@@ -1,13 +1,15 @@
+import asyncio
 from base64 import b64encode
 from email.message import EmailMessage
 from smtplib import (SMTP, SMTP_SSL, SMTPAuthenticationError,
                      SMTPResponseException)
 from unittest import mock
 
+import pytest
 from pytest import MonkeyPatch, raises
 
-from smtpdfix import Config
-from smtpdfix.controller import AuthController
+from smtpdfix import Config, CredentialStore
+from smtpdfix.controller import AsyncAuthController, AuthController
 from smtpdfix.fixture import _Authenticator
 from tests.conftest import User
 
@@ -109,6 +111,14 @@ def test_AUTH_PLAIN_failure(smtpd: AuthController, user: User) -> None:
         assert resp == b"5.7.8 Authentication credentials invalid"
 
 
+def test_port_published(smtpd: AuthController) -> None:
+    assert smtpd.port != 0
+    assert smtpd.config.port == smtpd.port
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        code, _ = client.noop()
+    assert code == 250
+
+
 def test_alt_port(smtpd: AuthController) -> None:
     smtpd.config.port = 5025
     assert smtpd.port == 5025
@@ -228,3 +238,134 @@ class TestDefaultAuthenticator:
     def test_get_password(cls, user: User) -> None:
         password = cls._auth.get_password(user.username)
         assert password == user.password
+
+
+def test_shared_first(smtpd_shared: AuthController,
+                      msg: EmailMessage) -> None:
+    smtpd_shared.config.enforce_auth = True
+    with SMTP(smtpd_shared.hostname, smtpd_shared.port) as client:
+        client.ehlo()
+        code, _ = client.docmd("DATA", "")
+        assert code == 530
+
+    smtpd_shared.config.enforce_auth = False
+    with SMTP(smtpd_shared.hostname, smtpd_shared.port) as client:
+        client.send_message(msg)
+
+    assert len(smtpd_shared.messages) == 1
+    smtpd_shared.config.use_starttls = True
+    smtpd_shared.authenticator = CredentialStore()
+
+
+def test_shared_second(smtpd_shared: AuthController,
+                       smtpd_session: AuthController,
+                       msg: EmailMessage) -> None:
+    # The messages and configuration from the previous test should not be
+    # visible to this test.
+    assert smtpd_shared is smtpd_session
+    assert smtpd_shared.config.use_starttls is False
+    assert isinstance(smtpd_shared.authenticator, _Authenticator)
+    assert len(smtpd_shared.messages) == 0
+
+    with SMTP(smtpd_shared.hostname, smtpd_shared.port) as client:
+        client.send_message(msg)
+
+    assert len(smtpd_shared.messages) == 1
+
+
+def test_shared_stats_first(smtpd_shared: AuthController,
+                            msg: EmailMessage) -> None:
+    smtpd_shared.config.update(failures="NOOP=every:1", message_rate=1,
+                               message_burst=1, rate_limit_by="user")
+    with SMTP(smtpd_shared.hostname, smtpd_shared.port) as client:
+        assert client.noop()[0] == 451
+        client.send_message(msg)
+
+    assert smtpd_shared.stats.connections == 1
+    assert smtpd_shared.admission.failures == {"NOOP": 1}
+
+
+def test_shared_stats_second(smtpd_shared: AuthController) -> None:
+    # The counters from the previous test should not be visible to this test.
+    assert smtpd_shared.stats.connections == 0
+    assert smtpd_shared.stats.commands == {}
+    assert smtpd_shared.admission.failures == {}
+    assert smtpd_shared.admission._buckets == {}
+    assert smtpd_shared.admission.sessions == 0
+    assert (smtpd_shared.ssl_cache.hits, smtpd_shared.ssl_cache.misses) == \
+        (0, 0)
+
+
+def test_clear(smtpd: AuthController, msg: EmailMessage) -> None:
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.send_message(msg)
+    assert len(smtpd.messages) == 1
+
+    smtpd.clear()
+    assert len(smtpd.messages) == 0
+
+
+@pytest.mark.asyncio
+async def test_async_smtpd(async_smtpd: AsyncAuthController,
+                           msg: EmailMessage) -> None:
+    def send() -> None:
+        with SMTP(async_smtpd.hostname, async_smtpd.port) as client:
+            client.send_message(msg)
+
+    await asyncio.get_running_loop().run_in_executor(None, send)
+    message, = await async_smtpd.wait_for_async()
+    assert message["Subject"] == "Foo"
+
+
+@pytest.mark.asyncio
+async def test_async_smtpd_reset(async_smtpd: AsyncAuthController) -> None:
+    def noop(port: int) -> int:
+        with SMTP(async_smtpd.hostname, port) as client:
+            code, _ = client.noop()
+        return code
+
+    loop = asyncio.get_running_loop()
+    with raises(RuntimeError):
+        async_smtpd.start()
+    with raises(RuntimeError):
+        async_smtpd.stop()
+
+    port = async_smtpd.port
+    async_smtpd.config.port = 0
+    assert async_smtpd.port == port
+    await async_smtpd.reset_async()
+    assert async_smtpd.port not in (0, port)
+    assert async_smtpd.config.port == async_smtpd.port
+    assert await loop.run_in_executor(None, noop, async_smtpd.port) == 250
+
+
+@pytest.mark.asyncio
+async def test_async_reset_stopped(msg: EmailMessage) -> None:
+    config = Config()
+    server = AsyncAuthController(config=config)
+    # Changes to the listener apply at once while the server is stopped
+    config.host = "127.0.0.1"
+    assert server.hostname == "127.0.0.1"
+    await server.reset_async()
+    assert server.server is None
+
+    await server.start_async()
+    try:
+        def noop() -> int:
+            with SMTP(server.hostname, server.port) as client:
+                return client.noop()[0]
+
+        loop = asyncio.get_running_loop()
+        assert await loop.run_in_executor(None, noop) == 250
+    finally:
+        await server.stop_async()
+
+
+@pytest.mark.asyncio
+async def test_async_smtpd_open_session(
+    async_smtpd: AsyncAuthController
+) -> None:
+    # Sessions still open when the test ends mustn't stop the server closing
+    reader, writer = await asyncio.open_connection(async_smtpd.hostname,
+                                                   async_smtpd.port)
+    assert (await reader.readline()).startswith(b"220")
@@ -0,0 +1,57 @@
+import pytest
+
+from smtpdfix.latency import (Delay, _parse_delay, _parse_delays,
+                              _parse_optional_delay)
+
+
+@pytest.mark.parametrize("value, expected", [
+    (0.5, Delay(0.5)),
+    ("2", Delay(2.0)),
+    ("uniform:0.5:0.25", Delay(0.5, 0.25, "uniform")),
+    ("Normal:0.2:0.05", Delay(0.2, 0.05, "normal")),
+    ("exponential:0.2", Delay(0.2, 0.0, "exponential")),
+    (Delay(1.0), Delay(1.0)),
+])
+def test_parse_delay(value: object, expected: Delay) -> None:
+    assert _parse_delay(value) == expected  # type: ignore
+
+
+@pytest.mark.parametrize("value", ["", "foo", "fixed:1:2:3", "-1",
+                                   Delay(1.0, 0.0, "foo")])
+def test_parse_delay_invalid(value: object) -> None:
+    with pytest.raises(ValueError):
+        _parse_delay(value)  # type: ignore
+
+
+def test_parse_delays() -> None:
+    assert _parse_delays(None) == {}
+    assert _parse_delays("greeting=1, DATA=exponential:0.2") == {
+        "GREETING": Delay(1.0),
+        "DATA": Delay(0.2, 0.0, "exponential"),
+    }
+    assert _parse_delays({"ehlo": 0.1}) == {"EHLO": Delay(0.1)}
+    with pytest.raises(ValueError):
+        _parse_delays("EHLO")
+
+
+def test_parse_optional_delay() -> None:
+    assert _parse_optional_delay("") is None
+    assert _parse_optional_delay(None) is None
+    assert _parse_optional_delay(1) == Delay(1.0)
+
+
+@pytest.mark.parametrize("distribution", ["fixed", "uniform", "normal",
+                                          "exponential"])
+def test_sample(distribution: str) -> None:
+    delay = Delay(0.2, 0.1, distribution)
+    samples = [delay.sample() for _ in range(1000)]
+    assert min(samples) >= 0
+    assert 0.15 < sum(samples) / len(samples) < 0.25
+    if distribution == "fixed":
+        assert set(samples) == {0.2}
+    if distribution == "uniform":
+        assert 0.1 <= min(samples) and max(samples) <= 0.3
+
+
+def test_sample_zero() -> None:
+    assert Delay(0, 0, "exponential").sample() == 0
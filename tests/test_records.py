@@ -0,0 +1,65 @@
+from email.message import EmailMessage
+from smtplib import SMTP
+
+from smtpdfix.controller import AuthController
+from smtpdfix.handlers import AuthMessage
+from smtpdfix.records import MessageRecord
+from smtpdfix.store import MessageStore
+
+
+def test_record_lazy_message() -> None:
+    record = MessageRecord(content=b"Subject: Foo\r\n\r\nFoo bar\r\n",
+                           mail_from="from.addr@example.org",
+                           rcpt_tos=["to.addr@example.org"],
+                           peer=("127.0.0.1", 1025))
+    assert record._message is None
+    assert record.size == 25
+
+    message = record.message
+    assert message["Subject"] == "Foo"
+    assert message["X-MailFrom"] == "from.addr@example.org"
+    assert message["X-RcptTo"] == "to.addr@example.org"
+    assert message["X-Peer"] == "('127.0.0.1', 1025)"
+    assert record.message is message
+
+
+def test_record_from_message(msg: EmailMessage) -> None:
+    msg["X-MailFrom"] = "from.addr@example.org"
+    msg["X-RcptTo"] = "to.addr@example.org, cc.addr@example.org"
+    record = MessageRecord.from_message(msg)
+    assert record.message is msg
+    assert record.mail_from == "from.addr@example.org"
+    assert record.rcpt_tos == ["to.addr@example.org", "cc.addr@example.org"]
+    assert "from.addr@example.org" in repr(record)
+
+
+def test_record_headers(msg: EmailMessage) -> None:
+    record = MessageRecord(content=msg.as_bytes())
+    headers = record.headers
+    assert headers["Subject"] == "Foo"
+    assert record._message is None
+
+    # Once the message is parsed it's used for the headers
+    message = record.message
+    assert record.headers is message
+
+
+def test_handle_message(msg: EmailMessage) -> None:
+    msg["X-MailFrom"] = "from.addr@example.org"
+    handler = AuthMessage(MessageStore())
+    handler.handle_message(msg)
+    record, = handler.store
+    assert record.message is msg
+    assert record.mail_from == "from.addr@example.org"
+
+
+def test_records(smtpd: AuthController, msg: EmailMessage) -> None:
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.send_message(msg)
+
+    record, = smtpd.records
+    assert record.mail_from == "from.addr@example.org"
+    assert record.rcpt_tos == ["to.addr@example.org"]
+    assert record._message is None
+    assert smtpd.messages[0]["Subject"] == "Foo"
+    assert record._message is not None
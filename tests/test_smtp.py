@@ -1,7 +1,8 @@
 import asyncio
+import hashlib
 from asyncio import CancelledError, Future
-from typing import Any
-from unittest.mock import MagicMock, Mock, patch
+from typing import Any, List
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
 
 import pytest
 
@@ -84,3 +85,300 @@ async def test_starttls_Exception(mock_AuthMessage: Mock,
         with pytest.raises(TLSSetupException):
             await smtpd.smtp_STARTTLS(None)
         mock_push.assert_called_once_with('220 Ready to start TLS')
+
+
+@pytest.mark.asyncio
+@patch("ssl.SSLContext")
+async def test_without_stats(mock_SSLContext: Mock, future: Any) -> None:
+    from smtpdfix.smtp import _SMTP
+
+    class Handler():
+        async def handle_NOOP(self, server: Any, session: Any,
+                              envelope: Any, arg: str) -> str:
+            return "250 Noted"
+
+    transport = Mock()
+    mock_loop = Mock(start_tls=AsyncMock(return_value=transport))
+    smtpd: _SMTP = _SMTP(Handler(),
+                         tls_context=mock_SSLContext,
+                         loop=mock_loop)
+    assert await smtpd._call_handler_hook("NOOP", "") == "250 Noted"
+
+    smtpd.transport = Mock()
+    smtpd._reader, smtpd._writer = Mock(), Mock()
+    with patch.object(smtpd, "push", return_value=future):
+        await smtpd.smtp_STARTTLS("")
+    assert smtpd._tls_protocol is transport.get_protocol()
+
+
+class StreamHandler():
+    """A handler that hashes the content of messages as it's received."""
+    def __init__(self) -> None:
+        self.chunks: List[bytes] = []
+        self.digests: List[str] = []
+
+    async def handle_DATA_CHUNK(self, server: Any, session: Any,
+                                envelope: Any, chunk: bytes) -> None:
+        self.chunks.append(chunk)
+
+    async def handle_DATA_END(self, server: Any, session: Any,
+                              envelope: Any) -> str:
+        self.digests.append(hashlib.sha256(b"".join(self.chunks)).hexdigest())
+        self.chunks = []
+        return "250 Hashed"
+
+
+class ChunkHandler(StreamHandler):
+    """A handler that also discards the chunks of aborted messages."""
+    def __init__(self) -> None:
+        super().__init__()
+        self.aborted = 0
+
+    async def handle_DATA_ABORT(self, server: Any, session: Any,
+                                envelope: Any) -> None:
+        self.aborted += 1
+        self.chunks = []
+
+
+@pytest.fixture
+def chunk_handler() -> ChunkHandler:
+    return ChunkHandler()
+
+
+def test_streaming_data(request: pytest.FixtureRequest,
+                        chunk_handler: ChunkHandler) -> None:
+    from smtplib import SMTP
+
+    from smtpdfix.controller import AuthController
+    from smtpdfix.smtp import CHUNK_SIZE
+    server = AuthController(handler=chunk_handler)
+    request.addfinalizer(server.stop)
+    server.start()
+
+    lines = [b".starts with a dot", b"x" * 76] * (CHUNK_SIZE // 40)
+    content = b"\r\n".join(lines) + b"\r\n"
+    with SMTP(server.hostname, server.port) as client:
+        client.ehlo()
+        client.mail("from.addr@example.org")
+        client.rcpt("to.addr@example.org")
+        code, resp = client.data(content)
+
+    assert (code, resp) == (250, b"Hashed")
+    assert chunk_handler.digests == [hashlib.sha256(content).hexdigest()]
+    assert server.messages == []
+
+
+def test_streaming_data_line_too_long(request: pytest.FixtureRequest,
+                                      chunk_handler: ChunkHandler) -> None:
+    from smtplib import SMTP, SMTPDataError
+
+    from smtpdfix.controller import AuthController
+    server = AuthController(handler=chunk_handler)
+    request.addfinalizer(server.stop)
+    server.start()
+
+    with SMTP(server.hostname, server.port) as client:
+        with pytest.raises(SMTPDataError) as error:
+            client.sendmail("from.addr@example.org",
+                            ["to.addr@example.org"],
+                            b"x" * 2000)
+    assert error.value.smtp_code == 500
+    assert chunk_handler.aborted == 1
+    assert chunk_handler.digests == []
+
+
+def test_streaming_data_too_large(request: pytest.FixtureRequest,
+                                  chunk_handler: ChunkHandler) -> None:
+    from smtplib import SMTP
+
+    from smtpdfix.configuration import Config
+    from smtpdfix.controller import AuthController
+    config = Config()
+    config.data_size_limit = 1024
+    server = AuthController(config=config, handler=chunk_handler)
+    request.addfinalizer(server.stop)
+    server.start()
+
+    with SMTP(server.hostname, server.port) as client:
+        client.ehlo()
+        client.mail("from.addr@example.org")
+        client.rcpt("to.addr@example.org")
+        code, _ = client.data((b"x" * 76 + b"\r\n") * 20)
+    assert code == 552
+    assert chunk_handler.aborted == 1
+
+
+@pytest.fixture
+def chunk_smtpd(request: pytest.FixtureRequest,
+                chunk_handler: ChunkHandler) -> Any:
+    from smtpdfix.controller import AuthController
+    server = AuthController(handler=chunk_handler)
+    request.addfinalizer(server.stop)
+    server.start()
+    return server
+
+
+def test_streaming_data_helo_needed(chunk_smtpd: Any) -> None:
+    from smtplib import SMTP
+    with SMTP(chunk_smtpd.hostname, chunk_smtpd.port) as client:
+        assert client.docmd("DATA")[0] == 503
+
+
+def test_streaming_data_auth_needed(chunk_smtpd: Any) -> None:
+    from smtplib import SMTP
+    chunk_smtpd.config.enforce_auth = True
+    with SMTP(chunk_smtpd.hostname, chunk_smtpd.port) as client:
+        client.ehlo()
+        assert client.docmd("DATA")[0] == 530
+
+
+def test_streaming_data_no_rcpt(chunk_smtpd: Any) -> None:
+    from smtplib import SMTP
+    with SMTP(chunk_smtpd.hostname, chunk_smtpd.port) as client:
+        client.ehlo()
+        client.mail("from.addr@example.org")
+        code, resp = client.docmd("DATA")
+        assert (code, resp) == (503, b"Error: need RCPT command")
+
+
+def test_streaming_data_arg(chunk_smtpd: Any) -> None:
+    from smtplib import SMTP
+    with SMTP(chunk_smtpd.hostname, chunk_smtpd.port) as client:
+        client.ehlo()
+        client.mail("from.addr@example.org")
+        client.rcpt("to.addr@example.org")
+        code, resp = client.docmd("DATA", "foo")
+        assert (code, resp) == (501, b"Syntax: DATA")
+
+
+def test_streaming_data_empty(chunk_smtpd: Any,
+                              chunk_handler: ChunkHandler) -> None:
+    from smtplib import SMTP
+    with SMTP(chunk_smtpd.hostname, chunk_smtpd.port) as client:
+        client.ehlo()
+        client.mail("from.addr@example.org")
+        client.rcpt("to.addr@example.org")
+        assert client.docmd("DATA")[0] == 354
+        client.send(b".\r\n")
+        assert client.getreply() == (250, b"Hashed")
+    assert chunk_handler.digests == [hashlib.sha256(b"").hexdigest()]
+
+
+def test_streaming_data_connection_lost(chunk_smtpd: Any,
+                                        chunk_handler: ChunkHandler) -> None:
+    from smtplib import SMTP
+    from time import sleep
+    client = SMTP(chunk_smtpd.hostname, chunk_smtpd.port)
+    client.ehlo()
+    client.mail("from.addr@example.org")
+    client.rcpt("to.addr@example.org")
+    assert client.docmd("DATA")[0] == 354
+    client.send(b"Subject: Foo\r\n\r\nPart of a message\r\n")
+    client.close()
+
+    for _ in range(50):
+        if chunk_handler.aborted:
+            break
+        sleep(0.02)
+    assert chunk_handler.aborted == 1
+    assert chunk_handler.digests == []
+
+
+def test_streaming_data_no_abort_hook(request: pytest.FixtureRequest) -> None:
+    from smtplib import SMTP, SMTPDataError
+    from time import sleep
+
+    from smtpdfix.controller import AuthController
+    handler = StreamHandler()
+    server = AuthController(handler=handler)
+    request.addfinalizer(server.stop)
+    server.start()
+
+    with SMTP(server.hostname, server.port) as client:
+        with pytest.raises(SMTPDataError) as error:
+            client.sendmail("from.addr@example.org",
+                            ["to.addr@example.org"],
+                            b"x" * 2000)
+    assert error.value.smtp_code == 500
+
+    client = SMTP(server.hostname, server.port)
+    client.ehlo()
+    client.mail("from.addr@example.org")
+    client.rcpt("to.addr@example.org")
+    client.docmd("DATA")
+    client.close()
+    sleep(0.1)
+
+    # The message is discarded, leaving the next one to be hashed alone
+    with SMTP(server.hostname, server.port) as client:
+        client.sendmail("from.addr@example.org",
+                        ["to.addr@example.org"],
+                        b"Foo\r\n")
+    assert handler.digests == [hashlib.sha256(b"Foo\r\n").hexdigest()]
+
+
+def _timed(action: Any) -> float:
+    from time import perf_counter
+    start = perf_counter()
+    action()
+    return perf_counter() - start
+
+
+def test_command_delays(smtpd: Any, msg: Any) -> None:
+    from smtplib import SMTP
+    smtpd.config.delays = "GREETING=0.2,EHLO=0.2,DATA=0.3"
+    client = SMTP()
+    assert _timed(lambda: client.connect(smtpd.hostname, smtpd.port)) >= 0.2
+    assert _timed(client.ehlo) >= 0.2
+    assert _timed(client.noop) < 0.2
+    client.mail("from.addr@example.org")
+    client.rcpt("to.addr@example.org")
+    assert _timed(lambda: client.data(msg.as_bytes())) >= 0.3
+    client.quit()
+    assert len(smtpd.messages) == 1
+
+
+def test_read_bandwidth(smtpd: Any, msg: Any) -> None:
+    from smtplib import SMTP
+    smtpd.config.read_bandwidth = 2**16
+    msg.set_content("x" * 2**16)
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        # 64 KiB at 64 KiB/s takes at least a second to be read
+        assert _timed(lambda: client.send_message(msg)) >= 0.9
+    assert len(smtpd.messages) == 1
+
+
+@patch("smtpdfix.handlers.AuthMessage")
+def test_read_bandwidth_pending(mock_AuthMessage: Mock) -> None:
+    from smtpdfix.smtp import _SMTP
+    loop = Mock(**{"time.return_value": 0.0})
+    smtpd = _SMTP(mock_AuthMessage, read_bandwidth=1024, loop=loop)
+    transport = Mock(**{"is_closing.return_value": False})
+    smtpd.transport = transport
+    with patch("aiosmtpd.smtp.SMTP.data_received") as received:
+        # Reading is paused until all of the data received has been read
+        smtpd.data_received(b"Foo")
+        smtpd.data_received(b"Bar")
+        transport.pause_reading.assert_called_once()
+        assert loop.call_at.call_count == 2
+        smtpd._receive(b"Foo")
+        transport.resume_reading.assert_not_called()
+        smtpd._receive(b"Bar")
+        transport.resume_reading.assert_called_once()
+        assert received.call_count == 2
+
+        # Data is discarded if the connection is lost before it's read
+        smtpd.data_received(b"Baz")
+        smtpd.transport = None
+        smtpd._receive(b"Baz")
+        assert received.call_count == 2
+        assert smtpd._read_pending == 0
+
+
+def test_handshake_delay(smtpd: Any) -> None:
+    from smtplib import SMTP
+    smtpd.config.use_starttls = True
+    smtpd.config.handshake_delay = 0.3
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        assert _timed(client.starttls) >= 0.3
+        assert client.noop()[0] == 250
@@ -3,6 +3,7 @@ from pathlib import Path
 from smtplib import SMTP
 from typing import Any
 
+import pytest
 from pytest import MonkeyPatch, TempPathFactory
 
 from smtpdfix import SMTPDFix
@@ -42,3 +43,181 @@ def test_configured_socket(monkeypatch: MonkeyPatch,
     _generate_certs(path)
 
     assert Path.joinpath(path, "cert.pem").is_file()
+
+
+def test_cached_certs(tmp_path_factory: TempPathFactory) -> None:
+    from smtpdfix.certs import _cached_certs
+    path = tmp_path_factory.mktemp("cache")
+    generated = _cached_certs(path)
+    mtime = generated.cert.stat().st_mtime_ns
+
+    # The same certificate, and key, are returned once it's cached
+    cached = _cached_certs(path)
+    assert cached == generated
+    assert cached.key is None
+    assert cached.cert.stat().st_mtime_ns == mtime
+
+
+def test_cached_certs_expiring(tmp_path_factory: TempPathFactory) -> None:
+    from smtpdfix.certs import _cached_certs
+    path = tmp_path_factory.mktemp("cache")
+    cert, _ = _cached_certs(path, days=1, min_days=0)
+    data = cert.read_bytes()
+
+    # A certificate valid for less than min_days is replaced
+    regenerated, _ = _cached_certs(path, days=1, min_days=2)
+    assert regenerated == cert
+    assert regenerated.read_bytes() != data
+
+
+def test_cached_certs_corrupt(tmp_path_factory: TempPathFactory) -> None:
+    from smtpdfix.certs import _cached_certs
+    path = tmp_path_factory.mktemp("cache")
+    cert, _ = _cached_certs(path)
+    cert.write_bytes(b"rubbish")
+
+    regenerated, _ = _cached_certs(path)
+    assert b"PRIVATE KEY" in regenerated.read_bytes()
+
+
+def test_file_lock_stale(tmp_path_factory: TempPathFactory) -> None:
+    import os
+
+    from smtpdfix.certs import _FileLock
+    lock_path = tmp_path_factory.mktemp("lock").joinpath(".lock")
+    lock_path.touch()
+    os.utime(lock_path, (0, 0))
+
+    with _FileLock(lock_path):
+        assert lock_path.is_file()
+    assert not lock_path.exists()
+
+
+def test_file_lock_timeout(tmp_path_factory: TempPathFactory) -> None:
+    from pytest import raises
+
+    from smtpdfix.certs import _FileLock
+    lock_path = tmp_path_factory.mktemp("lock").joinpath(".lock")
+    with _FileLock(lock_path):
+        with raises(TimeoutError):
+            with _FileLock(lock_path, timeout=0.1):
+                pass  # pragma: no cover
+
+
+def test_file_lock_removed(monkeypatch: MonkeyPatch,
+                           tmp_path_factory: TempPathFactory) -> None:
+    # The lock may be released between failing to create it and reading its
+    # age, in which case taking it is tried again.
+    import os
+
+    from smtpdfix.certs import _FileLock
+    lock_path = tmp_path_factory.mktemp("lock").joinpath(".lock")
+    os_open = os.open
+    attempts = []
+
+    def open_once_taken(*args: Any) -> int:
+        attempts.append(args)
+        if len(attempts) == 1:
+            raise FileExistsError()
+        return os_open(*args)
+    monkeypatch.setattr("os.open", open_once_taken)
+
+    with _FileLock(lock_path):
+        assert lock_path.is_file()
+    assert len(attempts) == 2
+
+
+def test_default_certs_no_cache(monkeypatch: MonkeyPatch,
+                                tmp_path_factory: TempPathFactory) -> None:
+    import os
+    from types import SimpleNamespace
+
+    from smtpdfix.configuration import Config
+    from smtpdfix.fixture import _default_certs
+    monkeypatch.delenv("SMTPD_SSL_CERTIFICATE_FILE", raising=False)
+    monkeypatch.setattr("smtpdfix.fixture._generated_certs", {})
+    config = Config()
+    pytestconfig: Any = SimpleNamespace()
+
+    _default_certs(config, pytestconfig, tmp_path_factory)
+    cert = Path(os.environ["SMTPD_SSL_CERTIFICATE_FILE"])
+    assert config.ssl_cert_files == (str(cert), None)
+    assert cert.is_file()
+    assert cert.parent.parent == tmp_path_factory.getbasetemp()
+
+
+def test_default_certs_makedir(monkeypatch: MonkeyPatch,
+                               tmp_path_factory: TempPathFactory) -> None:
+    # Before pytest 7 the cache only had makedir
+    import os
+    from types import SimpleNamespace
+
+    from smtpdfix.configuration import Config
+    from smtpdfix.fixture import _default_certs
+    monkeypatch.delenv("SMTPD_SSL_CERTIFICATE_FILE", raising=False)
+    monkeypatch.setattr("smtpdfix.fixture._generated_certs", {})
+    path = tmp_path_factory.mktemp("cache")
+    config = Config()
+    pytestconfig: Any = SimpleNamespace(
+        cache=SimpleNamespace(makedir=path.joinpath))
+
+    _default_certs(config, pytestconfig, tmp_path_factory)
+    cert = Path(os.environ["SMTPD_SSL_CERTIFICATE_FILE"])
+    assert config.ssl_cert_files == (str(cert), None)
+    assert path.joinpath("smtpdfix") in cert.parents
+
+
+def test_default_certs_key_type(monkeypatch: MonkeyPatch,
+                                tmp_path_factory: TempPathFactory) -> None:
+    from types import SimpleNamespace
+
+    from smtpdfix.certs import _generate_certs
+    from smtpdfix.configuration import Config
+    from smtpdfix.fixture import _default_certs
+    monkeypatch.delenv("SMTPD_SSL_CERTIFICATE_FILE", raising=False)
+    monkeypatch.setattr("smtpdfix.fixture._generated_certs", {})
+    pytestconfig: Any = SimpleNamespace()
+
+    def default_cert(key_type: str) -> Any:
+        config = Config()
+        config.cert_key_type = key_type
+        _default_certs(config, pytestconfig, tmp_path_factory)
+        return config.ssl_cert_files[0]
+
+    # Each key type has a certificate of its own, generated once
+    ec = default_cert("ec")
+    ed25519 = default_cert("ed25519")
+    assert ec != ed25519
+    assert default_cert("ec") == ec
+
+    # A certificate set by the user is kept whatever the key type
+    cert, _ = _generate_certs(tmp_path_factory.mktemp("certs"),
+                              key_type="ec")
+    monkeypatch.setenv("SMTPD_SSL_CERTIFICATE_FILE", str(cert))
+    assert default_cert("ec") == str(cert)
+
+
+@pytest.mark.parametrize("key_type", ["rsa", "ec", "ed25519"])
+def test_key_types(key_type: str,
+                   tmp_path_factory: TempPathFactory,
+                   msg: EmailMessage) -> None:
+    from smtpdfix import Config
+    from smtpdfix.certs import _generate_certs
+    path = tmp_path_factory.mktemp("certs")
+    cert, _ = _generate_certs(path, key_type=key_type)
+
+    config = Config()
+    config.ssl_cert_files = str(cert)
+    config.use_starttls = True
+    with SMTPDFix(config=config) as server:
+        with SMTP(server.hostname, server.port) as client:
+            client.starttls()
+            client.send_message(msg)
+        assert len(server.messages) == 1
+
+
+def test_unsupported_key_type(tmp_path_factory: TempPathFactory) -> None:
+    from smtpdfix.certs import _generate_certs
+    path = tmp_path_factory.mktemp("certs")
+    with pytest.raises(ValueError):
+        _generate_certs(path, key_type="dsa")
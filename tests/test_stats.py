@@ -0,0 +1,84 @@
+import math
+from email.message import EmailMessage
+from smtplib import SMTP, SMTP_SSL, SMTPAuthenticationError
+
+import pytest
+
+from smtpdfix.controller import AuthController
+from smtpdfix.stats import BUCKETS, Histogram, ServerStats
+from tests.conftest import User
+
+
+def test_histogram() -> None:
+    histogram = Histogram()
+    assert histogram.percentile(50) == 0.0
+    assert histogram.mean == 0.0
+
+    for seconds in (0.0003, 0.0004, 0.002, 20.0):
+        histogram.record(seconds)
+    assert histogram.count == 4
+    assert histogram.percentile(50) == 0.0005
+    assert histogram.percentile(75) == 0.0025
+    assert histogram.percentile(100) == math.inf
+    assert len(histogram.as_dict()["buckets"]) == len(BUCKETS) + 1
+
+
+def test_stats_reset() -> None:
+    stats = ServerStats()
+    stats.connections = 1
+    stats.record_command("EHLO", 0.001)
+    stats.reset()
+    assert stats.connections == 0
+    assert stats.commands == {}
+
+
+def test_repr() -> None:
+    stats = ServerStats()
+    stats.connections = 2
+    stats.record_command("NOOP", 0.002)
+    stats.record_command("EHLO", 0.001)
+    assert repr(stats) == ("ServerStats(connections=2, bytes_received=0, "
+                           "commands=['EHLO', 'NOOP'])")
+    assert repr(stats.commands["EHLO"]) == \
+        "Histogram(count=1, mean=0.001000)"
+
+
+def test_server_stats(smtpd: AuthController,
+                      user: User,
+                      msg: EmailMessage) -> None:
+    smtpd.config.use_starttls = True
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.starttls()
+        with pytest.raises(SMTPAuthenticationError):
+            client.login(user.username, "wrong")
+        client.login(user.username, user.password)
+        client.send_message(msg)
+
+    stats = smtpd.stats
+    assert stats.connections == 1
+    assert stats.bytes_received > len(msg.as_bytes())
+    assert stats.handshake.count == 1
+    assert stats.auth_success == 1
+    # smtplib tries each mechanism offered before giving up
+    assert stats.auth_failure >= 1
+    for command in ("EHLO", "STARTTLS", "AUTH", "MAIL", "RCPT", "DATA"):
+        assert stats.commands[command].count >= 1
+    assert stats.handlers["DATA"].count == 1
+    assert stats.as_dict()["connections"] == 1
+
+    stats.reset()
+    assert stats.connections == 0
+
+
+def test_server_stats_implicit_tls(smtpd: AuthController) -> None:
+    smtpd.config.use_ssl = True
+    with SMTP_SSL(smtpd.hostname, smtpd.port) as client:
+        client.noop()
+    assert smtpd.stats.handshake.count >= 1
+
+
+def test_help_with_stats(smtpd: AuthController) -> None:
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        code, resp = client.docmd("HELP", "MAIL")
+    assert code == 250
+    assert resp.startswith(b"Syntax: MAIL")
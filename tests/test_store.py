@@ -0,0 +1,323 @@
+import hashlib
+import threading
+from email.message import EmailMessage
+from smtplib import SMTP
+
+import pytest
+
+from smtpdfix.controller import AuthController
+from smtpdfix.fixture import SMTPDFix
+from smtpdfix.records import MessageRecord
+from smtpdfix.store import MessageStore, SinkStore, SpoolStore, _Spool
+from tests.conftest import User, make_record
+
+
+def test_message_store() -> None:
+    store = MessageStore()
+    record = make_record(b"Foo")
+    store.append(record)
+    assert len(store) == 1
+    assert store[0] is record
+    assert list(store) == [record]
+    assert store.copy() == [record]
+
+    store.clear()
+    assert len(store) == 0
+
+
+def test_spool_store() -> None:
+    store = SpoolStore(max_memory=5)
+    store.append(make_record(b"Foo"))
+    store.append(make_record(b"Bar bar"))
+    store.append(make_record(b""))
+    store.append(make_record(b"Baz"))
+
+    assert store.memory_size == 3
+    assert store.spool_size == 10
+    assert [r.content for r in store] == [b"Foo", b"Bar bar", b"", b"Baz"]
+    assert store[1]._content is None
+    assert store[1].size == 7
+
+    # The spool is remapped after it grows
+    store.append(make_record(b"Qux"))
+    assert store[4].content == b"Qux"
+
+
+def test_spool_store_index_in_memory() -> None:
+    store = SpoolStore(max_memory=0)
+    store.append(make_record(b"Subject: Foo\r\n\r\n" + b"x" * 1024))
+    # The headers were indexed without reading the content back from the spool
+    assert store._spool._map is None
+    assert store.find(subject="Foo") == [store[0]]
+
+
+def test_spool_empty() -> None:
+    # An empty file can't be mapped so nothing is read for empty content
+    spool = _Spool()
+    assert spool.read(0, 0) == b""
+    assert spool._map is None
+
+
+def test_spool_store_from_message(msg: EmailMessage) -> None:
+    msg["X-Peer"] = "('127.0.0.1', 1025)"
+    store = SpoolStore(max_memory=0)
+    store.append(MessageRecord.from_message(msg))
+    record = store[0]
+    assert record._message is None
+
+    message = record.message
+    assert message is not msg
+    assert message.get_all("X-Peer") == ["('127.0.0.1', 1025)"]
+    assert message["Subject"] == msg["Subject"]
+
+
+def test_spool_store_clear() -> None:
+    store = SpoolStore(max_memory=0)
+    store.append(make_record(b"Foo"))
+    record = store[0]
+    store.clear()
+    store.append(make_record(b"Bar"))
+
+    assert record.content == b"Foo"
+    assert store[0].content == b"Bar"
+    assert store.spool_size == 3
+
+
+def test_spooled_messages(smtpd: AuthController, msg: EmailMessage) -> None:
+    smtpd.config.update(message_store="spool", spool_max_memory=0)
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.send_message(msg)
+        client.send_message(msg)
+
+    assert isinstance(smtpd.store, SpoolStore)
+    assert smtpd.store.memory_size == 0
+    assert [m["Subject"] for m in smtpd.messages] == ["Foo", "Foo"]
+    # The spooled messages are parsed again rather than kept in memory
+    assert all(record._message is None for record in smtpd.records)
+
+
+def test_change_store(smtpd: AuthController, msg: EmailMessage) -> None:
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.send_message(msg)
+        smtpd.config.update(message_store="spool", spool_max_memory=0)
+        client.send_message(msg)
+
+    assert isinstance(smtpd.store, SpoolStore)
+    assert smtpd.store.spool_size == 2 * smtpd.records[0].size
+    assert len(smtpd.messages) == 2
+
+
+def test_change_store_custom_handler(request: pytest.FixtureRequest) -> None:
+    from aiosmtpd.handlers import Sink
+
+    server = AuthController(handler=Sink())
+    request.addfinalizer(server.stop)
+    server.start()
+    server.config.message_store = "spool"
+    assert isinstance(server.store, SpoolStore)
+
+
+def indexed_store() -> MessageStore:
+    store = MessageStore()
+    for n, (to, subject) in enumerate([("a@example.org", "Foo"),
+                                       ("B@example.org", "Bar"),
+                                       ("a@example.org", "Bar")]):
+        content = (f"Subject: {subject}\r\n"
+                   f"Message-ID: <{n}@example.org>\r\n\r\n"
+                   f"Body\r\n").encode()
+        store.append(MessageRecord(content=content,
+                                   mail_from="from.addr@example.org",
+                                   rcpt_tos=[to],
+                                   auth_user="user" if n else None))
+    return store
+
+
+def test_find() -> None:
+    store = indexed_store()
+    assert [r.rcpt_tos for r in store.find(to="A@example.org")] == \
+        [["a@example.org"], ["a@example.org"]]
+    assert len(store.find(to="b@example.org", subject="Bar")) == 1
+    assert len(store.find(to="a@example.org", subject="Bar")) == 1
+    assert len(store.find(sender="from.addr@example.org")) == 3
+    assert len(store.find(auth_user="user")) == 2
+    assert store.find(to="c@example.org", subject="Foo") == []
+    assert len(store.find()) == 3
+
+
+def test_find_unknown_criterion() -> None:
+    store = indexed_store()
+    with pytest.raises(TypeError):
+        store.find(rubbish="Foo")
+
+
+def test_get() -> None:
+    store = indexed_store()
+    record = store.get(" <1@example.org> ")
+    assert record is not None
+    assert record.rcpt_tos == ["B@example.org"]
+    assert store.get("<9@example.org>") is None
+
+    store.clear()
+    assert store.get("<1@example.org>") is None
+
+
+def test_find_message_id() -> None:
+    # The Message-ID is matched by find() in the same way as by get()
+    store = indexed_store()
+    assert store.find(message_id=" <1@example.org> ") == \
+        [store.get(" <1@example.org> ")]
+    assert len(store.find(message_id="<2@example.org>\n",
+                          subject=" Bar ")) == 1
+
+
+def test_encoded_subject() -> None:
+    store = MessageStore()
+    store.append(MessageRecord(b"Subject: =?utf-8?q?H=C3=A9llo?=\n\nBody"))
+    store.append(MessageRecord(b"Subject: =?rubbish?q?Foo?="))
+    assert len(store.find(subject="Héllo")) == 1
+    assert len(store.find(subject="=?rubbish?q?Foo?=")) == 1
+
+
+def test_find_messages(smtpd: AuthController,
+                       user: User,
+                       msg: EmailMessage) -> None:
+    smtpd.config.auth_require_tls = False
+    msg["Message-ID"] = "<foo@example.org>"
+    with SMTP(smtpd.hostname, smtpd.port) as client:
+        client.login(user.username, user.password)
+        client.send_message(msg)
+
+    found, = smtpd.find(to="to.addr@example.org", auth_user=user.username)
+    assert found["Subject"] == "Foo"
+    message = smtpd.get("<foo@example.org>")
+    assert message is not None and message["Subject"] == "Foo"
+    found, = smtpd.find(message_id=" <foo@example.org> ")
+    assert found["Subject"] == "Foo"
+    assert smtpd.get("<bar@example.org>") is None
+
+
+def test_wait_for() -> None:
+    store = MessageStore()
+    records = [make_record(b"Foo"), make_record(b"Bar")]
+    timer = threading.Timer(0.1, lambda: [store.append(r) for r in records])
+    timer.start()
+    assert store.wait_for(count=2, timeout=5) == records
+    timer.join()
+
+
+def test_wait_for_predicate() -> None:
+    store = MessageStore()
+    store.append(make_record(b"Foo"))
+    bar = make_record(b"Bar")
+    timer = threading.Timer(0.1, store.append, args=(bar,))
+    timer.start()
+    assert store.wait_for(predicate=lambda r: r.content == b"Bar",
+                          timeout=5) == [bar]
+    timer.join()
+
+
+def test_wait_for_timeout() -> None:
+    store = MessageStore()
+    store.append(make_record(b"Foo"))
+    with pytest.raises(TimeoutError):
+        store.wait_for(count=2, timeout=0.1)
+
+
+def test_wait_for_cleared() -> None:
+    store = MessageStore()
+    store.append(make_record(b"Foo"))
+    records = [make_record(b"Bar"), make_record(b"Baz")]
+
+    def clear_and_append() -> None:
+        store.clear()
+        for record in records:
+            store.append(record)
+
+    timer = threading.Timer(0.1, clear_and_append)
+    timer.start()
+    assert store.wait_for(count=2, timeout=5) == records
+    timer.join()
+
+
+@pytest.mark.asyncio
+async def test_wait_for_async() -> None:
+    store = MessageStore()
+    record = make_record(b"Foo")
+    timer = threading.Timer(0.1, store.append, args=(record,))
+    timer.start()
+    assert await store.wait_for_async(timeout=5) == [record]
+    timer.join()
+
+    with pytest.raises(TimeoutError):
+        await store.wait_for_async(count=2, timeout=0.1)
+
+
+@pytest.mark.asyncio
+async def test_wait_for_async_cleared() -> None:
+    store = MessageStore()
+    store.append(make_record(b"Foo"))
+    records = [make_record(b"Bar"), make_record(b"Baz")]
+
+    def clear_and_append() -> None:
+        store.clear()
+        for record in records:
+            store.append(record)
+
+    timer = threading.Timer(0.1, clear_and_append)
+    timer.start()
+    assert await store.wait_for_async(count=2, timeout=5) == records
+    timer.join()
+
+
+def test_controller_wait_for(smtpd: AuthController,
+                             msg: EmailMessage) -> None:
+    def send() -> None:
+        with SMTP(smtpd.hostname, smtpd.port) as client:
+            client.send_message(msg)
+
+    timer = threading.Timer(0.1, send)
+    timer.start()
+    message, = smtpd.wait_for(predicate=lambda m: m["Subject"] == "Foo")
+    assert message["Subject"] == "Foo"
+    timer.join()
+
+
+def test_sink_store() -> None:
+    store = SinkStore(digest="sha256")
+    store.append(make_record(b"Foo"))
+    store.append(make_record(b"Bar"))
+    assert len(store) == store.count == 2
+    assert store.total_bytes == 6
+    assert store.copy() == []
+    assert store.find(to="to.addr@example.org") == []
+    assert store.digest == hashlib.sha256(b"FooBar").hexdigest()
+    assert store.wait_for(count=2, timeout=1) == []
+    with pytest.raises(TypeError):
+        store.wait_for(predicate=lambda r: True)
+    with pytest.raises(TimeoutError):
+        store.wait_for(count=3, timeout=0.1)
+
+    store.clear()
+    assert (store.count, store.total_bytes) == (0, 0)
+    assert store.digest == hashlib.sha256().hexdigest()
+    assert SinkStore().digest is None
+
+
+@pytest.mark.asyncio
+async def test_sink_store_wait_for_async() -> None:
+    store = SinkStore()
+    timer = threading.Timer(0.1, store.append, args=(make_record(b"Foo"),))
+    timer.start()
+    assert await store.wait_for_async(timeout=5) == []
+    timer.join()
+
+
+def test_sink(msg: EmailMessage) -> None:
+    with SMTPDFix(message_store="sink") as smtpd:
+        with SMTP(smtpd.hostname, smtpd.port) as client:
+            client.send_message(msg)
+            client.send_message(msg)
+
+        assert isinstance(smtpd.store, SinkStore)
+        assert len(smtpd.store) == 2
+        assert smtpd.messages == []
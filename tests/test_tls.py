@@ -0,0 +1,135 @@
+import os
+import ssl
+from pathlib import Path
+from smtplib import SMTP, SMTP_SSL
+from unittest.mock import Mock, patch
+
+import pytest
+from pytest import TempPathFactory
+
+from benchmarks.suite import _client_context, _ResumingContext
+from smtpdfix.certs import _generate_certs
+from smtpdfix.controller import AuthController
+from smtpdfix.tls import SSLContextCache, _set_session_tickets
+
+
+@pytest.fixture(scope="module")
+def cert_path(tmp_path_factory: TempPathFactory) -> Path:
+    path = tmp_path_factory.mktemp("certs")
+    cert, _ = _generate_certs(path)
+    return Path(cert)
+
+
+def test_cache_hit(cert_path: Path) -> None:
+    cache = SSLContextCache()
+    context = cache.get(str(cert_path))
+    assert cache.get(str(cert_path)) is context
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_cache_clear(cert_path: Path) -> None:
+    cache = SSLContextCache()
+    context = cache.get(str(cert_path))
+    cache.clear()
+    assert cache.get(str(cert_path)) is not context
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_cache_modified_file(cert_path: Path) -> None:
+    cache = SSLContextCache()
+    context = cache.get(str(cert_path))
+    stat = cert_path.stat()
+    optional = cache.get(str(cert_path), verify_mode=ssl.CERT_OPTIONAL)
+    os.utime(cert_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get(str(cert_path)) is not context
+    # The contexts for the earlier version of the file are discarded
+    assert list(cache._contexts.values()) == [cache.get(str(cert_path))]
+    assert cache.get(str(cert_path), verify_mode=ssl.CERT_OPTIONAL) \
+        is not optional
+    assert len(cache._contexts) == 2
+
+
+def test_cache_verify_mode(cert_path: Path) -> None:
+    cache = SSLContextCache()
+    context = cache.get(str(cert_path))
+    optional = cache.get(str(cert_path), verify_mode=ssl.CERT_OPTIONAL)
+    assert optional is not context
+    assert (context.verify_mode, optional.verify_mode) == \
+        (ssl.CERT_NONE, ssl.CERT_OPTIONAL)
+
+
+def test_reset_counters(cert_path: Path) -> None:
+    cache = SSLContextCache()
+    cache.get(str(cert_path))
+    cache.reset_counters()
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+@pytest.mark.parametrize("cert_file", [None, "rubbish.pem", "."])
+def test_missing_file(cert_file: str) -> None:
+    cache = SSLContextCache()
+    with pytest.raises(FileNotFoundError):
+        cache.get(cert_file)
+
+
+def test_session_tickets(cert_path: Path) -> None:
+    cache = SSLContextCache()
+    context = cache.get(str(cert_path), session_tickets=0)
+    assert context.options & ssl.OP_NO_TICKET
+    assert getattr(context, "num_tickets", 0) == 0
+
+    assert cache.get(str(cert_path), session_tickets=4) is context
+    assert not context.options & ssl.OP_NO_TICKET
+    assert getattr(context, "num_tickets", 4) == 4
+
+    # The shared context is only changed when the number of tickets is
+    with patch("smtpdfix.tls._set_session_tickets") as mock_set:
+        assert cache.get(str(cert_path), session_tickets=4) is context
+    mock_set.assert_not_called()
+
+
+def test_session_tickets_unsupported() -> None:
+    # num_tickets isn't available with every implementation of the ssl module
+    context = Mock(spec=["options"], options=ssl.Options(0))
+    _set_session_tickets(context, 0)
+    assert context.options & ssl.OP_NO_TICKET
+    assert not hasattr(context, "num_tickets")
+
+
+@pytest.mark.parametrize("mode", ["ssl", "starttls"])
+def test_session_resumption(smtpd: AuthController, mode: str) -> None:
+    smtpd.config.update(use_ssl=mode == "ssl",
+                        use_starttls=mode == "starttls")
+    context = _ResumingContext(_client_context())
+    resumed = []
+    for _ in range(3):
+        client: SMTP
+        if mode == "ssl":
+            client = SMTP_SSL(smtpd.hostname, smtpd.port,
+                              context=context)  # type: ignore
+        else:
+            client = SMTP(smtpd.hostname, smtpd.port)
+            client.starttls(context=context)  # type: ignore
+        # TLS 1.3 tickets are sent after the handshake so are only received
+        # once the client reads a response.
+        client.noop()
+        resumed.append(client.sock.session_reused)
+        context.session = client.sock.session
+        client.quit()
+        # Changing the config doesn't discard the context and its sessions
+        smtpd.config.enforce_auth = not smtpd.config.enforce_auth
+
+    assert resumed == [False, True, True]
+    assert (smtpd.stats.tls_full, smtpd.stats.tls_resumed) == (1, 2)
+
+
+def test_session_resumption_no_tickets(smtpd: AuthController) -> None:
+    smtpd.config.update(use_ssl=True, tls_session_tickets=0)
+    context = _ResumingContext(_client_context())
+    for _ in range(2):
+        with SMTP_SSL(smtpd.hostname, smtpd.port,
+                      context=context) as client:  # type: ignore
+            client.noop()
+            context.session = client.sock.session
+    # TLS 1.3 sessions can only be resumed with tickets
+    assert smtpd.stats.tls_resumed == 0
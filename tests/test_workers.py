@@ -0,0 +1,129 @@
+import mailbox
+import queue
+import socket
+import threading
+from email.message import EmailMessage
+from pathlib import Path
+from smtplib import SMTP
+
+import pytest
+from pytest import FixtureRequest
+
+from smtpdfix.configuration import Config
+from smtpdfix.fixture import _Authenticator
+from smtpdfix.records import MessageRecord
+from smtpdfix.workers import WorkerController, _serve
+from tests.conftest import User
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "SO_REUSEPORT"),
+                                reason="SO_REUSEPORT is not supported")
+
+
+def test_workers(request: FixtureRequest, msg: EmailMessage) -> None:
+    config = Config()
+    server = WorkerController(workers=2,
+                              config=config,
+                              authenticator=_Authenticator(config))
+    request.addfinalizer(server.stop)
+    server.start()
+    assert server.port != 0
+
+    for _ in range(6):
+        with SMTP(server.hostname, server.port) as client:
+            client.send_message(msg)
+
+    assert len(server.wait_for(count=6)) == 6
+    assert server.messages[0]["Subject"] == msg["Subject"]
+
+
+def test_workers_export(msg: EmailMessage, tmp_path: Path) -> None:
+    path = tmp_path.joinpath("messages.mbox")
+    config = Config()
+    config.export_path = path
+    server = WorkerController(workers=2, config=config)
+    server.start()
+
+    for _ in range(4):
+        with SMTP(server.hostname, server.port) as client:
+            client.send_message(msg)
+    server.wait_for(count=4)
+    server.stop()
+
+    assert len(mailbox.mbox(str(path))) == 4
+
+
+def test_workers_login(msg: EmailMessage, user: User) -> None:
+    # The login set by the config is accepted, as it is by SMTPDFix
+    config = Config()
+    config.update(enforce_auth=True, auth_require_tls=False)
+    server = WorkerController(workers=1, config=config)
+    server.start()
+    try:
+        with SMTP(server.hostname, server.port) as client:
+            client.login(user.username, user.password)
+            client.send_message(msg)
+        assert len(server.wait_for(count=1)) == 1
+    finally:
+        server.stop()
+
+
+def test_serve(msg: EmailMessage) -> None:
+    # The worker is run on a thread so that it's covered
+    config = Config()
+    records: "queue.Queue[MessageRecord]" = queue.Queue()
+    status: "queue.Queue[Exception]" = queue.Queue()
+    stop = threading.Event()
+    worker = threading.Thread(target=_serve,
+                              args=(config, None, records, status, stop))
+    worker.start()
+    try:
+        assert status.get(timeout=5) is None
+        with SMTP(config.host, config.port) as client:
+            client.send_message(msg)
+        assert records.get(timeout=5).message["Subject"] == msg["Subject"]
+    finally:
+        stop.set()
+        worker.join()
+
+
+def test_serve_error() -> None:
+    config = Config()
+    config.host = "256.0.0.1"
+    status: "queue.Queue[Exception]" = queue.Queue()
+    _serve(config, None, queue.Queue(), status, threading.Event())
+    assert isinstance(status.get_nowait(), OSError)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_workers_port(msg: EmailMessage) -> None:
+    port = _free_port()
+    server = WorkerController(workers=1, hostname="127.0.0.1", port=port)
+    server.start()
+    try:
+        assert (server.hostname, server.port) == ("127.0.0.1", port)
+        with SMTP(server.hostname, server.port) as client:
+            client.send_message(msg)
+        server.wait_for(count=1)
+    finally:
+        server.stop()
+
+
+def test_workers_error() -> None:
+    server = WorkerController(workers=1,
+                              hostname="256.0.0.1",
+                              port=_free_port())
+    with pytest.raises(OSError):
+        server.start()
+
+
+def test_workers_timeout() -> None:
+    config = Config()
+    config.ready_timeout = 0.001
+    server = WorkerController(workers=1, config=config)
+    with pytest.raises(TimeoutError):
+        server.start()